@@ -0,0 +1,80 @@
+"""Coverage-driven sampling of corpus chunks for question generation"""
+import random
+
+from packing import count_tokens
+
+TOKENS_PER_QUESTION = 350
+MIN_SAMPLE_TOKENS = 2500
+MAX_SAMPLE_TOKENS = 12000
+
+
+def sample_budget(num_questions):
+    """Material tokens to send for a request of num_questions questions"""
+    return max(MIN_SAMPLE_TOKENS, min(MAX_SAMPLE_TOKENS, num_questions * TOKENS_PER_QUESTION))
+
+
+class CoverageTracker:
+    """How often each chunk of one corpus has been used for generation.
+
+    sample() always prefers the least-used chunks, so successive requests
+    walk through the whole material before any passage is reused. Ties are
+    broken randomly while files take turns, so one sample spans several
+    files rather than a single long one.
+    """
+
+    def __init__(self, chunks, seed=None):
+        self.chunks = chunks
+        self.uses = [0] * len(chunks)
+        self.samples = 0
+        self._random = random.Random(seed)
+
+    def _order(self):
+        by_file = {}
+        for chunk_id in range(len(self.chunks)):
+            by_file.setdefault(int(self.chunks.files[chunk_id]), []).append(chunk_id)
+        queues = list(by_file.values())
+        self._random.shuffle(queues)
+        for queue in queues:
+            self._random.shuffle(queue)
+            queue.sort(key=lambda chunk_id: self.uses[chunk_id])
+        interleaved = []
+        for rank in range(max((len(queue) for queue in queues), default=0)):
+            interleaved.extend(queue[rank] for queue in queues if rank < len(queue))
+        return sorted(interleaved, key=lambda chunk_id: self.uses[chunk_id])
+
+    def sample(self, max_tokens):
+        """Least-used chunk ids that fit max_tokens, in document order; marks them used"""
+        selected = []
+        used = 0
+        skipped_uses = None
+        for chunk_id in self._order():
+            if skipped_uses is not None and self.uses[chunk_id] > skipped_uses:
+                # Don't fill the gap with reused chunks while less-used ones didn't fit
+                break
+            cost = count_tokens(self.chunks.text(chunk_id))
+            if used + cost > max_tokens:
+                if selected:
+                    if skipped_uses is None:
+                        skipped_uses = self.uses[chunk_id]
+                    continue
+            selected.append(chunk_id)
+            used += cost
+        for chunk_id in selected:
+            self.uses[chunk_id] += 1
+        self.samples += 1
+        return sorted(selected, key=lambda chunk_id: self.chunks.starts[chunk_id])
+
+    def coverage(self):
+        """Share of chunks used at least once"""
+        if not self.uses:
+            return 0.0
+        return sum(1 for uses in self.uses if uses) / len(self.uses)
+
+    @property
+    def passes(self):
+        """Complete passes over the material so far"""
+        return min(self.uses, default=0)
+
+    def reset(self):
+        self.uses = [0] * len(self.chunks)
+        self.samples = 0
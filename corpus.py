@@ -0,0 +1,333 @@
+"""Loaded study material with a file/page offset index, and its on-disk store"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+
+from dedup import dedup_records, new_dedup_report
+from ingest import CACHE_DIR, file_banner, iter_records, pick_cheapest_sources
+from pdf_backends import active_pdf_backend
+
+DEFAULT_STORE_PATH = CACHE_DIR / "corpus_store.sqlite3"
+
+# Array slots in serialisation order
+_ARRAY_SLOTS = (
+    'file_starts', 'file_ends', 'file_words', 'file_pages', 'file_first_page',
+    'page_starts', 'page_ends', 'page_files', 'page_numbers',
+)
+
+
+class Corpus:
+    """Combined document text plus array-backed file and page boundaries.
+
+    text is exactly what the prompt builders see (files separated by the
+    FILE banner). Every file and page is addressed by (start, end) offsets
+    into text, so lookups are a binary search and slicing only copies when
+    the caller asks for the string.
+    """
+
+    __slots__ = (
+        'text', 'names', 'paths', 'file_starts', 'file_ends', 'file_words',
+        'file_pages', 'file_first_page', 'page_starts', 'page_ends', 'page_files', 'page_numbers',
+        'word_count',
+    )
+
+    def __init__(self):
+        self.text = ""
+        self.names = []
+        self.paths = []
+        self.file_starts = array('Q')
+        self.file_ends = array('Q')
+        self.file_words = array('Q')
+        self.file_pages = array('I')
+        self.file_first_page = array('I')
+        self.page_starts = array('Q')
+        self.page_ends = array('Q')
+        self.page_files = array('I')
+        self.page_numbers = array('I')
+        self.word_count = 0
+
+    @classmethod
+    def from_records(cls, records, banner=file_banner):
+        """Build a corpus from (file_path, page_no, text) records with one join.
+
+        Files that produce no text are dropped.
+        banner=None concatenates files without separators (single-file mode).
+        """
+        corpus = cls()
+        parts = []
+        offset = 0
+        current = None
+        file_parts = []
+        file_pages = []
+
+        def flush():
+            nonlocal offset
+            if current is None or not any(file_parts):
+                return
+            index = len(corpus.names)
+            if banner:
+                separator = banner(current.name)
+                parts.append(separator)
+                offset += len(separator)
+            corpus.names.append(current.name)
+            corpus.paths.append(str(current))
+            corpus.file_starts.append(offset)
+            corpus.file_first_page.append(len(corpus.page_starts))
+            words = 0
+            paged = 0
+            for page_no, text in zip(file_pages, file_parts):
+                corpus.page_starts.append(offset)
+                offset += len(text)
+                corpus.page_ends.append(offset)
+                corpus.page_files.append(index)
+                corpus.page_numbers.append(page_no or 0)
+                words += len(text.split())
+                if page_no is not None:
+                    paged += 1
+            parts.extend(file_parts)
+            corpus.file_ends.append(offset)
+            corpus.file_words.append(words)
+            corpus.file_pages.append(paged)
+            corpus.word_count += words
+
+        for file_path, page_no, text in records:
+            file_path = Path(file_path)
+            if file_path != current:
+                flush()
+                current, file_parts, file_pages = file_path, [], []
+            file_parts.append(text)
+            file_pages.append(page_no)
+        flush()
+
+        corpus.text = "".join(parts)
+        return corpus
+
+    def __len__(self):
+        return len(self.text)
+
+    def __bool__(self):
+        return bool(self.text)
+
+    @property
+    def file_count(self):
+        return len(self.names)
+
+    @property
+    def page_count(self):
+        return sum(self.file_pages)
+
+    def files_info(self):
+        """Per-file name/pages/words in the loaded_files_info format"""
+        return [
+            {
+                'name': name,
+                'pages': pages if pages else 'N/A',
+                'words': words
+            }
+            for name, pages, words in zip(self.names, self.file_pages, self.file_words)
+        ]
+
+    def page_at(self, offset):
+        """(file index, page number) for a text offset; page is None for unpaged files"""
+        if not self.page_starts:
+            raise IndexError("empty corpus")
+        index = min(bisect_right(self.page_ends, offset), len(self.page_ends) - 1)
+        page_no = self.page_numbers[index]
+        return self.page_files[index], page_no or None
+
+    def file_span(self, index):
+        """(start, end) offsets of a file's text, excluding its banner"""
+        return self.file_starts[index], self.file_ends[index]
+
+    def slice(self, start, end):
+        """Text between two offsets"""
+        return self.text[start:end]
+
+    def file_text(self, index):
+        return self.slice(*self.file_span(index))
+
+    def digest(self):
+        """Content hash of the text, for keying indexes built over this corpus"""
+        return hashlib.sha1(self.text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def iter_records(self):
+        """Yield (file_path, page_no, text) records back out of the corpus"""
+        for page in range(len(self.page_starts)):
+            yield (
+                Path(self.paths[self.page_files[page]]),
+                self.page_numbers[page] or None,
+                self.text[self.page_starts[page]:self.page_ends[page]],
+            )
+
+    def to_blobs(self):
+        """Serialise to (compressed text, JSON metadata, packed index arrays)"""
+        packed = b"".join(getattr(self, slot).tobytes() for slot in _ARRAY_SLOTS)
+        meta = {
+            'names': self.names,
+            'paths': self.paths,
+            'word_count': self.word_count,
+            'lengths': [len(getattr(self, slot)) for slot in _ARRAY_SLOTS],
+        }
+        return zlib.compress(self.text.encode('utf-8'), 1), json.dumps(meta), packed
+
+    @classmethod
+    def from_blobs(cls, text_blob, meta_json, packed):
+        corpus = cls()
+        meta = json.loads(meta_json)
+        corpus.text = zlib.decompress(text_blob).decode('utf-8')
+        corpus.names = meta['names']
+        corpus.paths = meta['paths']
+        corpus.word_count = meta['word_count']
+        view = memoryview(packed)
+        offset = 0
+        for slot, length in zip(_ARRAY_SLOTS, meta['lengths']):
+            values = getattr(corpus, slot)
+            size = length * values.itemsize
+            values.frombytes(view[offset:offset + size])
+            offset += size
+        return corpus
+
+
+def folder_signature(file_paths):
+    """Hash of the name, size and mtime of every file in a folder listing"""
+    digest = hashlib.sha1()
+    for file_path in sorted(str(p) for p in file_paths):
+        stat = os.stat(file_path)
+        digest.update(f"{Path(file_path).name}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def corpus_variant(prefer_fast=True, dedup=True):
+    """Store key for the options that change what an all-files corpus contains"""
+    return f"all|fast={int(bool(prefer_fast))}|dedup={int(bool(dedup))}|pdf={active_pdf_backend()}"
+
+
+def build_folder_corpus(file_paths, cache=None, prefer_fast=True, dedup=True,
+                        parallel=True, on_progress=None, errors=None):
+    """Extract, normalise and index a folder's files into an all-files Corpus.
+
+    Returns (corpus, dedup_report, skipped) where skipped lists slower copies
+    left out by pick_cheapest_sources and dedup_report is None when dedup is off.
+    """
+    skipped = []
+    if prefer_fast:
+        file_paths, skipped = pick_cheapest_sources(file_paths)
+    records = iter_records(
+        file_paths, cache=cache, parallel=parallel,
+        on_progress=on_progress, errors=errors
+    )
+    report = None
+    if dedup:
+        report = new_dedup_report()
+        records = dedup_records(records, report=report)
+    return Corpus.from_records(records), report, skipped
+
+
+class CorpusStore:
+    """SQLite store of prebuilt folder corpora, keyed by folder and variant.
+
+    Each entry remembers the folder_signature it was built from, so a load
+    with the current signature only succeeds while the folder is unchanged.
+    Loaded corpora are kept in memory for the life of the process.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._memory = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS manifests (folder TEXT PRIMARY KEY, entries TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS corpora ("
+                "folder TEXT, variant TEXT, signature TEXT, built_at REAL, "
+                "text BLOB, meta TEXT, arrays BLOB, report TEXT, "
+                "PRIMARY KEY (folder, variant))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save(self, folder, variant, signature, corpus, report=None):
+        text_blob, meta, packed = corpus.to_blobs()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO corpora "
+                "(folder, variant, signature, built_at, text, meta, arrays, report) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(folder), variant, signature, time.time(),
+                 text_blob, meta, packed, json.dumps(report))
+            )
+            self._memory[(str(folder), variant)] = (signature, corpus, report)
+
+    def load(self, folder, variant, signature=None):
+        """Return (corpus, report) if stored (and built from signature, when given)"""
+        key = (str(folder), variant)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT signature, text, meta, arrays, report FROM corpora "
+                        "WHERE folder = ? AND variant = ?", key
+                    ).fetchone()
+                if row is None:
+                    return None
+                entry = (row[0], Corpus.from_blobs(row[1], row[2], row[3]), json.loads(row[4]))
+                self._memory[key] = entry
+        stored_signature, corpus, report = entry
+        if signature is not None and signature != stored_signature:
+            return None
+        return corpus, report
+
+    def update_signature(self, folder, variant, old_signature, new_signature):
+        """Re-key an entry built from old_signature to new_signature; returns True if one was"""
+        key = (str(folder), variant)
+        with self._lock, self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE corpora SET signature = ? WHERE folder = ? AND variant = ? AND signature = ?",
+                (new_signature, *key, old_signature)
+            ).rowcount
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] == old_signature:
+                self._memory[key] = (new_signature, *entry[1:])
+        return bool(updated)
+
+    def warm(self):
+        """Load every stored corpus into memory; returns how many were loaded"""
+        with self._connect() as conn:
+            keys = conn.execute("SELECT folder, variant FROM corpora").fetchall()
+        for folder, variant in keys:
+            self.load(folder, variant)
+        return len(keys)
+
+    def entries(self):
+        """(folder, variant, built_at) for everything in the store"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT folder, variant, built_at FROM corpora ORDER BY folder, variant"
+            ).fetchall()
+
+    def save_manifest(self, folder, entries):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO manifests (folder, entries) VALUES (?, ?)",
+                (str(folder), json.dumps(entries))
+            )
+
+    def load_manifest(self, folder):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT entries FROM manifests WHERE folder = ?", (str(folder),)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
@@ -0,0 +1,158 @@
+"""Near-duplicate file and repeated-section removal for the record stream"""
+import re
+import zlib
+
+import numpy as np
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+DEFAULT_THRESHOLD = 0.8
+MIN_SECTION_WORDS = 8
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240501)
+_PERM_A = _rng.randint(1, _PRIME, size=NUM_PERMUTATIONS).astype(np.uint64)
+_PERM_B = _rng.randint(0, _PRIME, size=NUM_PERMUTATIONS).astype(np.uint64)
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_SECTION_SPLIT_RE = re.compile(r'(\n[ \t]*\n)')
+
+
+def normalized_words(text):
+    return _WORD_RE.findall(text.lower())
+
+
+def shingle_hashes(words, k=SHINGLE_SIZE):
+    """Unique hashes of the k-word shingles of a word list (values < 2**31 - 1)"""
+    if len(words) < k:
+        k = max(len(words), 1)
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    ids = np.fromiter((zlib.crc32(w.encode()) for w in words), dtype=np.uint64, count=len(words))
+    ids %= _PRIME
+    hashes = np.zeros(len(words) - k + 1, dtype=np.uint64)
+    for offset in range(k):
+        hashes = (hashes * np.uint64(1000003) + ids[offset:len(ids) - k + 1 + offset]) % _PRIME
+    return np.unique(hashes)
+
+
+def minhash_signature(hashes, chunk=16384):
+    """MinHash signature of a shingle hash set"""
+    signature = np.full(NUM_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), chunk):
+        block = hashes[start:start + chunk]
+        permuted = (np.outer(_PERM_A, block) + _PERM_B[:, None]) % _PRIME
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature
+
+
+class DocumentFingerprint:
+    """MinHash signature plus shingle count for one document"""
+
+    __slots__ = ('name', 'signature', 'size')
+
+    def __init__(self, name, text):
+        hashes = shingle_hashes(normalized_words(text))
+        self.name = name
+        self.signature = minhash_signature(hashes)
+        self.size = len(hashes)
+
+    def jaccard(self, other):
+        """Estimated Jaccard similarity of the two shingle sets"""
+        if not self.size or not other.size:
+            return 0.0
+        return float(np.mean(self.signature == other.signature))
+
+    def containment_in(self, other):
+        """Estimated share of this document's shingles that also occur in other"""
+        jaccard = self.jaccard(other)
+        if not jaccard:
+            return 0.0
+        intersection = jaccard * (self.size + other.size) / (1 + jaccard)
+        return min(intersection / self.size, 1.0)
+
+
+def estimate_tokens(text):
+    return len(text) // 4
+
+
+def new_dedup_report():
+    return {
+        'duplicate_files': [],
+        'sections_removed': 0,
+        'words_saved': 0,
+        'tokens_saved': 0,
+    }
+
+
+def _section_key(block):
+    words = normalized_words(block)
+    if len(words) < MIN_SECTION_WORDS:
+        return None
+    return zlib.crc32(' '.join(words).encode()), len(words)
+
+
+def dedup_records(records, threshold=DEFAULT_THRESHOLD, report=None):
+    """Drop near-duplicate files and repeated sections from a record stream.
+
+    Records are buffered one file at a time. A file whose shingles are at
+    least `threshold` contained in an earlier kept file is dropped whole;
+    otherwise blank-line separated sections already seen in earlier files
+    are removed. The first copy is always the one kept. Savings are added
+    to report (see new_dedup_report).
+    """
+    if report is None:
+        report = new_dedup_report()
+    kept = []
+    seen_sections = set()
+
+    def process(file_path, file_records):
+        text = "".join(text for _, _, text in file_records)
+        if not text.strip():
+            return []
+        fingerprint = DocumentFingerprint(file_path.name, text)
+        for other in kept:
+            containment = fingerprint.containment_in(other)
+            if containment >= threshold:
+                words = len(text.split())
+                report['duplicate_files'].append({
+                    'name': file_path.name,
+                    'duplicate_of': other.name,
+                    'similarity': containment,
+                    'words': words,
+                })
+                report['words_saved'] += words
+                report['tokens_saved'] += estimate_tokens(text)
+                return []
+        kept.append(fingerprint)
+
+        output = []
+        file_sections = set()
+        for path, page_no, page_text in file_records:
+            pieces = _SECTION_SPLIT_RE.split(page_text)
+            parts = []
+            for index in range(0, len(pieces), 2):
+                block = pieces[index]
+                separator = pieces[index + 1] if index + 1 < len(pieces) else ""
+                key = _section_key(block)
+                if key is not None:
+                    if key in seen_sections:
+                        report['sections_removed'] += 1
+                        report['words_saved'] += len(block.split())
+                        report['tokens_saved'] += estimate_tokens(block + separator)
+                        continue
+                    file_sections.add(key)
+                parts.append(block + separator)
+            output.append((path, page_no, "".join(parts)))
+        seen_sections.update(file_sections)
+        return output
+
+    current = None
+    buffered = []
+    for file_path, page_no, text in records:
+        if file_path != current:
+            if current is not None:
+                yield from process(current, buffered)
+            current, buffered = file_path, []
+        buffered.append((file_path, page_no, text))
+    if current is not None:
+        yield from process(current, buffered)
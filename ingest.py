@@ -0,0 +1,580 @@
+"""Document extraction and the on-disk extraction cache"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+import zlib
+from array import array
+from html.parser import HTMLParser
+from xml.etree.ElementTree import iterparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from pdf_backends import active_pdf_backend, get_pdf_backend, iter_pdf_page_texts, set_pdf_backend
+
+CACHE_DIR = Path(__file__).resolve().parent / ".study_cache"
+DEFAULT_CACHE_PATH = CACHE_DIR / "extraction.sqlite3"
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PDF_SELECTION_PATH = CACHE_DIR / "pdf_backend.json"
+
+
+# Extractors are page generators registered by file extension. cost is a
+# rough relative parse cost used to pick between copies of the same document.
+EXTRACTORS = {}
+EXTRACTOR_COSTS = {}
+
+
+def register_extractor(*extensions, cost=1):
+    """Register a (file_path) -> iterator of (page_no, text) extractor"""
+    def decorator(func):
+        for ext in extensions:
+            EXTRACTORS[ext] = func
+            EXTRACTOR_COSTS[ext] = cost
+        return func
+    return decorator
+
+
+def supported_extensions():
+    return list(EXTRACTORS)
+
+
+def is_supported_file(file_path):
+    """True for files with a registered extractor, excluding Office lock files"""
+    file_path = Path(file_path)
+    return file_path.suffix.lower() in EXTRACTORS and not file_path.name.startswith('~$')
+
+
+@register_extractor('.txt', '.md', cost=0)
+def extract_text_pages(file_path):
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        yield None, f.read()
+
+
+@register_extractor('.pdf', cost=10)
+def extract_pdf_pages(file_path):
+    with open(file_path, 'rb') as f:
+        for page_no, text in enumerate(iter_pdf_page_texts(f), 1):
+            yield page_no, (text + "\n") if text else ""
+
+
+class LazyPdf:
+    """A PDF whose pages are extracted only when requested.
+
+    page_count comes from the document catalogue, so opening a large PDF
+    does not parse any page content. No file handle is kept between calls:
+    each page or page range is read by reopening the file, so instances can
+    sit in a cache without holding descriptors. Extracted pages are kept in
+    memory, formatted like extract_pdf_pages (newline-terminated, "" when
+    empty).
+    """
+
+    def __init__(self, file_path, backend=None):
+        self.file_path = Path(file_path)
+        self.backend = get_pdf_backend(backend)
+        self._lock = threading.Lock()
+        with open(self.file_path, 'rb') as f:
+            self.page_count = self.backend.page_count(self.backend.open(f))
+        self._pages = {}
+
+    def _extract(self, page_nos):
+        """Texts of the given 1-based pages, opening the file once for any not yet extracted"""
+        with self._lock:
+            missing = [page_no for page_no in page_nos if page_no not in self._pages]
+            if missing:
+                with open(self.file_path, 'rb') as f:
+                    reader = self.backend.open(f)
+                    for page_no in missing:
+                        text = self.backend.page_text(reader, page_no - 1)
+                        self._pages[page_no] = (text + "\n") if text else ""
+            return [self._pages[page_no] for page_no in page_nos]
+
+    def page(self, page_no):
+        """Text of a 1-based page"""
+        if not 1 <= page_no <= self.page_count:
+            raise IndexError(f"page {page_no} outside 1-{self.page_count}")
+        return self._extract([page_no])[0]
+
+    def iter_range(self, first_page=1, last_page=None):
+        """Yield (page_no, text) for pages first_page..last_page"""
+        last_page = self.page_count if last_page is None else min(last_page, self.page_count)
+        page_nos = list(range(max(first_page, 1), last_page + 1))
+        yield from zip(page_nos, self._extract(page_nos))
+
+    @property
+    def cached_pages(self):
+        return len(self._pages)
+
+
+def extraction_variant(file_path):
+    """Tag for settings that change a file's extracted text (the PDF backend)"""
+    if Path(file_path).suffix.lower() == '.pdf':
+        return f"pdf:{active_pdf_backend()}"
+    return ""
+
+
+class _HTMLTextParser(HTMLParser):
+    """Collects visible text, dropping script/style and breaking on block tags"""
+
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg'}
+    BLOCK_TAGS = {
+        'p', 'div', 'br', 'li', 'tr', 'table', 'section', 'article', 'header',
+        'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote', 'hr',
+        'title', 'ul', 'ol', 'dt', 'dd',
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag in ('td', 'th'):
+            self.parts.append(" | ")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def take(self):
+        """Return and clear the text collected so far"""
+        text = "".join(self.parts)
+        self.parts = []
+        return text
+
+
+def _tidy_lines(text):
+    lines = (' '.join(line.split()) for line in text.splitlines())
+    return re.sub(r'\n{3,}', '\n\n', "\n".join(lines)).strip()
+
+
+@register_extractor('.html', '.htm', cost=1)
+def extract_html_pages(file_path, block_size=64 * 1024):
+    parser = _HTMLTextParser()
+    parts = []
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            parser.feed(block)
+            parts.append(parser.take())
+    parser.close()
+    parts.append(parser.take())
+    text = _tidy_lines("".join(parts))
+    yield None, (text + "\n") if text else ""
+
+
+def _iter_ooxml_paragraphs(stream, namespace):
+    """Stream paragraph texts out of an Office Open XML part"""
+    paragraph = f'{{{namespace}}}p'
+    text_tag = f'{{{namespace}}}t'
+    tab_tag = f'{{{namespace}}}tab'
+    break_tag = f'{{{namespace}}}br'
+    parts = []
+    for event, elem in iterparse(stream, events=('end',)):
+        if elem.tag == text_tag:
+            parts.append(elem.text or "")
+        elif elem.tag == tab_tag:
+            parts.append("\t")
+        elif elem.tag == break_tag:
+            parts.append("\n")
+        elif elem.tag == paragraph:
+            yield "".join(parts)
+            parts = []
+            elem.clear()
+
+
+WORD_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+DRAWING_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+
+
+@register_extractor('.docx', cost=2)
+def extract_docx_pages(file_path):
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open('word/document.xml') as stream:
+            lines = [line.strip() for line in _iter_ooxml_paragraphs(stream, WORD_NS) if line.strip()]
+    text = "\n".join(lines)
+    yield None, (text + "\n") if text else ""
+
+
+@register_extractor('.pptx', cost=2)
+def extract_pptx_pages(file_path):
+    with zipfile.ZipFile(file_path) as archive:
+        slides = sorted(
+            (int(match.group(1)), name)
+            for name in archive.namelist()
+            for match in [re.fullmatch(r'ppt/slides/slide(\d+)\.xml', name)]
+            if match
+        )
+        for slide_no, name in slides:
+            with archive.open(name) as stream:
+                lines = [line.strip() for line in _iter_ooxml_paragraphs(stream, DRAWING_NS) if line.strip()]
+            text = "\n".join(lines)
+            yield slide_no, (text + "\n") if text else ""
+
+
+def iter_pages(file_path):
+    """Yield (page_no, text) for each page of a file.
+
+    PDF pages and PPTX slides are numbered from 1 and each non-empty page
+    ends with a newline; other formats are yielded as a single record with
+    page_no None.
+    """
+    file_path = Path(file_path)
+    extractor = EXTRACTORS.get(file_path.suffix.lower(), extract_text_pages)
+    yield from extractor(file_path)
+
+
+def list_folders(base_path="."):
+    """Sorted study folders under base_path (hidden and __pycache__-style folders excluded)"""
+    return sorted(
+        str(item) for item in Path(base_path).iterdir()
+        if item.is_dir() and not item.name.startswith(('.', '__'))
+    )
+
+
+def list_folder_files(folder_path):
+    """Sorted supported files directly inside a folder"""
+    folder = Path(folder_path)
+    files = []
+    for ext in supported_extensions():
+        files.extend(f for f in folder.glob(f'*{ext}') if is_supported_file(f))
+    return sorted(files)
+
+
+def sample_pdfs(folders, limit=3):
+    """The first PDF of up to `limit` folders, for benchmarking"""
+    samples = []
+    for folder in folders:
+        pdfs = sorted(Path(folder).glob('*.pdf'))
+        if pdfs:
+            samples.append(pdfs[0])
+        if len(samples) >= limit:
+            break
+    return samples
+
+
+def pick_cheapest_sources(file_paths):
+    """Keep one file per document name, preferring the cheapest format to parse.
+
+    Files are grouped by case-insensitive stem (e.g. rman_guide.html and
+    rman_guide.pdf); input order is preserved for the files that remain.
+    Returns (kept, skipped).
+    """
+    best = {}
+    for file_path in file_paths:
+        file_path = Path(file_path)
+        key = (str(file_path.parent), file_path.stem.lower())
+        cost = EXTRACTOR_COSTS.get(file_path.suffix.lower(), 0)
+        if key not in best or cost < best[key][0]:
+            best[key] = (cost, file_path)
+    keep = {file_path for _, file_path in best.values()}
+    kept = [Path(p) for p in file_paths if Path(p) in keep]
+    skipped = [Path(p) for p in file_paths if Path(p) not in keep]
+    return kept, skipped
+
+
+def extract_document(file_path):
+    """Extract a file into (content, pages, page_ends) with a single join.
+
+    page_ends holds the end offset of every page in content, so page n is
+    content[page_ends[n - 2] if n > 1 else 0:page_ends[n - 1]]. pages is None
+    for files without pages.
+    """
+    parts = []
+    page_ends = array('Q')
+    offset = 0
+    pages = None
+    for page_no, text in iter_pages(file_path):
+        parts.append(text)
+        offset += len(text)
+        page_ends.append(offset)
+        if page_no is not None:
+            pages = page_no
+    return "".join(parts), pages, page_ends
+
+
+def split_pages(content, pages, page_ends):
+    """Yield (page_no, text) slices of an extracted document"""
+    if not page_ends:
+        yield None, content
+        return
+    start = 0
+    for index, end in enumerate(page_ends):
+        yield (index + 1) if pages is not None else None, content[start:end]
+        start = end
+
+
+def file_digest(file_path, block_size=1024 * 1024):
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Persistent, content-addressed cache of extracted document text.
+
+    Files are looked up by (path, size, mtime); the stored text is keyed by
+    the SHA-256 of the file bytes, so an unchanged file never has to be
+    re-hashed and identical copies share one entry. Entries are evicted in
+    least-recently-used order once the compressed total exceeds max_bytes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS paths ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(entries)")]
+            if columns and 'page_ends' not in columns:
+                conn.execute("DROP TABLE entries")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "digest TEXT PRIMARY KEY, text BLOB, pages INTEGER, page_ends BLOB, "
+                "nbytes INTEGER, last_used REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _entry_key(self, conn, file_path):
+        """Content digest plus the extraction variant the text was produced with"""
+        digest = self._digest_for(conn, file_path)
+        variant = extraction_variant(file_path)
+        return f"{digest}:{variant}" if variant else digest
+
+    def _digest_for(self, conn, file_path):
+        """Return the content digest, re-hashing only when size/mtime changed"""
+        key = str(Path(file_path).resolve())
+        stat = os.stat(file_path)
+        row = conn.execute(
+            "SELECT size, mtime_ns, digest FROM paths WHERE path = ?", (key,)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = file_digest(file_path)
+        conn.execute(
+            "INSERT OR REPLACE INTO paths (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+            (key, stat.st_size, stat.st_mtime_ns, digest)
+        )
+        return digest
+
+    def contains(self, file_path):
+        """Whether a file's text is cached, without loading it (a miss is counted
+        here, a hit when get() loads it)"""
+        with self._lock, self._connect() as conn:
+            digest = self._entry_key(conn, file_path)
+            found = conn.execute("SELECT 1 FROM entries WHERE digest = ?", (digest,)).fetchone() is not None
+            if not found:
+                self.misses += 1
+            return found
+
+    def get(self, file_path):
+        """Return cached (content, pages, page_ends) for a file, or None on a miss"""
+        with self._lock, self._connect() as conn:
+            digest = self._entry_key(conn, file_path)
+            row = conn.execute(
+                "SELECT text, pages, page_ends FROM entries WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE entries SET last_used = ? WHERE digest = ?", (time.time(), digest)
+            )
+            self.hits += 1
+            page_ends = array('Q')
+            page_ends.frombytes(row[2] or b'')
+            return zlib.decompress(row[0]).decode('utf-8'), row[1], page_ends
+
+    def put(self, file_path, content, pages, page_ends=None):
+        """Store extracted content for a file and evict old entries if over the cap"""
+        blob = zlib.compress(content.encode('utf-8'), 1)
+        ends = array('Q', page_ends if page_ends is not None else [len(content)])
+        with self._lock, self._connect() as conn:
+            digest = self._entry_key(conn, file_path)
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (digest, text, pages, page_ends, nbytes, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, blob, pages, ends.tobytes(), len(blob), time.time())
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for digest, nbytes in conn.execute(
+            "SELECT digest, nbytes FROM entries ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+            total -= nbytes
+            self.evictions += 1
+
+    def stats(self):
+        """Hit/miss counters plus the on-disk footprint"""
+        with self._lock, self._connect() as conn:
+            entries, nbytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': nbytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM paths")
+
+
+def _safe_extract(file_path):
+    """Pool worker: extract a file, returning the error instead of raising"""
+    try:
+        content, pages, page_ends = extract_document(file_path)
+        return content, pages, page_ends, None
+    except Exception as e:
+        return "", None, array('Q'), str(e)
+
+
+def _cache_call(cache, method, file_path):
+    """cache.method(file_path), treating a broken cache as a miss"""
+    try:
+        return getattr(cache, method)(file_path)
+    except Exception:
+        return None
+
+
+def iter_extracted(file_paths, cache=None, max_workers=None, parallel=True, on_progress=None):
+    """Extract many files, yielding (file_path, content, pages, page_ends, error) in order.
+
+    Cache hits are only loaded when their turn comes. Cache misses are
+    fanned out across a process pool; results that finish early are held
+    back until every earlier file has been yielded, so only the
+    out-of-order tail of extracted files is buffered. on_progress(done,
+    total, file_path) is called in the calling thread as each file is
+    ready. Extraction runs serially when there is at most one file to
+    extract or parallel is False.
+    """
+    file_paths = [Path(p) for p in file_paths]
+    total = len(file_paths)
+    pending = [
+        index for index, file_path in enumerate(file_paths)
+        if cache is None or not _cache_call(cache, 'contains', file_path)
+    ]
+    ready = {}
+    done = 0
+
+    def finish(index, result):
+        nonlocal done
+        content, pages, page_ends, error = result
+        if cache is not None and content and not error:
+            try:
+                cache.put(file_paths[index], content, pages, page_ends)
+            except Exception:
+                pass
+        ready[index] = result
+        done += 1
+        if on_progress:
+            on_progress(done, total, file_paths[index])
+
+    def load(index):
+        """A cache hit, extracted in-process if it has been evicted since"""
+        nonlocal done
+        cached = _cache_call(cache, 'get', file_paths[index])
+        if cached is None:
+            finish(index, _safe_extract(file_paths[index]))
+            return ready.pop(index)
+        done += 1
+        if on_progress:
+            on_progress(done, total, file_paths[index])
+        return cached + (None,)
+
+    if not parallel or len(pending) <= 1:
+        pending = set(pending)
+        for index, file_path in enumerate(file_paths):
+            if index in pending:
+                finish(index, _safe_extract(file_path))
+                yield (file_path,) + ready.pop(index)
+            else:
+                yield (file_path,) + load(index)
+        return
+
+    workers = min(len(pending), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=set_pdf_backend,
+        initargs=(active_pdf_backend(),)
+    ) as pool:
+        futures = {pool.submit(_safe_extract, file_paths[index]): index for index in pending}
+        extracting = set(futures.values())
+        completed = as_completed(futures)
+        for index, file_path in enumerate(file_paths):
+            if index not in extracting:
+                yield (file_path,) + load(index)
+                continue
+            while index not in ready:
+                future = next(completed)
+                try:
+                    result = future.result()
+                except Exception:
+                    # Broken pool (e.g. a worker was killed): extract in-process instead
+                    result = _safe_extract(file_paths[futures[future]])
+                finish(futures[future], result)
+            yield (file_path,) + ready.pop(index)
+
+
+def iter_records(file_paths, cache=None, max_workers=None, parallel=True, on_progress=None, errors=None):
+    """Yield (file_path, page_no, text) records for every page of every file.
+
+    Each file's extracted text is released as soon as its pages have been
+    yielded. Files that fail to extract are skipped and, when an errors list
+    is passed in, appended to it as (file_path, message).
+    """
+    for file_path, content, pages, page_ends, error in iter_extracted(
+        file_paths, cache=cache, max_workers=max_workers,
+        parallel=parallel, on_progress=on_progress
+    ):
+        if error:
+            if errors is not None:
+                errors.append((file_path, error))
+            continue
+        for page_no, text in split_pages(content, pages, page_ends):
+            yield file_path, page_no, text
+
+
+def file_banner(file_name):
+    """Separator placed before each file in a combined document"""
+    return f"\n\n{'='*80}\nFILE: {file_name}\n{'='*80}\n\n"
@@ -0,0 +1,342 @@
+"""Swappable LLM backends: OpenRouter, an offline fake, and record/replay"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from pathlib import Path
+
+from ingest import CACHE_DIR
+from llm_client import ClientPool, _env_number
+from responses import prompt_digest, response_key
+from retrieval import STOPWORDS, tokenize
+
+LLM_BACKEND_ENV = "STUDY_LLM_BACKEND"
+LLM_RECORD_ENV = "STUDY_LLM_RECORD"
+LLM_RECORDINGS_ENV = "STUDY_LLM_RECORDINGS"
+LLM_SEED_ENV = "STUDY_LLM_SEED"
+FAKE_LATENCY_ENV = "STUDY_LLM_FAKE_LATENCY"
+FAKE_TOKENS_PER_SECOND_ENV = "STUDY_LLM_FAKE_TOKENS_PER_SECOND"
+DEFAULT_RECORDINGS_DIR = CACHE_DIR / "recordings"
+RECORD_MODES = ('off', 'record', 'replay')
+DEFAULT_RECORD_SEED = "0"
+STREAM_CHUNK_CHARS = 40
+
+QUESTION_TYPES = ("Multiple Choice", "True/False", "Short Answer", "Fill in the Blank")
+
+
+class ReplayMiss(LookupError):
+    """A prompt with no recorded response was requested in replay mode"""
+
+
+def _chunks(text, size=STREAM_CHUNK_CHARS):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+class LlmBackend:
+    """What the app needs from an LLM: blocking, streamed and async completions.
+
+    ClientPool is the real implementation; subclasses here stand in for it.
+    Async use goes through `async with backend.async_client(api_key) as client`
+    followed by `await backend.acomplete(client, prompt, model)`.
+    """
+
+    name = None
+    label = None
+    requires_api_key = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'retries': 0, 'failures': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def complete(self, api_key, prompt, model):
+        raise NotImplementedError
+
+    def stream(self, api_key, prompt, model):
+        yield from _chunks(self.complete(api_key, prompt, model))
+
+    def async_client(self, api_key):
+        return nullcontext(api_key)
+
+    async def acomplete(self, client, prompt, model):
+        return await asyncio.to_thread(self.complete, client, prompt, model)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats.setdefault('reuse_rate', 0.0)
+        return stats
+
+    def close(self):
+        pass
+
+
+class FakeBackend(LlmBackend):
+    """Deterministic offline responses with configurable latency.
+
+    The same (model, prompt) always gets the same answer. Prompts that ask
+    for ==QUESTION START== blocks get exactly the requested number of
+    well-formed questions; anything else gets short markdown notes built
+    from the prompt's most frequent terms. Each response takes latency
+    seconds before the first token plus its length / tokens_per_second.
+    """
+
+    name = 'fake'
+    label = "Offline fake"
+    requires_api_key = False
+
+    def __init__(self, latency=None, tokens_per_second=None, sleep=time.sleep):
+        super().__init__()
+        self.latency = latency if latency is not None else _env_number(FAKE_LATENCY_ENV, 0.0)
+        self.tokens_per_second = tokens_per_second if tokens_per_second is not None else _env_number(
+            FAKE_TOKENS_PER_SECOND_ENV, 0.0
+        )
+        self.sleep = sleep
+
+    def respond(self, prompt, model):
+        seed = int(hashlib.sha1(f"{model}\0{prompt}".encode('utf-8', 'surrogatepass')).hexdigest()[:8], 16)
+        terms = self._terms(prompt)
+        if "==QUESTION START==" in prompt:
+            return self._question_blocks(prompt, terms, seed)
+        count = re.search(r"Generate (\d+) ", prompt)
+        if count:
+            return self._question_list(int(count.group(1)), terms, seed)
+        return self._notes(terms, seed)
+
+    def _terms(self, prompt):
+        words = [word for word in tokenize(prompt) if word not in STOPWORDS and not word.isdigit()]
+        terms = [word for word, _ in Counter(words).most_common(40)]
+        return terms or ["topic"]
+
+    def _question_blocks(self, prompt, terms, seed):
+        count = re.search(r"EXACTLY (\d+) questions", prompt)
+        count = int(count.group(1)) if count else 5
+        mix = re.search(r"Mix of question types: (.+)", prompt)
+        types = [t for t in QUESTION_TYPES if mix and t in mix.group(1)] or list(QUESTION_TYPES)
+        blocks = []
+        for i in range(count):
+            term = terms[(seed + i) % len(terms)]
+            question_type = types[(seed + i) % len(types)]
+            difficulty = ("Easy", "Medium", "Hard")[(seed + i) % 3]
+            if question_type == "Multiple Choice":
+                question = f"Which statement best describes {term}?"
+                others = [terms[(seed + i + k) % len(terms)] for k in (1, 2, 3)]
+                options = " | ".join(
+                    f"{letter}) It relates to {word}" for letter, word in zip("ABCD", [term] + others)
+                )
+                answer = "A"
+            elif question_type == "True/False":
+                question = f"{term.capitalize()} is covered in the study material."
+                options, answer = "True | False", "True"
+            elif question_type == "Fill in the Blank":
+                question = f"The material describes ____ in question {i + 1}."
+                options, answer = "N/A", term
+            else:
+                question = f"Briefly explain {term}."
+                options, answer = "N/A", f"{term.capitalize()} as described in the material"
+            blocks.append(
+                "==QUESTION START==\n"
+                f"Question Type: {question_type}\n"
+                f"Difficulty: {difficulty}\n"
+                f"Question: {question}\n"
+                f"Options: {options}\n"
+                f"Correct Answer: {answer}\n"
+                f"Explanation: The material discusses {term}.\n"
+                "==QUESTION END=="
+            )
+        return "\n\n".join(blocks)
+
+    def _question_list(self, count, terms, seed):
+        return "\n\n".join(
+            f"**Question {i + 1}:** What is {terms[(seed + i) % len(terms)]}?\n"
+            f"- Correct answer: {terms[(seed + i) % len(terms)]} as described in the material\n"
+            f"- Explanation: The material discusses {terms[(seed + i) % len(terms)]}."
+            for i in range(count)
+        )
+
+    def _notes(self, terms, seed):
+        start = seed % len(terms)
+        ordered = terms[start:] + terms[:start]
+        sections = []
+        for group in range(0, min(len(ordered), 20), 5):
+            bullets = "\n".join(f"- **{term}**: appears in the material" for term in ordered[group:group + 5])
+            sections.append(f"## {ordered[group].capitalize()}\n{bullets}")
+        return "\n\n".join(sections)
+
+    def _delay(self, text):
+        delay = self.latency
+        if self.tokens_per_second > 0:
+            delay += len(text.split()) / self.tokens_per_second
+        return delay
+
+    def complete(self, api_key, prompt, model):
+        self._count('requests')
+        text = self.respond(prompt, model)
+        self.sleep(self._delay(text))
+        return text
+
+    def stream(self, api_key, prompt, model):
+        self._count('requests')
+        text = self.respond(prompt, model)
+        self.sleep(self.latency)
+        pieces = list(_chunks(text))
+        pause = (self._delay(text) - self.latency) / max(len(pieces), 1)
+        for piece in pieces:
+            yield piece
+            if pause:
+                self.sleep(pause)
+
+    async def acomplete(self, client, prompt, model):
+        self._count('requests')
+        text = self.respond(prompt, model)
+        await asyncio.sleep(self._delay(text))
+        return text
+
+
+class RecordReplayBackend(LlmBackend):
+    """Record another backend's responses to disk, or replay them without it.
+
+    Recordings are one JSON file per (model, prompt) under path, named by
+    response_key, so a directory of them can be kept as a fixture. In
+    'replay' mode a missing recording raises ReplayMiss instead of calling
+    out.
+    """
+
+    name = 'record'
+    label = "Record/replay"
+
+    def __init__(self, inner, path=DEFAULT_RECORDINGS_DIR, mode='replay'):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown record mode: {mode}")
+        super().__init__()
+        self.inner = inner
+        self.path = Path(path)
+        self.mode = mode
+        self.requires_api_key = mode == 'record' and inner.requires_api_key
+        self.counters = {'recorded': 0, 'replayed': 0, 'misses': 0}
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, model, prompt):
+        return self.path / f"{response_key(model, prompt)}.json"
+
+    def _load(self, model, prompt):
+        try:
+            recording = json.loads(self._file(model, prompt).read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            self._count('misses')
+            raise ReplayMiss(f"No recording for this {model} prompt in {self.path}") from None
+        self._count('replayed')
+        return recording['response']
+
+    def _save(self, model, prompt, response):
+        if not response:
+            return
+        target = self._file(model, prompt)
+        temporary = target.with_suffix('.tmp')
+        temporary.write_text(json.dumps({
+            'model': model,
+            'prompt_sha256': prompt_digest(prompt),
+            'prompt_head': prompt[:200],
+            'response': response,
+            'recorded': time.time(),
+        }, ensure_ascii=False, indent=1), encoding='utf-8')
+        os.replace(temporary, target)
+        self._count('recorded')
+
+    def complete(self, api_key, prompt, model):
+        if self.mode == 'replay':
+            return self._load(model, prompt)
+        response = self.inner.complete(api_key, prompt, model)
+        self._save(model, prompt, response)
+        return response
+
+    def stream(self, api_key, prompt, model):
+        if self.mode == 'replay':
+            yield from _chunks(self._load(model, prompt))
+            return
+        pieces = []
+        for piece in self.inner.stream(api_key, prompt, model):
+            pieces.append(piece)
+            yield piece
+        self._save(model, prompt, "".join(pieces))
+
+    def async_client(self, api_key):
+        if self.mode == 'replay':
+            return nullcontext(api_key)
+        return self.inner.async_client(api_key)
+
+    async def acomplete(self, client, prompt, model):
+        if self.mode == 'replay':
+            return self._load(model, prompt)
+        response = await self.inner.acomplete(client, prompt, model)
+        self._save(model, prompt, response)
+        return response
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        if self.mode == 'record':
+            stats = self.inner.stats()
+        else:
+            stats = {
+                'requests': counters['replayed'] + counters['misses'],
+                'retries': 0,
+                'failures': counters['misses'],
+                'reuse_rate': 0.0,
+            }
+        stats.update(counters)
+        return stats
+
+    def close(self):
+        self.inner.close()
+
+
+def make_llm_backend(name=None, record=None, recordings=None):
+    """The configured backend: arguments, else $STUDY_LLM_BACKEND ('openrouter'
+    or 'fake') wrapped per $STUDY_LLM_RECORD ('off', 'record' or 'replay')"""
+    name = (name or os.environ.get(LLM_BACKEND_ENV) or 'openrouter').lower()
+    record = (record or os.environ.get(LLM_RECORD_ENV) or 'off').lower()
+    if record not in RECORD_MODES:
+        raise ValueError(f"{LLM_RECORD_ENV} must be one of {', '.join(RECORD_MODES)}, not {record!r}")
+    if name == 'fake':
+        backend = FakeBackend()
+    elif name == 'openrouter':
+        backend = ClientPool()
+    else:
+        raise ValueError(f"{LLM_BACKEND_ENV} must be 'openrouter' or 'fake', not {name!r}")
+    if record != 'off':
+        backend = RecordReplayBackend(
+            backend, recordings or os.environ.get(LLM_RECORDINGS_ENV) or DEFAULT_RECORDINGS_DIR, record
+        )
+    return backend
+
+
+def fixed_seed():
+    """Seed for everything random that ends up in a prompt, or None to vary freely.
+
+    $STUDY_LLM_SEED if set; otherwise a constant while recording or
+    replaying, so a replayed session sends the same prompts as the
+    recorded one.
+    """
+    seed = os.environ.get(LLM_SEED_ENV)
+    if seed:
+        return seed
+    if (os.environ.get(LLM_RECORD_ENV) or 'off').lower() != 'off':
+        return DEFAULT_RECORD_SEED
+    return None
+
+
+def describe_backend(backend):
+    """Short label for the sidebar"""
+    if isinstance(backend, RecordReplayBackend):
+        return f"{backend.mode.capitalize()} ({describe_backend(backend.inner)}) · {backend.path}"
+    return getattr(backend, 'label', None) or "OpenRouter"
@@ -0,0 +1,336 @@
+"""Pooled OpenRouter clients with timeouts, retries and connection metrics"""
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain
+
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from telemetry import note, note_usage
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+BASE_URL_ENV = "STUDY_LLM_BASE_URL"
+CONNECT_TIMEOUT_ENV = "STUDY_LLM_CONNECT_TIMEOUT"
+READ_TIMEOUT_ENV = "STUDY_LLM_READ_TIMEOUT"
+MAX_RETRIES_ENV = "STUDY_LLM_MAX_RETRIES"
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 180.0
+DEFAULT_MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+KEEPALIVE_SECONDS = 120.0
+MAX_KEEPALIVE_CONNECTIONS = 20
+MAX_CLIENTS = 8
+
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+# The Limits class of whichever httpx flavour the openai package is built on
+_Limits = type(openai.DEFAULT_CONNECTION_LIMITS)
+
+
+def _env_number(name, default, cast=float):
+    try:
+        return cast(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def is_retryable(error):
+    """Connection problems, timeouts, rate limits and 5xx are worth retrying"""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+def retry_after(error):
+    """Seconds requested by a Retry-After header, if any"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def key_id(api_key):
+    """Stable identifier for an API key that does not contain it"""
+    return hashlib.sha256(str(api_key).encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX, rng=random):
+    """Exponential backoff with full jitter: uniform(0, min(cap, base * 2**attempt))"""
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class ClientPool:
+    """Keep-alive OpenAI clients per API key, shared across sessions and threads.
+
+    Clients are looked up by a hash of the key and kept for the max_clients
+    most recently used keys; an evicted client is closed once no request
+    is using it.
+
+    Requests go through complete(), which retries retryable errors with
+    exponential backoff and jitter (honouring Retry-After). The SDK's own
+    retries are off so every attempt is counted here. stats() reports
+    requests, retries, failures and how many responses arrived on a
+    connection that had already been used.
+
+    base_url defaults to $STUDY_LLM_BASE_URL, else OpenRouter, so any
+    OpenAI-compatible server (e.g. a local stub) can stand in.
+    """
+
+    label = "OpenRouter"
+    requires_api_key = True
+
+    def __init__(self, base_url=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, sleep=time.sleep, max_clients=MAX_CLIENTS):
+        self.base_url = base_url or os.environ.get(BASE_URL_ENV) or OPENROUTER_BASE_URL
+        self.connect_timeout = connect_timeout or _env_number(CONNECT_TIMEOUT_ENV, DEFAULT_CONNECT_TIMEOUT)
+        self.read_timeout = read_timeout or _env_number(READ_TIMEOUT_ENV, DEFAULT_READ_TIMEOUT)
+        self.max_retries = max_retries if max_retries is not None else _env_number(
+            MAX_RETRIES_ENV, DEFAULT_MAX_RETRIES, int
+        )
+        self.sleep = sleep
+        self.max_clients = max(1, max_clients)
+        self._clients = OrderedDict()
+        self._leases = {}
+        self._retired = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'clients': 0,
+            'requests': 0,
+            'attempts': 0,
+            'retries': 0,
+            'failures': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'backoff_seconds': 0.0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _on_response(self, response):
+        """Count a response as new or reused by the identity of its network stream"""
+        stream = response.extensions.get('network_stream')
+        if stream is None:
+            return
+        with self._lock:
+            if id(stream) in self._streams:
+                self.counters['connections_reused'] += 1
+            else:
+                # Keep the stream referenced so its id cannot be recycled
+                self._streams[id(stream)] = stream
+                if len(self._streams) > 4 * MAX_KEEPALIVE_CONNECTIONS:
+                    self._streams.pop(next(iter(self._streams)))
+                self.counters['connections_opened'] += 1
+
+    def _limits(self):
+        return _Limits(
+            max_connections=100,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_SECONDS,
+        )
+
+    def _timeout(self):
+        return openai.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def _new_client(self, api_key):
+        http_client = openai.DefaultHttpxClient(
+            limits=self._limits(),
+            timeout=self._timeout(),
+            event_hooks={'response': [self._on_response]},
+        )
+        return OpenAI(
+            base_url=self.base_url,
+            api_key=api_key,
+            max_retries=0,
+            http_client=http_client,
+        )
+
+    @contextmanager
+    def _lease(self, api_key):
+        """The key's client, held open for the duration of the with block"""
+        key = key_id(api_key)
+        evicted = []
+        with self._lock:
+            client = self._clients.pop(key, None)
+            if client is None:
+                client = self._new_client(api_key)
+                self.counters['clients'] += 1
+            self._clients[key] = client
+            self._leases[id(client)] = self._leases.get(id(client), 0) + 1
+            while len(self._clients) > self.max_clients:
+                _, old = self._clients.popitem(last=False)
+                if id(old) in self._leases:
+                    self._retired[id(old)] = old
+                else:
+                    evicted.append(old)
+        for old in evicted:
+            old.close()
+        try:
+            yield client
+        finally:
+            with self._lock:
+                self._leases[id(client)] -= 1
+                retired = None
+                if not self._leases[id(client)]:
+                    del self._leases[id(client)]
+                    retired = self._retired.pop(id(client), None)
+            if retired is not None:
+                retired.close()
+
+    def _retry_delay(self, error, attempt):
+        """Seconds to wait before retrying after error, or None to give up"""
+        if not is_retryable(error) or attempt >= self.max_retries:
+            self._count('failures')
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            delay = backoff_delay(attempt)
+        delay = min(delay, BACKOFF_MAX)
+        self._count('retries')
+        self._count('backoff_seconds', delay)
+        return delay
+
+    def call(self, api_key, request):
+        """Run request(client) with retries; raises the last error when out of attempts"""
+        with self._lease(api_key) as client:
+            return self._call(client, request)
+
+    def _call(self, client, request):
+        self._count('requests')
+        attempt = 0
+        while True:
+            self._count('attempts')
+            note(retries=attempt)
+            try:
+                return request(client)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                self.sleep(delay)
+                attempt += 1
+
+    def complete(self, api_key, prompt, model):
+        """One chat completion's text"""
+        def request(client):
+            completion = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                extra_body={}
+            )
+            note_usage(completion.usage)
+            return completion.choices[0].message.content
+        return self.call(api_key, request)
+
+    def stream(self, api_key, prompt, model):
+        """Yield a chat completion's text as it arrives.
+
+        The request and its first chunk go through call(), so failures up to
+        the first token are retried; once text is flowing errors propagate.
+        The HTTP response is closed however the stream ends, including when
+        the consumer stops reading early.
+        """
+        def request(client):
+            stream = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                stream_options={"include_usage": True},
+                extra_body={}
+            )
+            chunks = iter(stream)
+            try:
+                return stream, next(chunks, None), chunks
+            except BaseException:
+                stream.close()
+                raise
+
+        with self._lease(api_key) as client:
+            stream, first, rest = self._call(client, request)
+            try:
+                for chunk in chain([first] if first is not None else [], rest):
+                    if chunk.usage:
+                        note_usage(chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                stream.close()
+
+    def async_client(self, api_key):
+        """A new AsyncOpenAI client with the pool's settings.
+
+        Async connections belong to one event loop, so callers create one
+        per loop (use it as an async context manager) instead of sharing it.
+        """
+        async def on_response(response):
+            self._on_response(response)
+
+        self._count('clients')
+        return AsyncOpenAI(
+            base_url=self.base_url,
+            api_key=api_key,
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=self._limits(),
+                timeout=self._timeout(),
+                event_hooks={'response': [on_response]},
+            ),
+        )
+
+    async def acall(self, request):
+        """Async call(): await request() with the same retry policy"""
+        self._count('requests')
+        attempt = 0
+        while True:
+            self._count('attempts')
+            note(retries=attempt)
+            try:
+                return await request()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def acomplete(self, client, prompt, model):
+        """One chat completion's text through an async_client()"""
+        async def request():
+            completion = await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                extra_body={}
+            )
+            note_usage(completion.usage)
+            return completion.choices[0].message.content
+        return await self.acall(request)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        responses = stats['connections_opened'] + stats['connections_reused']
+        stats['reuse_rate'] = (stats['connections_reused'] / responses) if responses else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            for client in self._retired.values():
+                client.close()
+            self._retired.clear()
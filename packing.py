@@ -0,0 +1,237 @@
+"""Token estimation and fitting prompts into a model's context budget"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from corpus import Corpus
+from retrieval import BM25Index, chunk_corpus
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_BUDGET_ENV = "STUDY_CONTEXT_TOKENS"
+MODEL_CONTEXT_TOKENS = {
+    "openrouter/free": 32000,
+}
+DEFAULT_MODEL_CONTEXT_TOKENS = 32000
+RESPONSE_RESERVE_TOKENS = 4096
+SAFETY_MARGIN = 0.9
+STUB_WORDS = 30
+STUB_SHARE = 0.15
+PASSAGE_HEADER_TOKENS = 16
+
+_ALPHA_RE = re.compile(r'[^\W\d_]+')
+_DIGIT_RE = re.compile(r'\d+')
+_SYMBOL_RE = re.compile(r'[^\w\s]|_')
+
+
+def approx_tokens(text):
+    """BPE-like token estimate: ~6 letters or 3 digits per token, one per symbol.
+
+    Within ~10-15% of real tokenizers on English course material and an
+    overestimate on identifier-heavy text, which is the safe side.
+    """
+    return (
+        sum((len(word) + 5) // 6 for word in _ALPHA_RE.findall(text))
+        + sum((len(number) + 2) // 3 for number in _DIGIT_RE.findall(text))
+        + len(_SYMBOL_RE.findall(text))
+    )
+
+
+class TokenCounter:
+    """approx_tokens with a thread-safe LRU cache keyed by a hash of the text.
+
+    Holds at most max_entries counts, for texts totalling at most max_bytes
+    (a text larger than that is counted but not cached).
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text):
+        data = text.encode('utf-8', 'surrogatepass')
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        tokens = approx_tokens(text)
+        if len(data) > self.max_bytes:
+            return tokens
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = (tokens, len(data))
+                self._bytes += len(data)
+                while len(self._cache) > self.max_entries or self._bytes > self.max_bytes:
+                    self._bytes -= self._cache.popitem(last=False)[1][1]
+        return tokens
+
+
+default_counter = TokenCounter()
+
+
+def count_tokens(text):
+    return default_counter.count(text)
+
+
+def context_budget(model):
+    """Prompt token budget for a model: $STUDY_CONTEXT_TOKENS, else its window minus the response reserve"""
+    configured = os.environ.get(CONTEXT_BUDGET_ENV, "")
+    if configured.isdigit():
+        return int(configured)
+    window = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_MODEL_CONTEXT_TOKENS)
+    return int((window - RESPONSE_RESERVE_TOKENS) * SAFETY_MARGIN)
+
+
+def build_packing_index(document):
+    """BM25 index over non-overlapping chunks of a plain text document"""
+    corpus = Corpus.from_records([(Path("document"), None, document)], banner=None)
+    return BM25Index(chunk_corpus(corpus, overlap_words=0))
+
+
+def _priority_order(index, instructions):
+    """Chunk ids, most important first.
+
+    Files take turns so every file keeps some content; within a file chunks
+    most relevant to the instructions come first, then document order.
+    """
+    chunks = index.chunks
+    relevance = dict(index.search(instructions, k=len(chunks))) if instructions else {}
+    by_file = {}
+    for chunk_id in range(len(chunks)):
+        by_file.setdefault(int(chunks.files[chunk_id]), []).append(chunk_id)
+    queues = [
+        sorted(ids, key=lambda chunk_id: (-relevance.get(chunk_id, 0.0), chunk_id))
+        for ids in by_file.values()
+    ]
+    order = []
+    for rank in range(max((len(queue) for queue in queues), default=0)):
+        order.extend(queue[rank] for queue in queues if rank < len(queue))
+    return order
+
+
+def _stub(text):
+    words = text.split()
+    return " ".join(words[:STUB_WORDS]) + (" …" if len(words) > STUB_WORDS else "")
+
+
+def pack_document(index, instructions, max_tokens, counter=default_counter):
+    """Fit a chunked document into max_tokens.
+
+    Chunks are taken whole in priority order (see _priority_order) while
+    they fit, leaving STUB_SHARE of the budget free when some must go. The
+    lowest-priority chunks are then summarised as their opening words while
+    room remains, and the rest are dropped. Returns the packed text in
+    document order and {'kept', 'summarised', 'dropped', 'tokens'}.
+    """
+    chunks = index.chunks
+    kept, summarised = {}, {}
+    used = 0
+    order = _priority_order(index, instructions)
+    costs = {chunk_id: counter.count(chunks.text(chunk_id)) + PASSAGE_HEADER_TOKENS for chunk_id in order}
+    full_budget = max_tokens if sum(costs.values()) <= max_tokens else int(max_tokens * (1 - STUB_SHARE))
+    for chunk_id in order:
+        cost = costs[chunk_id]
+        if used + cost <= full_budget:
+            kept[chunk_id] = chunks.text(chunk_id)
+            used += cost
+    for chunk_id in order:
+        if chunk_id in kept:
+            continue
+        stub = _stub(chunks.text(chunk_id))
+        cost = counter.count(stub) + PASSAGE_HEADER_TOKENS
+        if used + cost <= max_tokens:
+            summarised[chunk_id] = stub
+            used += cost
+
+    def assemble():
+        parts = []
+        omitted = 0
+        for chunk_id in range(len(chunks)):
+            if chunk_id in kept:
+                text = f"[Source: {chunks.label(chunk_id)}]\n{kept[chunk_id]}"
+            elif chunk_id in summarised:
+                text = f"[Summary of {chunks.label(chunk_id)}] {summarised[chunk_id]}"
+            else:
+                omitted += 1
+                continue
+            if omitted:
+                parts.append(f"[… {omitted} omitted …]")
+                omitted = 0
+            parts.append(text)
+        if omitted:
+            parts.append(f"[… {omitted} omitted …]")
+        return "\n\n".join(parts)
+
+    # Headers and omission markers are estimated above; trim from the
+    # lowest priority end until the real count fits
+    packed = assemble()
+    tokens = counter.count(packed)
+    while tokens > max_tokens and (kept or summarised):
+        if summarised:
+            summarised.popitem()
+        else:
+            kept.popitem()
+        packed = assemble()
+        tokens = counter.count(packed)
+
+    return packed, {
+        'kept': len(kept),
+        'summarised': len(summarised),
+        'dropped': len(chunks) - len(kept) - len(summarised),
+        'tokens': tokens,
+    }
+
+
+def fit_prompt(prompt, document, model, index_factory=None, counter=default_counter):
+    """Pack the document embedded in a prompt so the prompt fits the model's budget.
+
+    index_factory returns a packing index for the document (default:
+    build_packing_index) and is only called when packing is needed.
+    Returns (prompt to send, stats) with original and sent token counts.
+    """
+    budget = context_budget(model)
+    embedded = bool(document) and document in prompt
+    if embedded:
+        instructions = prompt.replace(document, "", 1)
+        instruction_tokens = counter.count(instructions)
+        original = instruction_tokens + counter.count(document)
+    else:
+        original = counter.count(prompt)
+    stats = {
+        'model': model,
+        'budget': budget,
+        'original_tokens': original,
+        'sent_tokens': original,
+        'packed': False,
+    }
+
+    if original > budget and embedded:
+        index = index_factory() if index_factory else build_packing_index(document)
+        packed, packing = pack_document(index, instructions, max(budget - instruction_tokens, 0), counter)
+        prompt = prompt.replace(document, packed, 1)
+        stats.update(packing)
+        stats['sent_tokens'] = instruction_tokens + packing['tokens']
+        stats['packed'] = True
+
+    logger.info(
+        "%s: %d prompt tokens, %d sent (budget %d%s)",
+        model, stats['original_tokens'], stats['sent_tokens'], budget,
+        f", kept {stats['kept']} / summarised {stats['summarised']} / dropped {stats['dropped']} chunks"
+        if stats['packed'] else ""
+    )
+    if original > budget and not embedded:
+        logger.warning("%s: prompt of %d tokens exceeds budget %d and has no document to pack", model, original, budget)
+    return prompt, stats
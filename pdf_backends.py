@@ -0,0 +1,213 @@
+"""Pluggable PDF text extraction backends and a benchmark to choose between them"""
+import json
+import os
+import time
+
+PDF_BACKEND_ENV = "STUDY_PDF_BACKEND"
+
+PDF_BACKENDS = {}
+
+
+class PdfBackend:
+    """A PDF library wrapped as open / page count / page text"""
+
+    name = None
+    label = None
+
+    def open(self, stream):
+        raise NotImplementedError
+
+    def page_count(self, reader):
+        """Page count from the document catalogue, without touching page content"""
+        try:
+            return int(reader.trailer['/Root']['/Pages']['/Count'])
+        except Exception:
+            return len(reader.pages)
+
+    def page_text(self, reader, index):
+        return self.extract(reader.pages[index])
+
+    def extract(self, page):
+        return page.extract_text()
+
+    def iter_page_texts(self, stream):
+        for page in self.open(stream).pages:
+            yield self.extract(page)
+
+
+def register_pdf_backend(backend_class):
+    """Register a PdfBackend subclass under its name"""
+    PDF_BACKENDS[backend_class.name] = backend_class()
+    return backend_class
+
+
+try:
+    import PyPDF2
+
+    @register_pdf_backend
+    class PyPDF2Backend(PdfBackend):
+        name = 'pypdf2'
+        label = "PyPDF2"
+
+        def open(self, stream):
+            return PyPDF2.PdfReader(stream)
+except ImportError:
+    pass
+
+try:
+    import pypdf
+
+    @register_pdf_backend
+    class PypdfBackend(PdfBackend):
+        name = 'pypdf'
+        label = "pypdf (plain)"
+
+        def open(self, stream):
+            return pypdf.PdfReader(stream)
+
+    @register_pdf_backend
+    class PypdfLayoutBackend(PypdfBackend):
+        name = 'pypdf-layout'
+        label = "pypdf (layout)"
+
+        def extract(self, page):
+            return page.extract_text(extraction_mode="layout")
+except ImportError:
+    pass
+
+
+def available_pdf_backends():
+    return list(PDF_BACKENDS)
+
+
+def default_pdf_backend():
+    return 'pypdf2' if 'pypdf2' in PDF_BACKENDS else next(iter(PDF_BACKENDS))
+
+
+_active_backend = None
+
+
+def set_pdf_backend(name):
+    """Choose the backend used for all PDF extraction in this process"""
+    global _active_backend
+    if name not in PDF_BACKENDS:
+        raise ValueError(f"Unknown PDF backend {name!r}; available: {', '.join(PDF_BACKENDS)}")
+    _active_backend = name
+
+
+def active_pdf_backend():
+    """The configured backend: set_pdf_backend(), else $STUDY_PDF_BACKEND, else the default"""
+    if _active_backend:
+        return _active_backend
+    configured = os.environ.get(PDF_BACKEND_ENV, "")
+    if configured in PDF_BACKENDS:
+        return configured
+    return default_pdf_backend()
+
+
+def get_pdf_backend(name=None):
+    """The named backend, or the active one"""
+    return PDF_BACKENDS[name or active_pdf_backend()]
+
+
+def iter_pdf_page_texts(stream, backend=None):
+    """Yield the raw text of each page using the given (or active) backend"""
+    yield from get_pdf_backend(backend).iter_page_texts(stream)
+
+
+def text_quality(text):
+    """Share of alphanumeric/whitespace characters and mean word length"""
+    if not text:
+        return 0.0, 0.0
+    clean = sum(1 for ch in text if ch.isalnum() or ch.isspace())
+    words = text.split()
+    mean_word = (sum(len(w) for w in words) / len(words)) if words else 0.0
+    return clean / len(text), mean_word
+
+
+def benchmark_pdf_backends(pdf_paths, max_pages=10, backends=None):
+    """Time every backend over the first max_pages pages of each sample PDF.
+
+    Returns one result dict per backend with throughput (pages/s), output
+    size, quality figures and whether it passes the sanity check: at least
+    half the characters of the most productive backend, mostly
+    alphanumeric text, and plausible word lengths (spaced-out letters such
+    as "P a g e" fail). A backend that is not installed fails with an error.
+    """
+    results = []
+    for name in backends or available_pdf_backends():
+        backend = PDF_BACKENDS.get(name)
+        page_count = 0
+        chars = 0
+        sample = []
+        elapsed = 0.0
+        error = None if backend else "not installed"
+        for pdf_path in pdf_paths if backend else []:
+            try:
+                with open(pdf_path, 'rb') as f:
+                    started = time.perf_counter()
+                    for index, text in enumerate(backend.iter_page_texts(f)):
+                        if index >= max_pages:
+                            break
+                        page_count += 1
+                        chars += len(text or "")
+                        sample.append(text or "")
+                    elapsed += time.perf_counter() - started
+            except Exception as e:
+                error = str(e)
+        clean_ratio, mean_word = text_quality("".join(sample))
+        results.append({
+            'backend': name,
+            'label': backend.label if backend else name,
+            'pages': page_count,
+            'seconds': elapsed,
+            'pages_per_sec': (page_count / elapsed) if elapsed else 0.0,
+            'chars': chars,
+            'clean_ratio': clean_ratio,
+            'mean_word_length': mean_word,
+            'error': error,
+        })
+
+    most_chars = max((r['chars'] for r in results), default=0)
+    for result in results:
+        result['passes'] = (
+            result['error'] is None
+            and result['pages'] > 0
+            and result['chars'] >= 0.5 * most_chars
+            and result['clean_ratio'] >= 0.8
+            and 2.5 <= result['mean_word_length'] <= 15
+        )
+    return results
+
+
+def pick_fastest_backend(results):
+    """Fastest backend that passed the sanity check (default backend if none did)"""
+    passing = [r for r in results if r['passes']]
+    if not passing:
+        return default_pdf_backend()
+    return max(passing, key=lambda r: r['pages_per_sec'])['backend']
+
+
+def auto_select_pdf_backend(pdf_paths, selection_path, max_pages=10, rerun=False):
+    """Benchmark once, remember the winner in selection_path, and activate it.
+
+    Returns (backend name, benchmark results). A saved selection is reused
+    unless rerun is True or the backend is no longer installed.
+    """
+    if not rerun and os.path.exists(selection_path):
+        try:
+            with open(selection_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('backend') in PDF_BACKENDS:
+                set_pdf_backend(saved['backend'])
+                return saved['backend'], saved.get('results', [])
+        except (OSError, ValueError):
+            pass
+
+    results = benchmark_pdf_backends(pdf_paths, max_pages=max_pages) if pdf_paths else []
+    backend = pick_fastest_backend(results)
+    os.makedirs(os.path.dirname(selection_path), exist_ok=True)
+    with open(selection_path, 'w', encoding='utf-8') as f:
+        json.dump({'backend': backend, 'results': results, 'benchmarked_at': time.time()}, f, indent=2)
+    set_pdf_backend(backend)
+    return backend, results
@@ -0,0 +1,118 @@
+"""Practice test prompts and parsing, and splitting large tests into shards"""
+import math
+
+from dedup import normalized_words
+
+SHARD_QUESTIONS = 10
+SHARD_OVERSAMPLE = 0.2
+DUPLICATE_THRESHOLD = 0.8
+
+QUESTION_FIELDS = (
+    ("Question Type:", 'type'),
+    ("Difficulty:", 'difficulty'),
+    ("Question:", 'question'),
+    ("Options:", 'options'),
+    ("Correct Answer:", 'correct_answer'),
+    ("Explanation:", 'explanation'),
+)
+REQUIRED_FIELDS = ('type', 'question', 'correct_answer')
+
+
+def practice_test_prompt(count, question_types, difficulty, material):
+    return f"""Create a practice test with EXACTLY {count} questions from this study material.
+
+YOU MUST CREATE EXACTLY {count} QUESTIONS - NO MORE, NO LESS.
+
+SPECIFIC FORMATTING REQUIREMENTS:
+For EACH question, provide in this EXACT format:
+==QUESTION START==
+Question Type: [Multiple Choice/True/False/Short Answer/Fill in the Blank]
+Difficulty: [Easy/Medium/Hard]
+Question: [The question text]
+Options: [For MC: "A) Option1 | B) Option2 | C) Option3 | D) Option4" | For TF: "True | False" | For others: "N/A"]
+Correct Answer: [The exact correct answer]
+Explanation: [Brief explanation of why this is correct]
+==QUESTION END==
+
+Additional requirements:
+- Mix of question types: {', '.join(question_types)}
+- Overall difficulty: {difficulty}
+- Include questions that test conceptual understanding
+- Vary the cognitive level (remember, understand, apply, analyze)
+- CRITICAL: You must provide exactly {count} complete questions
+
+Study Material: {material}"""
+
+
+def parse_questions(text):
+    """Complete ==QUESTION START==/==QUESTION END== blocks as question dicts"""
+    questions = []
+    for block in (text or "").split("==QUESTION START==")[1:]:
+        if "==QUESTION END==" not in block:
+            continue
+        question_data = {}
+        for line in block.split("==QUESTION END==")[0].strip().split("\n"):
+            line = line.strip()
+            for prefix, field in QUESTION_FIELDS:
+                if line.startswith(prefix):
+                    question_data[field] = line.split(prefix)[1].strip()
+                    break
+        if all(key in question_data for key in REQUIRED_FIELDS):
+            questions.append(question_data)
+    return questions
+
+
+def plan_shards(count, shard_questions=SHARD_QUESTIONS):
+    """Balanced shard sizes adding up to count, none above shard_questions"""
+    if count <= 0:
+        return []
+    shards = math.ceil(count / shard_questions)
+    return [count // shards + (1 if index < count % shards else 0) for index in range(shards)]
+
+
+def shard_request_size(size, shards):
+    """Questions to ask one shard for: a little over size when there are
+    several shards, so duplicates between them can be dropped"""
+    if shards <= 1:
+        return size
+    return size + math.ceil(size * SHARD_OVERSAMPLE)
+
+
+def shard_question_types(question_types, index):
+    """The type mix with a different type leading in each shard"""
+    if not question_types:
+        return question_types
+    offset = index % len(question_types)
+    return question_types[offset:] + question_types[:offset]
+
+
+def _question_words(question):
+    return frozenset(normalized_words(question.get('question', '')))
+
+
+def is_duplicate(words, seen, threshold=DUPLICATE_THRESHOLD):
+    """Whether a question's word set is nearly the same as one already kept"""
+    for other in seen:
+        union = len(words | other)
+        if union and len(words & other) / union >= threshold:
+            return True
+    return False
+
+
+def merge_questions(kept, shards, limit):
+    """kept plus the shards' questions taken in turn, without near-duplicates,
+    trimmed to limit. Returns (questions, duplicates dropped)."""
+    merged = list(kept)
+    seen = [_question_words(question) for question in merged]
+    duplicates = 0
+    for rank in range(max((len(shard) for shard in shards), default=0)):
+        for shard in shards:
+            if rank >= len(shard):
+                continue
+            words = _question_words(shard[rank])
+            if is_duplicate(words, seen):
+                duplicates += 1
+                continue
+            merged.append(shard[rank])
+            seen.append(words)
+    return merged[:limit], duplicates
@@ -0,0 +1,127 @@
+"""Pre-ingest every study folder without Streamlit.
+
+Usage:
+    python preindex.py [--base .] [--workers N] [--pdf-backend NAME|auto]
+                       [--all-formats] [--keep-duplicates] [--watch SECONDS]
+
+Extracts all documents across all folders in one process pool (filling the
+extraction cache), then builds and stores the all-files corpus, file manifest and
+TF-IDF passage index of each folder so the app can load them instantly. With
+--watch it keeps polling the folders and re-indexes only the files that
+change.
+"""
+import argparse
+import sys
+import time
+
+from corpus import CorpusStore
+from ingest import (
+    ExtractionCache, iter_extracted, list_folder_files, list_folders, pick_cheapest_sources, sample_pdfs,
+    PDF_SELECTION_PATH
+)
+from pdf_backends import PDF_BACKENDS, auto_select_pdf_backend, set_pdf_backend
+from reindex import IncrementalIndexer, has_changes
+from vectors import load_or_build_vector_index
+
+
+def select_pdf_backend(base_path=".", name="auto", log=print):
+    """Activate a named PDF backend, or benchmark and pick one for 'auto'"""
+    if name != "auto":
+        set_pdf_backend(name)
+        return name
+    backend, results = auto_select_pdf_backend(sample_pdfs(list_folders(base_path)), PDF_SELECTION_PATH)
+    for result in results:
+        status = "ok" if result['passes'] else "rejected"
+        log(f"  {result['label']}: {result['pages_per_sec']:.1f} pages/s, {result['chars']:,} chars ({status})")
+    log(f"PDF backend: {PDF_BACKENDS[backend].label}")
+    return backend
+
+
+def preindex(base_path=".", workers=None, prefer_fast=True, dedup=True, log=print):
+    """Build and store the corpus of every folder under base_path"""
+    cache = ExtractionCache()
+    store = CorpusStore()
+    folders = {folder: list_folder_files(folder) for folder in list_folders(base_path)}
+    all_files = [
+        file_path for files in folders.values()
+        for file_path in (pick_cheapest_sources(files)[0] if prefer_fast else files)
+    ]
+    log(f"Extracting {len(all_files)} files from {len(folders)} folders...")
+
+    started = time.perf_counter()
+
+    def report_progress(done, total, file_path):
+        log(f"  [{done}/{total}] {file_path}")
+
+    for file_path, content, pages, page_ends, error in iter_extracted(
+        all_files, cache=cache, max_workers=workers, on_progress=report_progress
+    ):
+        if error:
+            log(f"  ! {file_path}: {error}")
+
+    for folder, files in folders.items():
+        if not files:
+            continue
+        indexer = IncrementalIndexer(folder, cache, store, prefer_fast, dedup)
+        indexer.load(parallel=False)
+        corpus, report = indexer.corpus, indexer.report
+        vector_index = load_or_build_vector_index(folder, corpus)
+        saved = f", {report['words_saved']:,} duplicate words removed" if report else ""
+        log(f"{folder}: {corpus.file_count} files, {corpus.word_count:,} words, "
+            f"{len(vector_index.chunks)} indexed passages{saved}")
+
+    stats = cache.stats()
+    log(
+        f"Done in {time.perf_counter() - started:.1f}s "
+        f"(cache {stats['hits']} hits / {stats['misses']} misses)"
+    )
+    return store
+
+
+def watch(base_path=".", interval=10.0, prefer_fast=True, dedup=True, log=print):
+    """Poll every folder and re-index the ones whose files change"""
+    cache = ExtractionCache()
+    store = CorpusStore()
+    indexers = {}
+    log(f"Watching {base_path} every {interval:g}s (Ctrl+C to stop)")
+    while True:
+        for folder in list_folders(base_path):
+            indexer = indexers.get(folder)
+            if indexer is None:
+                indexer = indexers[folder] = IncrementalIndexer(folder, cache, store, prefer_fast, dedup)
+                indexer.load(parallel=False)
+                continue
+            changes = indexer.refresh()
+            if has_changes(changes):
+                summary = ", ".join(f"{len(paths)} {kind}" for kind, paths in changes.items() if paths)
+                log(f"{folder}: re-indexed ({summary})")
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-ingest study folders into the corpus store")
+    parser.add_argument("--base", default=".", help="folder containing the module folders")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes (default: CPU count)")
+    parser.add_argument("--pdf-backend", default="auto", choices=["auto"] + list(PDF_BACKENDS),
+                        help="PDF extraction backend (default: benchmark and pick the fastest)")
+    parser.add_argument("--all-formats", action="store_true",
+                        help="keep every format of a document instead of the fastest to parse")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="do not remove near-duplicate files and sections")
+    parser.add_argument("--watch", type=float, metavar="SECONDS", default=None,
+                        help="after indexing, poll for file changes at this interval")
+    args = parser.parse_args(argv)
+    prefer_fast = not args.all_formats
+    dedup = not args.keep_duplicates
+    select_pdf_backend(args.base, args.pdf_backend)
+    preindex(args.base, workers=args.workers, prefer_fast=prefer_fast, dedup=dedup)
+    if args.watch:
+        try:
+            watch(args.base, interval=args.watch, prefer_fast=prefer_fast, dedup=dedup)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
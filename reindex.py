@@ -0,0 +1,178 @@
+"""Incremental re-indexing of a study folder driven by file change detection"""
+import os
+import threading
+import time
+from pathlib import Path
+
+from corpus import build_folder_corpus, corpus_variant, folder_signature
+from ingest import file_digest, is_supported_file, list_folder_files, pick_cheapest_sources
+
+CHANGE_KINDS = ('added', 'changed', 'removed')
+
+
+def scan_folder(folder_path):
+    """{path: (size, mtime_ns)} for the supported files in a folder, via os.scandir"""
+    found = {}
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_file() and is_supported_file(entry.name):
+                stat = entry.stat()
+                found[str(Path(folder_path) / entry.name)] = (stat.st_size, stat.st_mtime_ns)
+    return found
+
+
+class FolderManifest:
+    """Per-file size, mtime and content hash for one folder.
+
+    update() rescans the folder and returns what was added, changed or
+    removed. A file whose size/mtime moved but whose bytes hash the same
+    (e.g. it was only touched) is not reported as changed, only as touched.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+
+    def update(self, folder_path):
+        current = scan_folder(folder_path)
+        changes = {'added': [], 'changed': [], 'removed': [], 'touched': []}
+
+        for path in sorted(set(self.entries) - set(current)):
+            del self.entries[path]
+            changes['removed'].append(path)
+
+        for path, (size, mtime_ns) in sorted(current.items()):
+            known = self.entries.get(path)
+            if known and known['size'] == size and known['mtime_ns'] == mtime_ns:
+                continue
+            digest = file_digest(path)
+            self.entries[path] = {'size': size, 'mtime_ns': mtime_ns, 'digest': digest}
+            if known is None:
+                changes['added'].append(path)
+            elif known['digest'] != digest:
+                changes['changed'].append(path)
+            else:
+                changes['touched'].append(path)
+        return changes
+
+    def revert(self, paths, previous):
+        """Put the entries for paths back to what they were in previous, so the next update sees them again"""
+        for path in map(str, paths):
+            if path in previous:
+                self.entries[path] = previous[path]
+            else:
+                self.entries.pop(path, None)
+
+
+def has_changes(changes):
+    return bool(changes and any(changes.get(kind) for kind in CHANGE_KINDS))
+
+
+class IncrementalIndexer:
+    """Keeps one folder's all-files corpus in sync with the files on disk.
+
+    Unchanged files come straight out of the extraction cache, so a refresh
+    only extracts the files that were added or changed. A refresh builds a
+    new Corpus and swaps it in as self.corpus in one assignment, so readers
+    holding the previous one keep a consistent snapshot. Every listener
+    registered with subscribe() is called with (corpus, changes) so
+    downstream indexes can follow.
+
+    Files that fail to extract are left out of the saved manifest, so the
+    next refresh tries them again. When files are only touched, the stored
+    corpus is re-keyed to the new folder_signature instead of rebuilt.
+    """
+
+    def __init__(self, folder, cache, store, prefer_fast=True, dedup=True):
+        self.folder = str(folder)
+        self.cache = cache
+        self.store = store
+        self.prefer_fast = prefer_fast
+        self.dedup = dedup
+        self.corpus = None
+        self.report = None
+        self.signature = None
+        self.skipped = []
+        self.manifest = FolderManifest(store.load_manifest(self.folder))
+        self.last_poll = 0.0
+        self.listeners = []
+        self._lock = threading.RLock()
+
+    @property
+    def variant(self):
+        return corpus_variant(self.prefer_fast, self.dedup)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _install(self, corpus, report, skipped, changes, signature):
+        self.corpus = corpus
+        self.report = report
+        self.skipped = skipped
+        self.signature = signature
+        for listener in self.listeners:
+            listener(self.corpus, changes)
+
+    def _build(self, files, parallel, on_progress, errors):
+        """Build and store the corpus; the signature is None when it was not stored"""
+        corpus, report, skipped = build_folder_corpus(
+            files, cache=self.cache, prefer_fast=self.prefer_fast, dedup=self.dedup,
+            parallel=parallel, on_progress=on_progress, errors=errors
+        )
+        signature = None
+        if corpus and not errors:
+            signature = folder_signature(files)
+            self.store.save(self.folder, self.variant, signature, corpus, report)
+        return corpus, report, skipped, signature
+
+    def load(self, parallel=True, on_progress=None, errors=None):
+        """Load the corpus from the store, building it if stale; returns True if it came from the store"""
+        with self._lock:
+            errors = errors if errors is not None else []
+            files = list_folder_files(self.folder)
+            signature = folder_signature(files)
+            stored = self.store.load(self.folder, self.variant, signature)
+            if stored is not None:
+                corpus, report = stored
+                skipped = pick_cheapest_sources(files)[1] if self.prefer_fast else []
+            else:
+                corpus, report, skipped, signature = self._build(files, parallel, on_progress, errors)
+            previous = dict(self.manifest.entries)
+            changes = self.manifest.update(self.folder)
+            self.manifest.revert([path for path, _ in errors], previous)
+            self.store.save_manifest(self.folder, self.manifest.entries)
+            self.last_poll = time.monotonic()
+            self._install(corpus, report, skipped, changes, signature)
+            return stored is not None
+
+    def refresh(self, parallel=False, errors=None):
+        """Re-index if files were added, changed or removed; returns the changes or None"""
+        with self._lock:
+            self.last_poll = time.monotonic()
+            errors = errors if errors is not None else []
+            previous = dict(self.manifest.entries)
+            changes = self.manifest.update(self.folder)
+            if not has_changes(changes):
+                if changes['touched']:
+                    self._follow_touch()
+                    self.store.save_manifest(self.folder, self.manifest.entries)
+                return None
+            files = list_folder_files(self.folder)
+            corpus, report, skipped, signature = self._build(files, parallel, None, errors)
+            self.manifest.revert([path for path, _ in errors], previous)
+            self.store.save_manifest(self.folder, self.manifest.entries)
+            self._install(corpus, report, skipped, changes, signature)
+            return changes
+
+    def _follow_touch(self):
+        """Re-key the stored corpus to the folder's new signature after files were only touched"""
+        if self.signature is None:
+            return
+        signature = folder_signature(list_folder_files(self.folder))
+        if self.store.update_signature(self.folder, self.variant, self.signature, signature):
+            self.signature = signature
+
+    def poll(self, min_interval=5.0):
+        """refresh(), at most once per min_interval seconds"""
+        if time.monotonic() - self.last_poll < min_interval:
+            return None
+        return self.refresh()
@@ -0,0 +1,134 @@
+"""Stable-prefix prompt layout and an on-disk cache of model responses"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from ingest import CACHE_DIR
+
+DEFAULT_RESPONSE_CACHE_PATH = CACHE_DIR / "responses.sqlite3"
+DEFAULT_RESPONSE_TTL = 7 * 24 * 3600
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+PROMPT_LAYOUT_VERSION = 1
+
+
+def build_prompt(context, instructions, context_label="Study material"):
+    """Context first, instructions last.
+
+    Every prompt over the same material then starts with the same bytes, so
+    provider-side prefix caching can reuse it and only the short instruction
+    tail differs between tools and generations.
+    """
+    return f"{context_label}:\n{context}\n\n---\n\n{instructions}"
+
+
+def prompt_digest(prompt):
+    return hashlib.sha256(prompt.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def response_key(model, prompt, params=None):
+    """Cache key for (model, prompt hash, request parameters)"""
+    payload = json.dumps(
+        [PROMPT_LAYOUT_VERSION, model, prompt_digest(prompt), params or {}], sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Model responses keyed by response_key, with a TTL and LRU eviction.
+
+    Entries older than ttl seconds are treated as misses and removed; once
+    the compressed total exceeds max_bytes the least recently used entries
+    are evicted, as in ExtractionCache.
+    """
+
+    def __init__(self, path=DEFAULT_RESPONSE_CACHE_PATH, ttl=DEFAULT_RESPONSE_TTL,
+                 max_bytes=DEFAULT_RESPONSE_CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response BLOB, nbytes INTEGER, "
+                "created REAL, last_used REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_used)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, model, prompt, params=None):
+        """Return (response, created timestamp) or None on a miss"""
+        key = response_key(model, prompt, params)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.expirations += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return zlib.decompress(row[0]).decode('utf-8'), row[1]
+
+    def put(self, model, prompt, response, params=None):
+        blob = zlib.compress(response.encode('utf-8'))
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, nbytes, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (response_key(model, prompt, params), model, blob, len(blob), now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        expired = conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+        self.expirations += max(expired, 0)
+        total = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, nbytes in conn.execute(
+            "SELECT key, nbytes FROM responses ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= nbytes
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            entries, nbytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'expirations': self.expirations,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': nbytes,
+        }
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM responses")
@@ -0,0 +1,196 @@
+"""Corpus chunking and BM25 passage retrieval"""
+import heapq
+import math
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from dedup import estimate_tokens
+
+DEFAULT_CHUNK_WORDS = 180
+DEFAULT_OVERLAP_WORDS = 40
+DEFAULT_TOP_K = 6
+DEFAULT_CONTEXT_TOKENS = 3000
+
+_WORD_RE = re.compile(r'\S+')
+_TOKEN_RE = re.compile(r'[a-z0-9_$#]+')
+_HEADING_RE = re.compile(r'^(#{1,6} .+|[A-Z0-9][A-Z0-9 ,:&/()\-]{3,80}|\d+(\.\d+)*\.? [A-Z].{0,80})$')
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its
+of on or that the their then there these this to was what when where which who why will
+with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercase search terms (keeps Oracle-style names like v$session, dba_users)"""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class Chunks:
+    """Overlapping passages of a Corpus, stored as offsets into its text"""
+
+    __slots__ = ('corpus', 'starts', 'ends', 'files', 'pages')
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.files = array('I')
+        self.pages = array('I')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text(self, index):
+        return self.corpus.text[self.starts[index]:self.ends[index]]
+
+    def label(self, index):
+        """Human-readable source, e.g. 'backup.pdf, p. 4'"""
+        name = self.corpus.names[self.files[index]]
+        page = self.pages[index]
+        return f"{name}, p. {page}" if page else name
+
+
+def _break_points(text, start, end, page_starts):
+    """Word offsets where a chunk may end cleanly: page starts and heading lines"""
+    points = {offset for offset in page_starts if start < offset < end}
+    position = start
+    for line in text[start:end].splitlines(keepends=True):
+        stripped = line.strip()
+        if position > start and stripped and len(stripped) <= 90 and _HEADING_RE.match(stripped):
+            points.add(position + (len(line) - len(line.lstrip())))
+        position += len(line)
+    return points
+
+
+def chunk_corpus(corpus, max_words=DEFAULT_CHUNK_WORDS, overlap_words=DEFAULT_OVERLAP_WORDS):
+    """Split every file of a corpus into overlapping, page- and heading-aware chunks.
+
+    Chunks never cross files. A chunk holds up to max_words words and is cut
+    early at a page start or heading when one falls in its last third; the
+    next chunk repeats the last overlap_words words unless the cut was at such
+    a boundary.
+    """
+    chunks = Chunks(corpus)
+    text = corpus.text
+    for file_index in range(corpus.file_count):
+        start, end = corpus.file_span(file_index)
+        lo = corpus.file_first_page[file_index]
+        hi = corpus.file_first_page[file_index + 1] if file_index + 1 < corpus.file_count else len(corpus.page_starts)
+        page_starts = corpus.page_starts[lo:hi]
+        words = [(m.start(), m.end()) for m in _WORD_RE.finditer(text, start, end)]
+        if not words:
+            continue
+        word_starts = [word_start for word_start, _ in words]
+        breaks = {
+            bisect_left(word_starts, offset)
+            for offset in _break_points(text, start, end, page_starts)
+        }
+
+        first = 0
+        while first < len(words):
+            last = min(first + max_words, len(words))
+            cut_at_break = False
+            if last < len(words):
+                earliest = first + (2 * max_words) // 3
+                for candidate in range(last - 1, earliest - 1, -1):
+                    if candidate in breaks:
+                        last = candidate
+                        cut_at_break = True
+                        break
+            chunk_start = words[first][0]
+            chunk_end = words[last - 1][1]
+            chunks.starts.append(chunk_start)
+            chunks.ends.append(chunk_end)
+            chunks.files.append(file_index)
+            chunks.pages.append(corpus.page_at(chunk_start)[1] or 0)
+            if last >= len(words):
+                break
+            first = last if cut_at_break else max(last - overlap_words, first + 1)
+    return chunks
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over a Chunks collection"""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = array('I')
+        started = time.perf_counter()
+        for chunk_id in range(len(chunks)):
+            terms = Counter(tokenize(chunks.text(chunk_id)))
+            self.lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                ids, freqs = self.postings.setdefault(term, (array('I'), array('I')))
+                ids.append(chunk_id)
+                freqs.append(freq)
+        count = len(chunks)
+        self.average_length = (sum(self.lengths) / count) if count else 0.0
+        self.idf = {
+            term: math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+            for term, (ids, _) in self.postings.items()
+        }
+        self.build_seconds = time.perf_counter() - started
+
+    def search(self, query, k=DEFAULT_TOP_K):
+        """Top-k (chunk_id, score) pairs for a query, best first"""
+        scores = {}
+        k1, b = self.k1, self.b
+        average = self.average_length or 1.0
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            idf = self.idf[term]
+            ids, freqs = self.postings[term]
+            for chunk_id, freq in zip(ids, freqs):
+                norm = k1 * (1 - b + b * self.lengths[chunk_id] / average)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (k1 + 1) / (freq + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def select_within_budget(chunks, ranked, max_tokens=DEFAULT_CONTEXT_TOKENS):
+    """Keep ranked chunk ids, best first, until the token budget is used up"""
+    selected = []
+    used = 0
+    for chunk_id, _ in ranked:
+        cost = estimate_tokens(chunks.text(chunk_id))
+        if selected and used + cost > max_tokens:
+            break
+        selected.append(chunk_id)
+        used += cost
+    return selected, used
+
+
+def format_passages(chunks, chunk_ids):
+    """Passages with source labels, in document order"""
+    return "\n\n".join(
+        f"[Source: {chunks.label(chunk_id)}]\n{chunks.text(chunk_id)}"
+        for chunk_id in sorted(chunk_ids, key=lambda i: chunks.starts[i])
+    )
+
+
+def retrieve_context(index, query, k=DEFAULT_TOP_K, max_tokens=DEFAULT_CONTEXT_TOKENS):
+    """Top-k passages for a query, trimmed to a token budget.
+
+    Returns (context text, stats) where stats has the chunk ids, the total
+    chunk count, their source labels, the estimated token count and the
+    retrieval time in ms.
+    """
+    started = time.perf_counter()
+    ranked = index.search(query, k=k)
+    selected, tokens = select_within_budget(index.chunks, ranked, max_tokens)
+    context = format_passages(index.chunks, selected)
+    return context, {
+        'chunk_ids': selected,
+        'chunk_total': len(index.chunks),
+        'sources': [index.chunks.label(chunk_id) for chunk_id in selected],
+        'tokens': tokens,
+        'latency_ms': (time.perf_counter() - started) * 1000,
+    }
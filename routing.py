@@ -0,0 +1,228 @@
+"""Per-task model routing with latency and error tracking and failover"""
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from llm_client import is_retryable
+
+ROUTES_ENV = "STUDY_LLM_ROUTES"
+DEFAULT_MODEL = "openrouter/free"
+TASKS = (
+    'chat', 'summary', 'concepts', 'questions', 'practice_test',
+    'cheat_sheet', 'memory_aid', 'study_plan',
+)
+DEFAULT_ROUTES = {task: [DEFAULT_MODEL] for task in TASKS}
+HEALTH_WINDOW = 50
+MIN_SAMPLES = 5
+MAX_ERROR_RATE = 0.5
+SLOWER_RATIO = 1.5
+COOLDOWN_SECONDS = 60.0
+# Status codes meaning this model (not the request) is the problem, e.g. an unknown model id
+MODEL_ERROR_STATUS = frozenset({404})
+
+
+def load_routes(value=None):
+    """Routes from value or $STUDY_LLM_ROUTES: JSON (or a path to a JSON file)
+    mapping task to an ordered model list, with "*" as the default chain"""
+    value = value if value is not None else os.environ.get(ROUTES_ENV, "")
+    routes = {task: list(models) for task, models in DEFAULT_ROUTES.items()}
+    if not value.strip():
+        return routes
+    if not value.lstrip().startswith('{'):
+        value = Path(value).read_text(encoding='utf-8')
+    configured = json.loads(value)
+    default = configured.pop('*', None)
+    if default:
+        routes = {task: list(default) for task in routes}
+    for task, models in configured.items():
+        routes[task] = [models] if isinstance(models, str) else list(models)
+    return routes
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def fails_over(error):
+    """Whether another model might succeed where this one raised error: timeouts,
+    connection problems, rate limits and 5xx (once the client's own retries
+    are spent) or a model-specific failure. Anything else (auth, bad request,
+    replay misses, bugs) would fail the same way on every model."""
+    return is_retryable(error) or getattr(error, 'status_code', None) in MODEL_ERROR_STATUS
+
+
+class ModelHealth:
+    """Rolling latency and outcome of one model's recent calls for one task"""
+
+    def __init__(self, window=HEALTH_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.calls = 0
+        self.last_failure = None
+
+    def record(self, seconds, ok, now):
+        self.samples.append((seconds, ok))
+        self.calls += 1
+        if not ok:
+            self.last_failure = now
+
+    def latency(self, q):
+        values = [seconds for seconds, ok in self.samples if ok]
+        return percentile(values, q) if values else None
+
+    @property
+    def error_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def degraded(self, now):
+        """Failing too often lately; after COOLDOWN_SECONDS it gets another try"""
+        recent = list(self.samples)[-MIN_SAMPLES:]
+        failures = sum(1 for _, ok in recent if not ok)
+        if not recent or failures / len(recent) < MAX_ERROR_RATE or failures < 2:
+            return False
+        return now - self.last_failure < COOLDOWN_SECONDS
+
+
+class ModelRouter:
+    """Maps tasks to ordered model chains and picks the order per call.
+
+    The configured order is kept except that degraded models (too many
+    recent errors) go last until their cooldown passes, and models whose
+    p50 latency for the task is over SLOWER_RATIO times the fastest
+    healthy model's go after the faster ones. Calls fail over down the
+    chain on empty responses and errors that fails_over() accepts,
+    recording each model's latency and outcome; other errors are raised
+    at once without counting against the model.
+    """
+
+    def __init__(self, routes=None, clock=time.monotonic):
+        self.routes = routes or load_routes()
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._health = {}
+
+    def chain(self, task):
+        return self.routes.get(task) or self.routes.get('chat') or [DEFAULT_MODEL]
+
+    def primary(self, task):
+        """The configured first choice: used for cache keys and prompt budgets"""
+        return self.chain(task)[0]
+
+    def _health_of(self, task, model):
+        key = (task, model)
+        if key not in self._health:
+            self._health[key] = ModelHealth()
+        return self._health[key]
+
+    def order(self, task):
+        """The task's models in the order to try them now"""
+        now = self.clock()
+        with self._lock:
+            health = {model: self._health_of(task, model) for model in self.chain(task)}
+            healthy = [model for model in health if not health[model].degraded(now)]
+            medians = {
+                model: health[model].latency(50) for model in healthy
+                if len(health[model].samples) >= MIN_SAMPLES and health[model].latency(50) is not None
+            }
+        fastest = min(medians.values(), default=None)
+        fast = [m for m in healthy if fastest is None or medians.get(m, fastest) <= SLOWER_RATIO * fastest]
+        slow = [m for m in healthy if m not in fast]
+        return fast + slow + [m for m in health if m not in healthy]
+
+    def record(self, task, model, seconds, ok):
+        with self._lock:
+            self._health_of(task, model).record(seconds, ok, self.clock())
+
+    def call(self, task, request):
+        """request(model) -> text, tried down the chain until one succeeds"""
+        error = None
+        for model in self.order(task):
+            started = self.clock()
+            try:
+                result = request(model)
+            except Exception as e:
+                if not fails_over(e):
+                    raise
+                self.record(task, model, self.clock() - started, False)
+                error = e
+                continue
+            self.record(task, model, self.clock() - started, bool(result))
+            if result:
+                return result
+        if error is not None:
+            raise error
+        return None
+
+    async def acall(self, task, request):
+        """Async call(): request(model) is a coroutine function"""
+        error = None
+        for model in self.order(task):
+            started = self.clock()
+            try:
+                result = await request(model)
+            except Exception as e:
+                if not fails_over(e):
+                    raise
+                self.record(task, model, self.clock() - started, False)
+                error = e
+                continue
+            self.record(task, model, self.clock() - started, bool(result))
+            if result:
+                return result
+        if error is not None:
+            raise error
+        return None
+
+    def stream(self, task, request):
+        """Yield from request(model), failing over only until the first piece arrives"""
+        error = None
+        for model in self.order(task):
+            started = self.clock()
+            try:
+                pieces = iter(request(model))
+                first = next(pieces)
+            except StopIteration:
+                self.record(task, model, self.clock() - started, False)
+                continue
+            except Exception as e:
+                if not fails_over(e):
+                    raise
+                self.record(task, model, self.clock() - started, False)
+                error = e
+                continue
+            yield first
+            try:
+                yield from pieces
+            except Exception as e:
+                if fails_over(e):
+                    self.record(task, model, self.clock() - started, False)
+                raise
+            self.record(task, model, self.clock() - started, True)
+            return
+        if error is not None:
+            raise error
+
+    def stats(self):
+        """One row per (task, model) that has been called"""
+        now = self.clock()
+        with self._lock:
+            return [
+                {
+                    'task': task,
+                    'model': model,
+                    'calls': health.calls,
+                    'p50_seconds': health.latency(50),
+                    'p95_seconds': health.latency(95),
+                    'error_rate': health.error_rate,
+                    'degraded': health.degraded(now),
+                }
+                for (task, model), health in sorted(self._health.items())
+                if health.calls
+            ]
@@ -0,0 +1,255 @@
+"""Process-wide LLM request scheduling: rate limit, concurrency cap, fair queuing"""
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+from llm_client import _env_number
+from telemetry import note
+
+RATE_ENV = "STUDY_LLM_RATE_PER_MINUTE"
+BURST_ENV = "STUDY_LLM_BURST"
+CONCURRENCY_ENV = "STUDY_LLM_CONCURRENCY"
+DEFAULT_RATE_PER_MINUTE = 60.0
+DEFAULT_BURST = 5
+DEFAULT_CONCURRENCY = 4
+DEFAULT_SERVICE_SECONDS = 10.0
+SERVICE_SMOOTHING = 0.2
+STATUS_INTERVAL = 0.5
+
+
+class AcquireCancelled(Exception):
+    """A waiting request was cancelled before it was admitted"""
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most capacity (the allowed burst)"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available (0 if one is now)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class LlmScheduler:
+    """Admits LLM requests from every session through one gate.
+
+    A request starts only when it is next in line, fewer than
+    max_concurrency requests are in flight and the token bucket has a
+    token. Sessions take turns: the next request comes from the session
+    after the one served last, so one session queueing many requests
+    delays each other session by at most one request per turn. Thread-safe;
+    waiting callers are told their queue position and an estimated wait.
+    """
+
+    def __init__(self, rate_per_minute=None, burst=None, max_concurrency=None, clock=time.monotonic):
+        rate_per_minute = rate_per_minute or _env_number(RATE_ENV, DEFAULT_RATE_PER_MINUTE)
+        self.max_concurrency = max(1, max_concurrency or _env_number(CONCURRENCY_ENV, DEFAULT_CONCURRENCY, int))
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst or _env_number(BURST_ENV, DEFAULT_BURST, int), clock)
+        self.clock = clock
+        self._condition = threading.Condition()
+        self._queues = OrderedDict()
+        self._tickets = itertools.count()
+        self.active = 0
+        self.service_seconds = DEFAULT_SERVICE_SECONDS
+        self.counters = {'admitted': 0, 'queued': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+
+    def _next(self):
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def _position(self, session_id, ticket):
+        """Requests that will start before ticket under round-robin order"""
+        rounds = self._queues[session_id].index(ticket)
+        ahead = rounds
+        mine_seen = False
+        for other, queue in self._queues.items():
+            if other == session_id:
+                mine_seen = True
+                continue
+            # Sessions ahead of ours in the rotation get one more turn first
+            ahead += min(len(queue), rounds + (0 if mine_seen else 1))
+        return ahead
+
+    def _eta(self, position):
+        """Rough seconds until a request at position starts"""
+        throughput = min(self.bucket.rate, self.max_concurrency / max(self.service_seconds, 0.1))
+        busy = self.service_seconds if self.active >= self.max_concurrency else 0.0
+        return busy + position / throughput
+
+    def acquire(self, session_id, on_wait=None, cancelled=None):
+        """Block until this request may start; returns a ticket for release().
+
+        on_wait(position, eta_seconds) is called about every STATUS_INTERVAL
+        while waiting, and once with (None, 0) when the request is admitted
+        after having waited. Setting the cancelled Event makes a waiting call
+        leave the queue and raise AcquireCancelled.
+        """
+        enqueued = self.clock()
+        waited = False
+        with self._condition:
+            ticket = next(self._tickets)
+            self._queues.setdefault(session_id, deque()).append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    if cancelled is not None and cancelled.is_set():
+                        raise AcquireCancelled()
+                    if self._next() == ticket and self.active < self.max_concurrency:
+                        delay = self.bucket.delay()
+                        if delay == 0:
+                            self._admit(session_id)
+                            break
+                    else:
+                        delay = STATUS_INTERVAL
+                    position = self._position(session_id, ticket)
+                    eta = self._eta(position)
+                    self._condition.wait(min(delay, STATUS_INTERVAL))
+                waited = True
+                if on_wait:
+                    on_wait(position, eta)
+        except BaseException:
+            # Abandoned (e.g. the script was stopped): leave the queue
+            self._withdraw(session_id, ticket)
+            raise
+        wait = self.clock() - enqueued
+        with self._condition:
+            self.counters['queued'] += waited
+            self.counters['wait_seconds'] += wait
+            self.counters['max_wait_seconds'] = max(self.counters['max_wait_seconds'], wait)
+        note(queue_seconds=wait)
+        if waited and on_wait:
+            on_wait(None, 0.0)
+        return self.clock()
+
+    async def aacquire(self, session_id, on_wait=None):
+        """Async acquire(), waiting in a worker thread.
+
+        If the awaiting task is cancelled, the waiting thread leaves the
+        queue, and a slot it was granted in the meantime is released, so a
+        stopped run never holds a slot.
+        """
+        cancelled = threading.Event()
+        handoff = threading.Lock()
+        granted = []
+
+        def wait():
+            started = self.acquire(session_id, on_wait, cancelled)
+            with handoff:
+                if cancelled.is_set():
+                    self.release(started)
+                else:
+                    granted.append(started)
+            return started
+
+        try:
+            return await asyncio.to_thread(wait)
+        except asyncio.CancelledError:
+            with handoff:
+                cancelled.set()
+                if granted:
+                    self.release(granted[0])
+            raise
+
+    def _withdraw(self, session_id, ticket):
+        with self._condition:
+            queue = self._queues.get(session_id)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[session_id]
+                self._condition.notify_all()
+
+    def _admit(self, session_id):
+        queue = self._queues.pop(session_id)
+        queue.popleft()
+        if queue:
+            # Back of the rotation: every other waiting session goes first
+            self._queues[session_id] = queue
+        self.bucket.take()
+        self.active += 1
+        self.counters['admitted'] += 1
+        self._condition.notify_all()
+
+    def release(self, started):
+        """Finish a request admitted at started (the ticket from acquire())"""
+        with self._condition:
+            self.active -= 1
+            elapsed = self.clock() - started
+            self.service_seconds += SERVICE_SMOOTHING * (elapsed - self.service_seconds)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self.counters)
+            stats['active'] = self.active
+            stats['waiting'] = sum(len(queue) for queue in self._queues.values())
+            stats['sessions_waiting'] = len(self._queues)
+            stats['service_seconds'] = self.service_seconds
+        stats['mean_wait_seconds'] = (stats['wait_seconds'] / stats['admitted']) if stats['admitted'] else 0.0
+        return stats
+
+
+class ScheduledLlm:
+    """One session's view of an LLM backend, with every request admitted by a scheduler.
+
+    Has the backend's interface (complete, stream, async_client/acomplete,
+    stats), so it can be handed to anything that takes a ClientPool.
+    """
+
+    def __init__(self, backend, scheduler, session_id, on_wait=None):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.on_wait = on_wait
+
+    @property
+    def requires_api_key(self):
+        return self.backend.requires_api_key
+
+    def complete(self, api_key, prompt, model):
+        started = self.scheduler.acquire(self.session_id, self.on_wait)
+        try:
+            return self.backend.complete(api_key, prompt, model)
+        finally:
+            self.scheduler.release(started)
+
+    def stream(self, api_key, prompt, model):
+        started = self.scheduler.acquire(self.session_id, self.on_wait)
+        try:
+            yield from self.backend.stream(api_key, prompt, model)
+        finally:
+            self.scheduler.release(started)
+
+    def async_client(self, api_key):
+        return self.backend.async_client(api_key)
+
+    async def acomplete(self, client, prompt, model):
+        started = await self.scheduler.aacquire(self.session_id, self.on_wait)
+        try:
+            return await self.backend.acomplete(client, prompt, model)
+        finally:
+            self.scheduler.release(started)
+
+    def stats(self):
+        return self.backend.stats()
@@ -0,0 +1,181 @@
+"""Coalescing of identical in-flight LLM requests (singleflight)"""
+import asyncio
+import hashlib
+import re
+import threading
+from concurrent.futures import Future
+
+from packing import count_tokens
+from telemetry import note
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalise_prompt(prompt):
+    """Prompts differing only in whitespace are the same request"""
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def flight_key(model, prompt, credentials=None):
+    """Requests coalesce only with the same model, prompt and credentials (an
+    API key, or the client carrying one), so no caller gets an answer paid
+    for or authorised by another key"""
+    identity = hashlib.sha256(str(credentials).encode('utf-8', 'surrogatepass')).hexdigest()[:16]
+    return model, identity, hashlib.sha256(normalise_prompt(prompt).encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class _Abandoned(Exception):
+    """The leading caller went away before finishing; followers try again"""
+
+
+class Singleflight:
+    """At most one call per key in flight; later callers share its result.
+
+    The first caller for a key (the leader) runs the call. Callers arriving
+    while it runs wait on the leader's future instead of repeating it and
+    receive its result or exception. If the leader is interrupted (e.g. its
+    script was stopped), waiting callers retry and one becomes the new
+    leader. Works for threads and coroutines alike.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.counters = {'calls': 0, 'coalesced': 0, 'tokens_saved': 0}
+
+    def _join(self, key):
+        """(future, is leader)"""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = self._flights[key] = Future()
+            self.counters['calls'] += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._flights.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _saved(self, prompt, result):
+        note(coalesced=True)
+        tokens = count_tokens(prompt) + (count_tokens(result) if result else 0)
+        with self._lock:
+            self.counters['coalesced'] += 1
+            self.counters['tokens_saved'] += tokens
+
+    def do(self, key, prompt, call):
+        """call()'s result, shared with any identical call already in flight"""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = call()
+                except Exception as e:
+                    self._finish(key, future, error=e)
+                    raise
+                except BaseException:
+                    self._finish(key, future, error=_Abandoned())
+                    raise
+                self._finish(key, future, result)
+                return result
+            try:
+                result = future.result()
+            except _Abandoned:
+                continue
+            self._saved(prompt, result)
+            return result
+
+    async def ado(self, key, prompt, call):
+        """Async do(): call is a coroutine function"""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = await call()
+                except Exception as e:
+                    self._finish(key, future, error=e)
+                    raise
+                except BaseException:
+                    self._finish(key, future, error=_Abandoned())
+                    raise
+                self._finish(key, future, result)
+                return result
+            try:
+                result = await asyncio.wrap_future(future)
+            except _Abandoned:
+                continue
+            self._saved(prompt, result)
+            return result
+
+    def stream(self, key, prompt, stream):
+        """Yield stream()'s pieces; a caller joining an identical flight gets
+        the leader's full text as one piece once it is done"""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                pieces = []
+                try:
+                    for piece in stream():
+                        pieces.append(piece)
+                        yield piece
+                except Exception as e:
+                    self._finish(key, future, error=e)
+                    raise
+                except BaseException:
+                    self._finish(key, future, error=_Abandoned())
+                    raise
+                self._finish(key, future, "".join(pieces))
+                return
+            try:
+                result = future.result()
+            except _Abandoned:
+                continue
+            self._saved(prompt, result)
+            if result:
+                yield result
+            return
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = len(self._flights)
+        return stats
+
+
+class CoalescedLlm:
+    """An LLM backend (or session view of one) whose identical requests share one call"""
+
+    def __init__(self, llm, flights):
+        self.llm = llm
+        self.flights = flights
+
+    @property
+    def requires_api_key(self):
+        return self.llm.requires_api_key
+
+    def complete(self, api_key, prompt, model):
+        return self.flights.do(
+            flight_key(model, prompt, api_key), prompt, lambda: self.llm.complete(api_key, prompt, model)
+        )
+
+    def stream(self, api_key, prompt, model):
+        return self.flights.stream(
+            flight_key(model, prompt, api_key), prompt, lambda: self.llm.stream(api_key, prompt, model)
+        )
+
+    def async_client(self, api_key):
+        return self.llm.async_client(api_key)
+
+    async def acomplete(self, client, prompt, model):
+        return await self.flights.ado(
+            flight_key(model, prompt, getattr(client, 'api_key', client)), prompt,
+            lambda: self.llm.acomplete(client, prompt, model)
+        )
+
+    def stats(self):
+        return self.llm.stats()
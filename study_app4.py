@@ -1,11 +1,10 @@
 import streamlit as st
 import json
-from openai import OpenAI
 from datetime import datetime, timedelta
 import re
-import PyPDF2
 import io
 import os
+import time
 from pathlib import Path
 import random
 import hashlib
@@ -19,6 +18,36 @@ from reportlab.lib import colors
 from pypdf import PdfReader, PdfWriter
 import string
 import pandas as pd
+from ingest import (
+    ExtractionCache, iter_records, file_banner,
+    list_folders, list_folder_files, sample_pdfs, split_pages, LazyPdf, PDF_SELECTION_PATH
+)
+from pdf_backends import (
+    PDF_BACKEND_ENV, PDF_BACKENDS, active_pdf_backend, set_pdf_backend, auto_select_pdf_backend
+)
+from corpus import Corpus, CorpusStore
+from reindex import IncrementalIndexer
+from retrieval import (
+    BM25Index, chunk_corpus, format_passages, retrieve_context, DEFAULT_TOP_K, DEFAULT_CONTEXT_TOKENS
+)
+from vectors import load_or_build_vector_index, retrieve_context_batch
+from packing import context_budget, count_tokens, default_counter, fit_prompt
+from chunk_coverage import CoverageTracker, sample_budget
+from responses import ResponseCache, build_prompt
+from llm_backends import describe_backend, fixed_seed, make_llm_backend
+from scheduler import LlmScheduler, ScheduledLlm
+from singleflight import CoalescedLlm, Singleflight
+from routing import ModelRouter
+from telemetry import TelemetryLog
+from practice_test import (
+    merge_questions, parse_questions, plan_shards, practice_test_prompt,
+    shard_question_types, shard_request_size
+)
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from study_pack import PackTask, run_study_pack, DEFAULT_CONCURRENCY
+from summarize import (
+    SummaryCache, collapse_summaries, format_partials, map_summaries, summary_units, MAP_UNIT_TOKENS
+)
 
 # Page configuration
 st.set_page_config(
@@ -152,10 +181,14 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = hashlib.sha1(os.urandom(16)).hexdigest()[:12]
 if 'api_key' not in st.session_state:
     st.session_state.api_key = ""
 if 'document_content' not in st.session_state:
     st.session_state.document_content = ""
+if 'corpus' not in st.session_state:
+    st.session_state.corpus = None
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'generated_content' not in st.session_state:
@@ -174,6 +207,16 @@ if 'use_all_files' not in st.session_state:
     st.session_state.use_all_files = False
 if 'loaded_files_info' not in st.session_state:
     st.session_state.loaded_files_info = []
+if 'dedup_report' not in st.session_state:
+    st.session_state.dedup_report = None
+if 'folder_indexer' not in st.session_state:
+    st.session_state.folder_indexer = None
+if 'loaded_page_range' not in st.session_state:
+    st.session_state.loaded_page_range = None
+if 'token_log' not in st.session_state:
+    st.session_state.token_log = []
+if 'coverage_trackers' not in st.session_state:
+    st.session_state.coverage_trackers = {}
 if 'watermark_image' not in st.session_state:
     st.session_state.watermark_image = "the_coltap_logo.jpg"
 if 'generation_count' not in st.session_state:
@@ -278,81 +321,144 @@ def discover_folders(base_path="."):
     """Discover all subfolders"""
     folders = []
     try:
-        base = Path(base_path)
-        for item in base.iterdir():
-            if item.is_dir() and not item.name.startswith('.'):
-                folders.append(str(item))
-        folders.sort()
+        folders = list_folders(base_path)
     except Exception as e:
         st.error(f"Error discovering folders: {str(e)}")
     return folders
 
 def get_files_from_folder(folder_path):
     """Get list of supported files"""
-    supported_extensions = ['.txt', '.md', '.pdf']
-    files = []
     try:
-        folder = Path(folder_path)
-        for ext in supported_extensions:
-            files.extend(list(folder.glob(f'*{ext}')))
-        files.sort()
-        return files
+        return list_folder_files(folder_path)
     except Exception as e:
         st.error(f"Error reading folder: {str(e)}")
         return []
 
-def read_single_file(file_path):
-    """Read content from a file"""
+@st.cache_resource
+def get_extraction_cache():
+    """Process-wide extraction cache shared by all sessions"""
+    return ExtractionCache()
+
+def read_corpus(file_list, banner=True, parallel=True, on_progress=None):
+    """Read files into a Corpus"""
+    errors = []
+    records = iter_records(
+        file_list,
+        cache=get_extraction_cache(),
+        parallel=parallel,
+        on_progress=on_progress,
+        errors=errors
+    )
+    corpus = Corpus.from_records(records, banner=file_banner if banner else None)
+    
+    for file_path, error in errors:
+        st.warning(f"Could not read {file_path.name}: {error}")
+    
+    return corpus
+
+@st.cache_resource(max_entries=8)
+def get_lazy_pdf(file_path, mtime_ns, pdf_backend):
+    """Open a PDF for on-demand page extraction (shared while the file is unchanged)"""
+    return LazyPdf(file_path, pdf_backend)
+
+def read_pdf_pages(file_path, first_page, last_page):
+    """Read a page range of a PDF into a Corpus, extracting only those pages"""
+    file_path = Path(file_path)
     try:
-        file_path = Path(file_path)
-        if file_path.suffix == '.pdf':
-            with open(file_path, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                content = ""
-                for page in pdf_reader.pages:
-                    text = page.extract_text()
-                    if text:
-                        content += text + "\n"
-                return content, len(pdf_reader.pages)
+        cached = get_extraction_cache().get(file_path)
+        if cached is not None:
+            records = [
+                (file_path, page_no, text)
+                for page_no, text in split_pages(*cached)
+                if page_no is not None and first_page <= page_no <= last_page
+            ]
         else:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                return content, None
+            lazy_pdf = get_lazy_pdf(str(file_path), file_path.stat().st_mtime_ns, active_pdf_backend())
+            records = (
+                (file_path, page_no, text)
+                for page_no, text in lazy_pdf.iter_range(first_page, last_page)
+            )
+        return Corpus.from_records(records, banner=None)
     except Exception as e:
         st.error(f"Error reading file: {str(e)}")
-        return "", None
-
-def read_all_files(file_list):
-    """Read all files"""
-    combined_content = ""
-    files_info = []
-    total_pages = 0
-    total_words = 0
-    
-    for file_path in file_list:
-        try:
-            content, pages = read_single_file(file_path)
-            if content:
-                file_name = file_path.name
-                combined_content += f"\n\n{'='*80}\n"
-                combined_content += f"FILE: {file_name}\n"
-                combined_content += f"{'='*80}\n\n"
-                combined_content += content
-                
-                word_count = len(content.split())
-                files_info.append({
-                    'name': file_name,
-                    'pages': pages if pages else 'N/A',
-                    'words': word_count
-                })
-                
-                if pages:
-                    total_pages += pages
-                total_words += word_count
-        except Exception as e:
-            st.warning(f"Could not read {file_path.name}: {str(e)}")
-    
-    return combined_content, files_info, total_pages, total_words
+        return Corpus()
+
+@st.cache_resource
+def get_corpus_store():
+    """Prebuilt folder corpora (see preindex.py), warmed into memory at startup"""
+    store = CorpusStore()
+    store.warm()
+    return store
+
+ADMIN_ENV = "STUDY_ADMIN"
+
+def is_admin():
+    """Operator-only views and process-wide controls are shown when $STUDY_ADMIN is set"""
+    return os.environ.get(ADMIN_ENV, "").lower() in ("1", "true", "yes")
+
+def change_pdf_backend():
+    """on_change of the admin backend selector: the only place a widget sets the process-wide backend"""
+    chosen = st.session_state.pdf_backend_selector
+    set_pdf_backend(chosen)
+    get_pdf_backend_selection()['backend'] = chosen
+
+@st.cache_resource
+def get_pdf_backend_selection():
+    """Resolve the PDF backend once per process: $STUDY_PDF_BACKEND, or a benchmark when 'auto'"""
+    configured = os.environ.get(PDF_BACKEND_ENV, "auto")
+    if configured in PDF_BACKENDS:
+        set_pdf_backend(configured)
+        return {'backend': configured, 'results': []}
+    backend, results = auto_select_pdf_backend(sample_pdfs(list_folders(".")), PDF_SELECTION_PATH)
+    return {'backend': backend, 'results': results}
+
+@st.cache_resource
+def get_folder_indexer(folder, prefer_fast=True, dedup=True, pdf_backend=None):
+    """Incremental indexer for a folder's all-files corpus, shared by all sessions"""
+    return IncrementalIndexer(folder, get_extraction_cache(), get_corpus_store(), prefer_fast, dedup)
+
+def describe_changes(changes):
+    """Short summary of added/changed/removed files"""
+    parts = []
+    for kind, symbol in (('added', '+'), ('changed', '~'), ('removed', '-')):
+        if changes.get(kind):
+            parts.append(f"{symbol}{len(changes[kind])} {kind}")
+    return ", ".join(parts)
+
+def sync_folder_corpus(indexer):
+    """Point session state at the indexer's current corpus"""
+    corpus = indexer.corpus
+    st.session_state.folder_indexer = indexer
+    st.session_state.corpus = corpus
+    st.session_state.dedup_report = indexer.report
+    st.session_state.loaded_page_range = None
+    st.session_state.document_content = corpus.text
+    st.session_state.loaded_files_info = corpus.files_info()
+
+@st.cache_resource(max_entries=4)
+def get_retrieval_index(corpus_digest, _corpus):
+    """BM25 index over the chunks of a corpus, built once per distinct text"""
+    return BM25Index(chunk_corpus(_corpus))
+
+@st.cache_resource(max_entries=8)
+def get_vector_index(corpus_digest, folder, _corpus):
+    """TF-IDF vector index for a corpus, memory-mapped from the folder's saved copy when present"""
+    return load_or_build_vector_index(folder, _corpus)
+
+def focus_context(focus, k=12, max_tokens=6000):
+    """Passages most similar to comma-separated focus topics, or (None, None) without a focus"""
+    queries = [topic.strip() for topic in focus.split(",") if topic.strip()]
+    corpus = st.session_state.corpus
+    if not queries or not corpus:
+        return None, None
+    index = get_vector_index(corpus.digest(), str(st.session_state.selected_folder), corpus)
+    return retrieve_context_batch(index, queries, k=k, max_tokens=max_tokens)
+
+def retrieval_caption(stats):
+    return (
+        f"🔎 {len(stats['chunk_ids'])} of {stats['chunk_total']} passages · "
+        f"~{stats['tokens']:,} tokens · retrieved in {stats['latency_ms']:.1f} ms"
+    )
 
 def create_test_results_pdf(test_data, user_answers_data, detailed_results, watermark_path=None):
     """Create a comprehensive PDF with test questions, user answers, and results"""
@@ -663,40 +769,413 @@ def create_pdf_with_watermark(text_content, filename, watermark_image_path=None)
     buffer.seek(0)
     return buffer.getvalue()
 
-def get_ai_response(prompt, model="openrouter/free"):
-    """Get response from OpenRouter API"""
-    try:
-        client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=st.session_state.api_key,
+@st.cache_resource(max_entries=4)
+def get_packing_index(corpus_digest, _corpus):
+    """BM25 index over non-overlapping chunks, used to pack oversized prompts"""
+    return BM25Index(chunk_corpus(_corpus, overlap_words=0))
+
+def pack_prompt(prompt, task):
+    """Fit the prompt into the token budget of every model the task may be routed to,
+    and log original vs sent tokens"""
+    corpus = st.session_state.corpus
+    model = min(get_model_router().chain(task), key=context_budget)
+    prompt, packing = fit_prompt(
+        prompt, st.session_state.document_content, model,
+        index_factory=(lambda: get_packing_index(corpus.digest(), corpus)) if corpus else None
+    )
+    packing['time'] = datetime.now().strftime("%H:%M:%S")
+    packing['task'] = task
+    st.session_state.token_log = (st.session_state.token_log + [packing])[-50:]
+    if packing['packed']:
+        st.caption(
+            f"🧮 Prompt packed from ~{packing['original_tokens']:,} to ~{packing['sent_tokens']:,} tokens "
+            f"(budget {packing['budget']:,}): {packing['kept']} passages kept, "
+            f"{packing['summarised']} summarised, {packing['dropped']} dropped"
         )
+    return prompt
+
+@st.cache_resource
+def get_llm_pool():
+    """The LLM backend shared by all sessions: pooled OpenRouter clients, or the
+    offline fake / record-replay chosen by $STUDY_LLM_BACKEND and $STUDY_LLM_RECORD"""
+    return make_llm_backend()
+
+@st.cache_resource
+def get_llm_scheduler():
+    """Rate limit, concurrency cap and fair queuing shared by every session's LLM requests"""
+    return LlmScheduler()
+
+@st.cache_resource
+def get_singleflight():
+    """In-flight LLM requests shared across sessions, so identical ones are sent once"""
+    return Singleflight()
+
+def queue_notice():
+    """on_wait callback showing this session's queue position while a request waits"""
+    placeholder = None
+    
+    def on_wait(position, eta):
+        nonlocal placeholder
+        if get_script_run_ctx() is None:
+            # Worker threads can't draw; the request still waits its turn
+            return
+        if placeholder is None:
+            placeholder = st.empty()
+        if position is None:
+            placeholder.empty()
+        else:
+            ahead = f"{position} request{'s' if position != 1 else ''} ahead" if position else "next in line"
+            placeholder.info(f"⏳ Busy right now: {ahead}, starting in ~{eta:.0f}s")
+    return on_wait
+
+def get_llm():
+    """The shared LLM backend for this session: identical in-flight requests are
+    coalesced, then the rest go through the scheduler"""
+    return CoalescedLlm(
+        ScheduledLlm(get_llm_pool(), get_llm_scheduler(), st.session_state.session_id, queue_notice()),
+        get_singleflight()
+    )
+
+@st.cache_resource
+def get_model_router():
+    """Task → model chains ($STUDY_LLM_ROUTES) with latency/error tracking, shared by all sessions"""
+    return ModelRouter()
+
+@st.cache_resource
+def get_telemetry_log():
+    """Per-call LLM telemetry shared by all sessions"""
+    return TelemetryLog()
+
+def routed_completer(task):
+    """complete(prompt) for the task's model chain, recorded in telemetry;
+    safe to call from worker threads"""
+    api_key = st.session_state.api_key
+    session = st.session_state.session_id
+    llm = get_llm()
+    router = get_model_router()
+    telemetry = get_telemetry_log()
+    
+    def complete(prompt):
+        return router.call(task, lambda model: telemetry.track(
+            task, model, prompt, lambda: llm.complete(api_key, prompt, model), session
+        ))
+    return complete
+
+@st.cache_resource
+def get_summary_cache():
+    """Partial summary cache shared by all sessions"""
+    return SummaryCache()
+
+def summarize_corpus(corpus):
+    """Map step of the summary pipeline: per-file/section summaries (cached),
+    merged until they fit one reduce prompt. Returns the partials text or None."""
+    units = summary_units(corpus)
+    cache = get_summary_cache()
+    model = get_model_router().primary("summary")
+    complete = routed_completer("summary")
+    
+    progress = st.progress(0.0, text=f"Summarising {len(units)} sections...")
+    
+    def on_progress(done, total, label):
+        progress.progress(done / total, text=f"Summarised {done}/{total}: {label}")
+    
+    partials, stats = map_summaries(units, complete, cache, model, on_progress=on_progress)
+    progress.empty()
+    for error in stats['errors'][:3]:
+        st.error(f"Error communicating with API: {error}")
+    labels, partials = collapse_summaries([label for label, _ in units], partials, complete, cache, model)
+    st.caption(
+        f"🗺️ {stats['units']} sections: {stats['cached']} from cache, "
+        f"{stats['generated']} summarised, {stats['failed']} failed"
+    )
+    return format_partials(labels, partials) or None
+
+def get_coverage_tracker():
+    """This session's coverage of the loaded material, shared by the question and test generators"""
+    corpus = st.session_state.corpus
+    digest = corpus.digest()
+    key = (str(st.session_state.selected_folder), digest)
+    trackers = st.session_state.coverage_trackers
+    if key not in trackers:
+        trackers[key] = CoverageTracker(get_packing_index(digest, corpus).chunks, seed=fixed_seed())
+    return trackers[key]
+
+def sample_material(num_questions):
+    """Least-covered passages sized for num_questions questions, with a coverage caption"""
+    return sample_material_shards([num_questions])[0]
+
+def sample_material_shards(sizes):
+    """sample_material for several shards at once: each gets its own least-covered
+    passages, so shards draw on different parts of the material"""
+    if not st.session_state.corpus:
+        return [st.session_state.document_content] * len(sizes)
+    tracker = get_coverage_tracker()
+    samples = [tracker.sample(sample_budget(size)) for size in sizes]
+    st.caption(
+        f"🧭 {sum(len(chunk_ids) for chunk_ids in samples)} of {len(tracker.chunks)} passages this time · "
+        f"{tracker.coverage():.0%} of the material covered"
+        + (f" · pass {tracker.passes + 1}" if tracker.passes else "")
+    )
+    return [format_passages(tracker.chunks, chunk_ids) for chunk_ids in samples]
+
+@st.cache_resource
+def get_response_cache():
+    """On-disk cache of responses for tools that should not vary, shared by all sessions"""
+    return ResponseCache()
+
+def study_pack_tasks(keys):
+    """PackTasks for the chosen tools, using each tab's current settings.
+
+    Prompts are built and packed here on the script thread. Key Concepts and
+    Study Plan are answered from the response cache when possible and come
+    back as finished tasks.
+    """
+    text = st.session_state.document_content
+    corpus = st.session_state.corpus
+    tasks = []
+    for key in keys:
+        task = PackTask(key, STUDY_PACK_TOOLS[key])
+        if key == 'summary':
+            depth = st.session_state.get("tab1_summary_depth", "Brief")
+            suffix = uniqueness_instructions("summary")
+            if corpus and count_tokens(corpus.text) > MAP_UNIT_TOKENS:
+                units = summary_units(corpus)
+                cache = get_summary_cache()
+                model = get_model_router().primary("summary")
+                complete = routed_completer("summary")
+                
+                def prepare(units=units, depth=depth, suffix=suffix, cache=cache, model=model, complete=complete):
+                    partials, _ = map_summaries(units, complete, cache, model)
+                    labels, partials = collapse_summaries([label for label, _ in units], partials, complete, cache, model)
+                    return summary_prompt(depth, format_partials(labels, partials), sectioned=True) + suffix
+                task.prepare = prepare
+            else:
+                task.prompt = pack_prompt(summary_prompt(depth, text) + suffix, key)
+        elif key == 'concepts':
+            task.prompt = pack_prompt(key_concepts_prompt(text), key)
+        elif key == 'cheat_sheet':
+            cheat_sheet_format = st.session_state.get("tab3_cheat_sheet_format", "One-Page Summary")
+            task.prompt = pack_prompt(
+                add_uniqueness_instructions(cheat_sheet_prompt(cheat_sheet_format, text), "cheat_sheet"), key
+            )
+        elif key == 'memory_aid':
+            memory_tool = st.session_state.get("tab6_memory_tool", "Mnemonics")
+            task.prompt = pack_prompt(
+                add_uniqueness_instructions(memory_aid_prompt(memory_tool, text), "memory_aid"), key
+            )
+        elif key == 'study_plan':
+            exam_date = st.session_state.get("tab7_exam_date", datetime.now().date() + timedelta(days=14))
+            hours = st.session_state.get("tab7_study_hours", 2)
+            task.prompt = pack_prompt(
+                study_plan_prompt((exam_date - datetime.now().date()).days, hours, text), key
+            )
+        if key in ('concepts', 'study_plan'):
+            cached = get_response_cache().get(get_model_router().primary(key), task.prompt)
+            if cached is not None:
+                task.result, task.status, task.latency = cached[0], 'cached', 0.0
+        tasks.append(task)
+    return tasks
+
+def generate_study_pack(keys, concurrency=DEFAULT_CONCURRENCY):
+    """Generate several tools concurrently, storing each in generated_content as it completes"""
+    tasks = study_pack_tasks(keys)
+    router = get_model_router()
+    pending = [task for task in tasks if task.status == 'queued']
+    status_table = st.empty()
+    icons = {'queued': '⏳', 'running': '🔄', 'done': '✅', 'cached': '♻️', 'failed': '❌', 'cancelled': '⏹️'}
+    
+    def show_status(task=None):
+        if task is not None and task.status == 'done':
+            st.session_state.generated_content[task.key] = task.result
+            if task.key in ('concepts', 'study_plan'):
+                get_response_cache().put(router.primary(task.key), task.prompt, task.result)
+        status_table.dataframe(
+            pd.DataFrame([
+                {
+                    'Tool': t.label,
+                    'Status': f"{icons[t.status]} {t.status}",
+                    'Seconds': round(t.latency, 1) if t.latency is not None else None,
+                }
+                for t in tasks
+            ]),
+            hide_index=True,
+            use_container_width=True
+        )
+    
+    telemetry = get_telemetry_log()
+    for task in tasks:
+        if task.status == 'cached':
+            st.session_state.generated_content[task.key] = task.result
+            telemetry.record_cache_hit(
+                task.key, router.primary(task.key), task.prompt, task.result, st.session_state.session_id
+            )
+    show_status()
+    wall_time = run_study_pack(
+        pending, get_llm(), st.session_state.api_key, router, concurrency, on_update=show_status,
+        telemetry=telemetry, session=st.session_state.session_id
+    ) if pending else 0.0
+    
+    for task in tasks:
+        if task.error:
+            st.error(f"Error communicating with API ({task.label}): {task.error}")
+    done = [task for task in tasks if task.status in ('done', 'cached')]
+    sequential = sum(task.latency or 0.0 for task in pending)
+    st.success(
+        f"✅ Study pack ready: {len(done)} of {len(tasks)} tools in {wall_time:.1f}s "
+        f"(one after another: ~{sequential:.1f}s)"
+    )
+
+PRACTICE_TEST_ROUNDS = 3
+MAX_SHARD_CONCURRENCY = 4
+
+def generate_practice_test(test_length, question_types, difficulty):
+    """Practice test questions written as concurrent shards over different passages,
+    merged, de-duplicated and trimmed to test_length. A shortfall is topped up
+    with new shards for just the missing questions."""
+    router = get_model_router()
+    telemetry = get_telemetry_log()
+    progress = st.empty()
+    questions = []
+    for attempt in range(PRACTICE_TEST_ROUNDS):
+        missing = test_length - len(questions)
+        if missing <= 0:
+            break
+        sizes = plan_shards(missing)
+        materials = sample_material_shards(sizes)
+        tasks = [
+            PackTask('practice_test', f"Part {index + 1}", pack_prompt(
+                practice_test_prompt(
+                    shard_request_size(size, len(sizes)), shard_question_types(question_types, index),
+                    difficulty, material
+                ),
+                'practice_test'
+            ))
+            for index, (size, material) in enumerate(zip(sizes, materials))
+        ]
         
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            extra_body={}
+        def show_progress(task=None):
+            finished = sum(1 for t in tasks if t.status in ('done', 'failed'))
+            progress.caption(f"🧩 Writing {missing} questions in {len(tasks)} parts: {finished}/{len(tasks)} finished")
+        
+        show_progress()
+        wall_time = run_study_pack(
+            tasks, get_llm(), st.session_state.api_key, router, min(len(tasks), MAX_SHARD_CONCURRENCY),
+            on_update=show_progress, telemetry=telemetry, session=st.session_state.session_id
+        )
+        for task in tasks:
+            if task.error:
+                st.error(f"Error communicating with API ({task.label}): {task.error}")
+        questions, duplicates = merge_questions(
+            questions, [parse_questions(task.result) for task in tasks], test_length
         )
-        return completion.choices[0].message.content
+        progress.caption(
+            f"🧩 {len(tasks)} part{'s' if len(tasks) != 1 else ''} in {wall_time:.1f}s "
+            f"(one after another: ~{sum(task.latency or 0.0 for task in tasks):.1f}s)"
+            + (f" · {duplicates} duplicate questions dropped" if duplicates else "")
+        )
+        if len(questions) < test_length and attempt + 1 < PRACTICE_TEST_ROUNDS:
+            st.warning(f"Only got {len(questions)} questions, writing the rest... (Attempt {attempt + 2}/{PRACTICE_TEST_ROUNDS})")
+    return questions
+
+def get_ai_response(prompt, task="chat", cache=False):
+    """Get response from the task's models (from the response cache first when cache=True)"""
+    prompt = pack_prompt(prompt, task)
+    model = get_model_router().primary(task)
+    if cache:
+        cached = get_response_cache().get(model, prompt)
+        if cached is not None:
+            response, created = cached
+            st.caption(f"♻️ Reused the response generated {datetime.fromtimestamp(created):%Y-%m-%d %H:%M}")
+            get_telemetry_log().record_cache_hit(task, model, prompt, response, st.session_state.session_id)
+            return response
+    try:
+        response = routed_completer(task)(prompt)
     except Exception as e:
         st.error(f"Error communicating with API: {str(e)}")
         return None
+    if cache and response:
+        get_response_cache().put(model, prompt, response)
+    return response
 
-def get_unique_generation_seed(content_type):
-    """Generate unique seed"""
+def stream_ai_response(prompt, task="chat", cache=False, container=None):
+    """Streaming get_ai_response: renders the reply into container (default: here)
+    as it arrives, reports time to first token, and returns the full text"""
+    prompt = pack_prompt(prompt, task)
+    router = get_model_router()
+    model = router.primary(task)
+    target = container if container is not None else st
+    if cache:
+        cached = get_response_cache().get(model, prompt)
+        if cached is not None:
+            response, created = cached
+            st.caption(f"♻️ Reused the response generated {datetime.fromtimestamp(created):%Y-%m-%d %H:%M}")
+            get_telemetry_log().record_cache_hit(task, model, prompt, response, st.session_state.session_id)
+            target.write(response)
+            return response
+    
+    timing = {}
+    api_key = st.session_state.api_key
+    session = st.session_state.session_id
+    llm = get_llm()
+    telemetry = get_telemetry_log()
+    
+    def request(model):
+        return telemetry.track_stream(task, model, prompt, lambda: llm.stream(api_key, prompt, model), session)
+    
+    def deltas():
+        started = time.perf_counter()
+        for delta in router.stream(task, request):
+            if 'first_token' not in timing:
+                timing['first_token'] = time.perf_counter() - started
+            yield delta
+        timing['total'] = time.perf_counter() - started
+    
+    try:
+        response = target.write_stream(deltas())
+    except Exception as e:
+        st.error(f"Error communicating with API: {str(e)}")
+        return None
+    if isinstance(response, list):
+        response = "".join(str(part) for part in response)
+    if 'total' in timing:
+        st.caption(f"⚡ First token after {timing['first_token']:.1f}s · complete in {timing['total']:.1f}s")
+    if cache and response:
+        get_response_cache().put(model, prompt, response)
+    return response or None
+
+def stream_generation(prompt, task, cache=False):
+    """stream_ai_response into a temporary placeholder, for tabs that show the stored result below"""
+    placeholder = st.empty()
+    response = stream_ai_response(prompt, task, cache, container=placeholder)
+    placeholder.empty()
+    return response
+
+def count_generation(content_type):
+    """Increment and return the generation number of a content type"""
     if content_type not in st.session_state.generation_count:
         st.session_state.generation_count[content_type] = 0
     
     st.session_state.generation_count[content_type] += 1
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    random_num = random.randint(1000, 9999)
+    return st.session_state.generation_count[content_type]
+
+def get_unique_generation_seed(content_type):
+    """Generate unique seed (repeatable under $STUDY_LLM_SEED or record/replay)"""
+    count_generation(content_type)
     count = st.session_state.generation_count[content_type]
-    seed_string = f"{timestamp}_{random_num}_{count}"
+    seed = fixed_seed()
+    if seed is not None:
+        seed_string = f"{seed}_{content_type}_{count}"
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        random_num = random.randint(1000, 9999)
+        seed_string = f"{timestamp}_{random_num}_{count}"
     return hashlib.md5(seed_string.encode()).hexdigest()[:8]
 
-def add_uniqueness_instructions(base_prompt, content_type):
-    """Add uniqueness instructions"""
+def uniqueness_instructions(content_type):
+    """Uniqueness instructions for the next generation of a content type"""
     seed = get_unique_generation_seed(content_type)
-    uniqueness_instructions = f"""
+    return f"""
+
 IMPORTANT INSTRUCTIONS FOR UNIQUENESS (Generation ID: {seed}):
 - This is generation #{st.session_state.generation_count.get(content_type, 1)} for this content type
 - Create completely NEW and DIFFERENT content from any previous generations
@@ -705,9 +1184,81 @@ IMPORTANT INSTRUCTIONS FOR UNIQUENESS (Generation ID: {seed}):
 - Avoid repeating similar questions or content patterns
 - Be creative and explore the material from fresh angles
 - Mix difficulty levels and question styles differently each time
-
 """
-    return uniqueness_instructions + base_prompt
+
+def add_uniqueness_instructions(base_prompt, content_type):
+    """Add uniqueness instructions"""
+    # Appended so prompts over the same material keep a stable prefix
+    return base_prompt + uniqueness_instructions(content_type)
+
+SUMMARY_DEPTH_INSTRUCTIONS = {
+    "Brief": "Provide a concise summary in 5-7 sentences focusing on the core concepts and main takeaways.",
+    "Detailed": "Provide a detailed summary in 2-3 paragraphs covering all key concepts, their relationships, and practical applications.",
+    "Comprehensive": "Provide an in-depth analysis covering: 1) Main themes and concepts 2) Key principles and theories 3) Important examples/case studies 4) Practical applications 5) Critical insights and takeaways",
+    "Academic": "Provide a scholarly summary with: 1) Abstract-style overview 2) Methodology/theoretical framework 3) Key findings and evidence 4) Implications and significance 5) Limitations and future directions"
+}
+
+CHEAT_SHEET_INSTRUCTIONS = {
+    "One-Page Summary": "Create a concise one-page cheat sheet with the most important information from this text. Use bullet points and clear sections.",
+    "Flashcard Style": "Create flashcard-style content with questions on one side and answers on the other. Format as 'Q: [question]\nA: [answer]'",
+    "Formula Sheet": "Extract all formulas, equations, and important calculations. Explain when to use each.",
+    "Timeline": "Create a chronological timeline of events, developments, or processes mentioned in this text.",
+    "Comparison Table": "Create a comparison table showing similarities and differences between key concepts."
+}
+
+MEMORY_AID_INSTRUCTIONS = {
+    "Mnemonics": "Create memorable mnemonics for the key concepts in this text. Explain each mnemonic.",
+    "Analogies": "Create helpful analogies to explain difficult concepts in this text by relating them to everyday experiences.",
+    "Visual Associations": "Suggest visual associations and mental images to help remember key information from this text.",
+    "Acronyms": "Create acronyms to help remember lists and key points from this text.",
+    "Story Method": "Create a memorable story that incorporates the key concepts from this text."
+}
+
+def summary_prompt(depth, text, sectioned=False):
+    """Summary prompt over the material, or over its section summaries when sectioned"""
+    if sectioned:
+        return f"""Analyze the following section-by-section summaries of the study material and provide a {depth.lower()} summary of the whole material that captures the depth and nuance of the content. Never mention the course or the author.
+
+{SUMMARY_DEPTH_INSTRUCTIONS[depth]}
+
+Section summaries: {text}"""
+    return f"""Analyze the following text and provide a {depth.lower()} summary that captures the depth and nuance of the content. Never mention the course or the author.
+
+{SUMMARY_DEPTH_INSTRUCTIONS[depth]}
+
+Text: {text}"""
+
+def key_concepts_prompt(text):
+    return build_prompt(text, """Extract and define the key concepts from the study material above.
+Format as:
+**Concept Name**: Definition""")
+
+def cheat_sheet_prompt(cheat_sheet_format, text):
+    return f"{CHEAT_SHEET_INSTRUCTIONS[cheat_sheet_format]}\n\nText: {text}"
+
+def memory_aid_prompt(memory_tool, text):
+    return f"{MEMORY_AID_INSTRUCTIONS[memory_tool]}\n\nText: {text}"
+
+STUDY_PACK_TOOLS = {
+    'summary': "📖 Summary",
+    'concepts': "🔑 Key Concepts",
+    'cheat_sheet': "📋 Cheat Sheet",
+    'memory_aid': "🧠 Memory Aid",
+    'study_plan': "📊 Study Plan",
+}
+
+def study_plan_prompt(days_until_exam, study_hours_per_day, text):
+    return build_prompt(text, f"""Create a detailed study plan for the study material above with the following constraints:
+- Days until exam: {days_until_exam}
+- Study hours per day: {study_hours_per_day}
+- Total study hours available: {days_until_exam * study_hours_per_day}
+
+Include:
+1. Daily breakdown of topics to cover
+2. Recommended study techniques for each section
+3. Review sessions
+4. Practice test schedule
+5. Rest days""")
 
 def analyze_test_performance():
     """Analyze test performance"""
@@ -758,6 +1309,10 @@ def analyze_test_performance():
     
     return insights
 
+# Warm-start prebuilt corpora
+get_pdf_backend_selection()
+get_corpus_store()
+
 # Sidebar
 with st.sidebar:
     st.image("https://img.icons8.com/clouds/100/000000/book.png", width=80)
@@ -774,6 +1329,11 @@ with st.sidebar:
     if api_key_input:
         st.session_state.api_key = api_key_input
         st.success("✅ API Key saved!")
+    llm_backend = get_llm_pool()
+    if not llm_backend.requires_api_key:
+        st.session_state.api_key = st.session_state.api_key or "offline"
+    if describe_backend(llm_backend) != "OpenRouter":
+        st.info(f"🧪 LLM backend: {describe_backend(llm_backend)}")
     
     st.divider()
     
@@ -813,6 +1373,10 @@ with st.sidebar:
                 st.session_state.available_files = get_files_from_folder(selected_folder_path)
                 st.session_state.selected_file = None
                 st.session_state.document_content = ""
+                st.session_state.corpus = None
+                st.session_state.dedup_report = None
+                st.session_state.folder_indexer = None
+                st.session_state.loaded_page_range = None
                 st.session_state.use_all_files = False
                 st.session_state.loaded_files_info = []
                 
@@ -847,40 +1411,121 @@ with st.sidebar:
                     file_names.index(selected_file_name)
                 ]
                 
+                page_range = None
+                page_count = None
+                if selected_file_path.suffix.lower() == '.pdf':
+                    try:
+                        page_count = get_lazy_pdf(
+                            str(selected_file_path),
+                            selected_file_path.stat().st_mtime_ns,
+                            active_pdf_backend()
+                        ).page_count
+                    except Exception as e:
+                        st.warning(f"Could not open {selected_file_name}: {str(e)}")
+                if page_count and page_count > 1:
+                    page_range = st.slider(
+                        f"📑 Pages (of {page_count}):",
+                        1, page_count, (1, page_count),
+                        key=f"page_range_{selected_file_name}",
+                        help="Load only part of a large PDF; only these pages are extracted and sent to the AI"
+                    )
+                    if page_range == (1, page_count):
+                        page_range = None
+                
                 if st.button("📥 Load File", key="load_file", use_container_width=True):
                     st.session_state.selected_file = selected_file_path
                     with st.spinner(f"Reading {selected_file_name}..."):
-                        content, pages = read_single_file(selected_file_path)
-                        if content:
-                            st.session_state.document_content = content
-                            word_count = len(content.split())
-                            st.session_state.loaded_files_info = [{
-                                'name': selected_file_name,
-                                'pages': pages if pages else 'N/A',
-                                'words': word_count
-                            }]
+                        if page_range:
+                            corpus = read_pdf_pages(selected_file_path, *page_range)
+                        else:
+                            corpus = read_corpus([selected_file_path], banner=False)
+                        if corpus:
+                            st.session_state.corpus = corpus
+                            st.session_state.dedup_report = None
+                            st.session_state.folder_indexer = None
+                            st.session_state.loaded_page_range = (
+                                (page_range[0], page_range[1], page_count) if page_range else None
+                            )
+                            st.session_state.document_content = corpus.text
+                            st.session_state.loaded_files_info = corpus.files_info()
                             st.success(f"✅ Loaded successfully!")
                             st.balloons()
         else:
             st.info(f"📚 Ready to load {len(st.session_state.available_files)} files")
+            prefer_fast_formats = st.checkbox(
+                "🪶 Prefer fastest format for duplicates",
+                value=True,
+                key="prefer_fast_formats",
+                help="When a document exists in several formats (e.g. .html and .pdf), load only the quickest to parse"
+            )
+            remove_duplicates = st.checkbox(
+                "🧹 Remove duplicate material",
+                value=True,
+                key="remove_duplicates",
+                help="Skip near-identical files and sections repeated across files"
+            )
+            parallel_ingest = st.checkbox(
+                "⚡ Parallel extraction",
+                value=True,
+                key="parallel_ingest",
+                help="Extract files on all CPU cores instead of one at a time"
+            )
             
             if st.button("📥 Load All Files", key="load_all_files", use_container_width=True):
                 with st.spinner("Reading all files..."):
-                    combined_content, files_info, total_pages, total_words = read_all_files(
-                        st.session_state.available_files
+                    progress_bar = st.progress(0.0, text="Extracting files...")
+                    
+                    def show_progress(done, total, file_path):
+                        progress_bar.progress(done / total, text=f"📄 {done}/{total}: {file_path.name}")
+                    
+                    indexer = get_folder_indexer(
+                        st.session_state.selected_folder,
+                        prefer_fast=prefer_fast_formats,
+                        dedup=remove_duplicates,
+                        pdf_backend=active_pdf_backend()
                     )
+                    errors = []
+                    from_store = indexer.load(
+                        parallel=parallel_ingest,
+                        on_progress=show_progress,
+                        errors=errors
+                    )
+                    progress_bar.empty()
+                    for file_path, error in errors:
+                        st.warning(f"Could not read {file_path.name}: {error}")
+                    if indexer.skipped:
+                        st.caption(f"⏭️ Skipped slower copies: {', '.join(f.name for f in indexer.skipped)}")
+                    if from_store:
+                        st.caption("⚡ Loaded from the prebuilt corpus store")
                     
-                    if combined_content:
-                        st.session_state.document_content = combined_content
-                        st.session_state.loaded_files_info = files_info
+                    if indexer.corpus:
+                        sync_folder_corpus(indexer)
                         st.session_state.selected_file = None
-                        st.success(f"✅ Loaded {len(files_info)} files!")
+                        st.success(f"✅ Loaded {indexer.corpus.file_count} files!")
                         st.balloons()
+            
+            indexer = st.session_state.folder_indexer
+            if indexer is not None and st.session_state.corpus is not None:
+                watch_folder = st.checkbox(
+                    "👀 Watch folder for changes",
+                    value=True,
+                    key="watch_folder",
+                    help="Re-index only added, changed or removed files when the folder changes"
+                )
+                if watch_folder:
+                    changes = indexer.poll(min_interval=5.0)
+                    if st.session_state.document_content is not indexer.corpus.text:
+                        sync_folder_corpus(indexer)
+                        summary = describe_changes(changes) if changes else "updated"
+                        st.toast(f"🔄 {Path(indexer.folder).name} re-indexed ({summary})")
     
     # Current selection info
     if st.session_state.document_content:
         st.divider()
-        word_count = len(st.session_state.document_content.split())
+        if st.session_state.corpus is not None:
+            word_count = st.session_state.corpus.word_count
+        else:
+            word_count = len(st.session_state.document_content.split())
         
         if st.session_state.use_all_files:
             st.success(f"📚 **{len(st.session_state.loaded_files_info)} files loaded**")
@@ -891,11 +1536,186 @@ with st.sidebar:
                     pages_info = f", {file_info['pages']} pages" if file_info['pages'] != 'N/A' else ""
                     st.write(f"📄 **{file_info['name']}**")
                     st.caption(f"{file_info['words']:,} words{pages_info}")
+                
+                dedup_report = st.session_state.dedup_report
+                if dedup_report and dedup_report['words_saved']:
+                    st.divider()
+                    st.write("🧹 **Duplicates removed**")
+                    for duplicate in dedup_report['duplicate_files']:
+                        st.caption(
+                            f"⏭️ {duplicate['name']} ≈ {duplicate['duplicate_of']} "
+                            f"({duplicate['similarity']:.0%} overlap, {duplicate['words']:,} words)"
+                        )
+                    if dedup_report['sections_removed']:
+                        st.caption(f"✂️ {dedup_report['sections_removed']} repeated section(s)")
+                    st.caption(
+                        f"💾 Saved {dedup_report['words_saved']:,} words "
+                        f"(~{dedup_report['tokens_saved']:,} tokens) per prompt"
+                    )
         else:
             st.success("📄 **File loaded**")
             st.metric("Words", f"{word_count:,}")
             if st.session_state.selected_file:
                 st.caption(f"📝 {st.session_state.selected_file.name}")
+            if st.session_state.loaded_page_range:
+                first_page, last_page, page_count = st.session_state.loaded_page_range
+                st.caption(f"📑 Pages {first_page}–{last_page} of {page_count}")
+        
+        cache_stats = get_extraction_cache().stats()
+        st.caption(
+            f"🗄️ Extraction cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} files ({cache_stats['bytes'] / 1024 / 1024:.1f} MB)"
+        )
+        response_stats = get_response_cache().stats()
+        st.caption(
+            f"♻️ Response cache: {response_stats['hits']} hits / {response_stats['misses']} misses, "
+            f"{response_stats['entries']} responses"
+        )
+        api_stats = get_llm_pool().stats()
+        st.caption(
+            f"🔌 API: {api_stats['requests']} requests, {api_stats['retries']} retries, "
+            f"{api_stats['failures']} failed · connection reuse {api_stats['reuse_rate']:.0%}"
+        )
+        queue_stats = get_llm_scheduler().stats()
+        st.caption(
+            f"🚦 Queue: {queue_stats['active']} running, {queue_stats['waiting']} waiting "
+            f"from {queue_stats['sessions_waiting']} sessions · mean wait {queue_stats['mean_wait_seconds']:.1f}s"
+        )
+        flight_stats = get_singleflight().stats()
+        st.caption(
+            f"🔗 Coalesced: {flight_stats['coalesced']} duplicate requests joined "
+            f"{flight_stats['calls']} sent · ~{flight_stats['tokens_saved']:,} tokens saved"
+        )
+    
+    st.divider()
+    with st.expander("🧮 Token Budget"):
+        st.caption(
+            f"Prompt budget: {context_budget('openrouter/free'):,} tokens · "
+            f"token cache {default_counter.hits} hits / {default_counter.misses} misses"
+        )
+        if st.session_state.token_log:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        'Time': entry['time'],
+                        'Task': entry.get('task', ''),
+                        'Original': entry['original_tokens'],
+                        'Sent': entry['sent_tokens'],
+                        'Packed': '✂️' if entry['packed'] else ''
+                    }
+                    for entry in reversed(st.session_state.token_log)
+                ]),
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.caption("No requests yet")
+    
+    if is_admin():
+        with st.expander("📈 LLM Telemetry"):
+            telemetry_window = st.selectbox(
+                "Period:", ["Last hour", "Last 24 hours", "Last 7 days", "All time"],
+                index=1, key="telemetry_window"
+            )
+            since = {
+                "Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400
+            }.get(telemetry_window)
+            telemetry_summary = get_telemetry_log().summary(time.time() - since if since else 0.0)
+            if telemetry_summary:
+                def seconds(value):
+                    return round(value, 1) if value is not None else None
+                st.dataframe(
+                    pd.DataFrame([
+                        {
+                            'Task': row['task'],
+                            'Calls': row['calls'],
+                            'Cache hits': f"{row['cache_hit_rate']:.0%}",
+                            'Errors': f"{row['error_rate']:.0%}",
+                            'Abandoned': row['abandoned'],
+                            'Retries': row['retries'],
+                            'p50 (s)': seconds(row['wall_p50']),
+                            'p95 (s)': seconds(row['wall_p95']),
+                            'TTFT p50 (s)': seconds(row['ttft_p50']),
+                            'TTFT p95 (s)': seconds(row['ttft_p95']),
+                            'Queue p95 (s)': seconds(row['queue_p95']),
+                            'Prompt tokens': row['prompt_tokens'],
+                            'Completion tokens': row['completion_tokens'],
+                        }
+                        for row in telemetry_summary
+                    ]),
+                    hide_index=True,
+                    use_container_width=True
+                )
+                st.caption(
+                    f"{sum(row['prompt_tokens'] + row['completion_tokens'] for row in telemetry_summary):,} tokens sent and received · "
+                    "token counts come from the API's usage where reported, otherwise estimates"
+                )
+            else:
+                st.caption("No LLM calls recorded in this period")
+    
+    if is_admin():
+        with st.expander("🧭 Model Routing"):
+            router = get_model_router()
+            st.caption(" · ".join(f"{task}: {' → '.join(router.chain(task))}" for task in sorted(router.routes)))
+            routing_stats = router.stats()
+            if routing_stats:
+                st.dataframe(
+                    pd.DataFrame([
+                        {
+                            'Task': row['task'],
+                            'Model': row['model'],
+                            'Calls': row['calls'],
+                            'p50 (s)': round(row['p50_seconds'], 1) if row['p50_seconds'] is not None else None,
+                            'p95 (s)': round(row['p95_seconds'], 1) if row['p95_seconds'] is not None else None,
+                            'Errors': f"{row['error_rate']:.0%}",
+                            'State': '⚠️ degraded' if row['degraded'] else '✅',
+                        }
+                        for row in routing_stats
+                    ]),
+                    hide_index=True,
+                    use_container_width=True
+                )
+            else:
+                st.caption("No requests yet")
+    
+    if is_admin():
+        with st.expander("🧪 PDF Extraction Backend"):
+            pdf_selection = get_pdf_backend_selection()
+            backend_names = list(PDF_BACKENDS)
+            # Another admin session may have switched it; show the current process-wide choice
+            st.session_state.pdf_backend_selector = active_pdf_backend()
+            st.selectbox(
+                "Backend:",
+                options=backend_names,
+                format_func=lambda name: PDF_BACKENDS[name].label,
+                key="pdf_backend_selector",
+                on_change=change_pdf_backend,
+                help="Applies to every session. Auto-selected as the fastest backend whose output passes a quality check"
+            )
+            st.caption(f"Set ${PDF_BACKEND_ENV} to fix the backend at startup")
+        
+            if st.button("⏱️ Re-run Benchmark", key="pdf_benchmark_btn", use_container_width=True):
+                with st.spinner("Benchmarking PDF backends..."):
+                    backend, results = auto_select_pdf_backend(
+                        sample_pdfs(list_folders(".")), PDF_SELECTION_PATH, rerun=True
+                    )
+                    pdf_selection.update({'backend': backend, 'results': results})
+                    st.rerun()
+        
+            if pdf_selection['results']:
+                st.dataframe(
+                    pd.DataFrame([
+                        {
+                            'Backend': r['label'],
+                            'Pages/s': round(r['pages_per_sec'], 1),
+                            'Chars': r['chars'],
+                            'OK': '✅' if r['passes'] else '❌'
+                        }
+                        for r in pdf_selection['results']
+                    ]),
+                    hide_index=True,
+                    use_container_width=True
+                )
 
 # Main App
 col1, col2, col3 = st.columns([1, 3, 1])
@@ -1010,6 +1830,23 @@ if not st.session_state.document_content:
 with tab1:
     st.header("📝 Document Analysis")
     
+    with st.expander("📦 Study Pack: generate everything at once"):
+        pack_tools = st.multiselect(
+            "Include:",
+            options=list(STUDY_PACK_TOOLS),
+            default=list(STUDY_PACK_TOOLS),
+            format_func=lambda key: STUDY_PACK_TOOLS[key],
+            key="study_pack_tools"
+        )
+        pack_concurrency = st.slider(
+            "Parallel requests:", 1, 5, DEFAULT_CONCURRENCY, key="study_pack_concurrency",
+            help="How many generations run at the same time"
+        )
+        st.caption("Uses the depth, format, memory aid and exam date chosen in each tab")
+        if st.button("📦 Generate Study Pack", key="study_pack_btn", use_container_width=True,
+                     disabled=not pack_tools):
+            generate_study_pack(pack_tools, pack_concurrency)
+    
     col1, col2 = st.columns(2)
     
     with col1:
@@ -1022,21 +1859,19 @@ with tab1:
         
         if st.button("✨ Generate Summary", key="summary_btn", use_container_width=True):
             with st.spinner("Analyzing document..."):
-                depth_instructions = {
-                    "Brief": "Provide a concise summary in 5-7 sentences focusing on the core concepts and main takeaways.",
-                    "Detailed": "Provide a detailed summary in 2-3 paragraphs covering all key concepts, their relationships, and practical applications.",
-                    "Comprehensive": "Provide an in-depth analysis covering: 1) Main themes and concepts 2) Key principles and theories 3) Important examples/case studies 4) Practical applications 5) Critical insights and takeaways",
-                    "Academic": "Provide a scholarly summary with: 1) Abstract-style overview 2) Methodology/theoretical framework 3) Key findings and evidence 4) Implications and significance 5) Limitations and future directions"
-                }
-                
-                base_prompt = f"""Analyze the following text and provide a {summary_depth.lower()} summary that captures the depth and nuance of the content. Never mention the course or the author.
-
-{depth_instructions[summary_depth]}
-
-Text: {st.session_state.document_content}"""
+                corpus = st.session_state.corpus
+                base_prompt = None
+                if corpus and count_tokens(corpus.text) > MAP_UNIT_TOKENS:
+                    section_summaries = summarize_corpus(corpus)
+                    if section_summaries:
+                        base_prompt = summary_prompt(summary_depth, section_summaries, sectioned=True)
+                else:
+                    base_prompt = summary_prompt(summary_depth, st.session_state.document_content)
                 
-                prompt = add_uniqueness_instructions(base_prompt, "summary")
-                summary = get_ai_response(prompt)
+                summary = None
+                if base_prompt:
+                    prompt = add_uniqueness_instructions(base_prompt, "summary")
+                    summary = stream_generation(prompt, "summary")
                 
                 if summary:
                     st.session_state.generated_content['summary'] = summary
@@ -1077,13 +1912,9 @@ Text: {st.session_state.document_content}"""
         
         if st.button("✨ Extract Key Concepts", key="concepts_btn", use_container_width=True):
             with st.spinner("Extracting key concepts..."):
-                prompt = f"""Extract and define the key concepts from this text. 
-Format as:
-**Concept Name**: Definition
-
-Text: {st.session_state.document_content}"""
+                prompt = key_concepts_prompt(st.session_state.document_content)
                 
-                concepts = get_ai_response(prompt)
+                concepts = stream_generation(prompt, "concepts", cache=True)
                 if concepts:
                     st.session_state.generated_content['concepts'] = concepts
                     st.success("✅ Concepts extracted!")
@@ -1140,8 +1971,20 @@ with tab2:
             key="tab2_question_type"
         )
     
+    question_focus = st.text_input(
+        "🎯 Focus topics (optional, comma-separated):",
+        key="tab2_question_focus",
+        help="Generate questions only from the passages most similar to these topics"
+    )
+    
     if st.button("✨ Generate Questions", key="gen_questions", use_container_width=True):
         with st.spinner(f"Generating {num_questions} {question_type} questions..."):
+            material, focus_stats = focus_context(question_focus)
+            sampled = not focus_stats and bool(st.session_state.corpus)
+            if focus_stats:
+                st.caption(retrieval_caption(focus_stats))
+            else:
+                material = sample_material(num_questions)
             base_prompt = f"""Generate {num_questions} {question_type} questions from this text.
 Difficulty level: {difficulty}
 
@@ -1152,16 +1995,16 @@ Format each question clearly with:
 - Correct answer
 - Brief explanation
 
-Text: {st.session_state.document_content}"""
+Text: {material}"""
             
-            prompt = add_uniqueness_instructions(base_prompt, "questions")
-            questions = get_ai_response(prompt)
+            generation_num = count_generation("questions")
+            questions = stream_generation(base_prompt, "questions")
             
             if questions:
                 st.session_state.generated_content['questions'] = questions
-                generation_num = st.session_state.generation_count.get('questions', 1)
                 st.success(f"✅ Questions generated! (Generation #{generation_num})")
-                st.info(f"🎲 This is generation #{generation_num}. Each generation creates completely new questions!")
+                if sampled:
+                    st.info(f"🧭 Generation #{generation_num} drew on passages not yet used for questions, so it covers new material!")
     
     if 'questions' in st.session_state.generated_content:
         st.markdown("### 📝 Generated Questions")
@@ -1209,19 +2052,20 @@ with tab3:
         ["One-Page Summary", "Flashcard Style", "Formula Sheet", "Timeline", "Comparison Table"],
         key="tab3_cheat_sheet_format"
     )
+    cheat_sheet_focus = st.text_input(
+        "🎯 Focus topics (optional, comma-separated):",
+        key="tab3_cheat_sheet_focus",
+        help="Build the cheat sheet only from the passages most similar to these topics"
+    )
     
     if st.button("✨ Generate Cheat Sheet", key="cheat_sheet_btn", use_container_width=True):
         with st.spinner("Creating cheat sheet..."):
-            prompts = {
-                "One-Page Summary": f"Create a concise one-page cheat sheet with the most important information from this text. Use bullet points and clear sections.\n\nText: {st.session_state.document_content}",
-                "Flashcard Style": f"Create flashcard-style content with questions on one side and answers on the other. Format as 'Q: [question]\nA: [answer]'\n\nText: {st.session_state.document_content}",
-                "Formula Sheet": f"Extract all formulas, equations, and important calculations. Explain when to use each.\n\nText: {st.session_state.document_content}",
-                "Timeline": f"Create a chronological timeline of events, developments, or processes mentioned in this text.\n\nText: {st.session_state.document_content}",
-                "Comparison Table": f"Create a comparison table showing similarities and differences between key concepts.\n\nText: {st.session_state.document_content}"
-            }
-            
-            prompt = add_uniqueness_instructions(prompts[cheat_sheet_format], "cheat_sheet")
-            cheat_sheet = get_ai_response(prompt)
+            focused, focus_stats = focus_context(cheat_sheet_focus)
+            cheat_text = focused or st.session_state.document_content
+            if focus_stats:
+                st.caption(retrieval_caption(focus_stats))
+            prompt = add_uniqueness_instructions(cheat_sheet_prompt(cheat_sheet_format, cheat_text), "cheat_sheet")
+            cheat_sheet = stream_generation(prompt, "cheat_sheet")
             
             if cheat_sheet:
                 st.session_state.generated_content['cheat_sheet'] = cheat_sheet
@@ -1262,6 +2106,27 @@ with tab4:
     st.header("💬 Interactive Q&A Chat")
     st.markdown("*Ask questions about your documents and get instant answers*")
     
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        use_retrieval = st.toggle(
+            "🔎 Send only relevant passages", value=True, key="chat_use_retrieval",
+            help="Search the documents and send the best-matching passages instead of the full text"
+        )
+    with col2:
+        chat_top_k = st.slider("Passages per question:", 1, 20, DEFAULT_TOP_K, key="chat_top_k",
+                               disabled=not use_retrieval)
+    with col3:
+        max_chat_budget = min(context_budget(model) for model in get_model_router().chain("chat"))
+        st.session_state.chat_token_budget = min(
+            st.session_state.get("chat_token_budget", DEFAULT_CONTEXT_TOKENS), max_chat_budget
+        )
+        chat_token_budget = st.number_input("Context token budget:", min(500, max_chat_budget), max_chat_budget,
+                                            step=500, key="chat_token_budget", disabled=not use_retrieval,
+                                            help="Capped at the prompt budget of the models chat is routed to")
+    with col4:
+        chat_search = st.selectbox("Search by:", ["Keywords (BM25)", "Similarity (TF-IDF)"],
+                                   key="chat_search", disabled=not use_retrieval)
+    
     for chat in st.session_state.chat_history:
         with st.chat_message(chat["role"]):
             st.write(chat["content"])
@@ -1276,16 +2141,33 @@ with tab4:
         
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
-                prompt = f"""Based on the following documents, answer this question: {user_question}
-
-If the question cannot be answered from the documents, say so and provide general knowledge if helpful.
+                retrieval_stats = None
+                if use_retrieval and st.session_state.corpus:
+                    corpus = st.session_state.corpus
+                    if chat_search == "Similarity (TF-IDF)":
+                        index = get_vector_index(corpus.digest(), str(st.session_state.selected_folder), corpus)
+                    else:
+                        index = get_retrieval_index(corpus.digest(), corpus)
+                    documents, retrieval_stats = retrieve_context(
+                        index, user_question, k=chat_top_k, max_tokens=chat_token_budget
+                    )
+                else:
+                    documents = st.session_state.document_content
+                
+                question = " ".join(user_question.split())
+                prompt = build_prompt(documents, f"""Based on the documents above, answer this question: {question}
 
-Documents: {st.session_state.document_content}"""
+If the question cannot be answered from the documents, say so and provide general knowledge if helpful.""", context_label="Documents")
                 
-                response = get_ai_response(prompt)
+                response = stream_ai_response(prompt, "chat", cache=True)
                 if response:
-                    st.write(response)
                     st.session_state.chat_history.append({"role": "assistant", "content": response})
+                if retrieval_stats:
+                    st.caption(retrieval_caption(retrieval_stats))
+                    if retrieval_stats['sources']:
+                        with st.expander("📎 Sources"):
+                            for source in retrieval_stats['sources']:
+                                st.write(f"- {source}")
     
     if st.button("🗑️ Clear Chat History", key="clear_chat"):
         st.session_state.chat_history = []
@@ -1322,96 +2204,22 @@ with tab5:
             st.session_state.user_answers = {}
             st.session_state.test_submitted = False
             st.session_state.current_test_id = str(datetime.now().timestamp())
+            count_generation("flashcard_test")
             
-            base_prompt = f"""Create a practice test with EXACTLY {test_length} questions from this study material.
-
-YOU MUST CREATE EXACTLY {test_length} QUESTIONS - NO MORE, NO LESS.
-
-SPECIFIC FORMATTING REQUIREMENTS:
-For EACH question, provide in this EXACT format:
-==QUESTION START==
-Question Type: [Multiple Choice/True/False/Short Answer/Fill in the Blank]
-Difficulty: [Easy/Medium/Hard]
-Question: [The question text]
-Options: [For MC: "A) Option1 | B) Option2 | C) Option3 | D) Option4" | For TF: "True | False" | For others: "N/A"]
-Correct Answer: [The exact correct answer]
-Explanation: [Brief explanation of why this is correct]
-==QUESTION END==
-
-Additional requirements:
-- Mix of question types: {', '.join(question_types)}
-- Overall difficulty: {test_difficulty}
-- Include questions that test conceptual understanding
-- Vary the cognitive level (remember, understand, apply, analyze)
-- CRITICAL: You must provide exactly {test_length} complete questions
-
-Study Material: {st.session_state.document_content}"""
-            
-            prompt = add_uniqueness_instructions(base_prompt, "flashcard_test")
+            questions = generate_practice_test(test_length, question_types, test_difficulty)
             
-            max_attempts = 3
-            attempt = 0
-            
-            while attempt < max_attempts:
-                test_content = get_ai_response(prompt)
-                
-                if test_content:
-                    questions = []
-                    question_blocks = test_content.split("==QUESTION START==")[1:]
-                    
-                    for block in question_blocks:
-                        if "==QUESTION END==" in block:
-                            question_text = block.split("==QUESTION END==")[0].strip()
-                            lines = question_text.split("\n")
-                            
-                            question_data = {}
-                            for line in lines:
-                                line = line.strip()
-                                if line.startswith("Question Type:"):
-                                    question_data['type'] = line.split("Question Type:")[1].strip()
-                                elif line.startswith("Difficulty:"):
-                                    question_data['difficulty'] = line.split("Difficulty:")[1].strip()
-                                elif line.startswith("Question:"):
-                                    question_data['question'] = line.split("Question:")[1].strip()
-                                elif line.startswith("Options:"):
-                                    question_data['options'] = line.split("Options:")[1].strip()
-                                elif line.startswith("Correct Answer:"):
-                                    question_data['correct_answer'] = line.split("Correct Answer:")[1].strip()
-                                elif line.startswith("Explanation:"):
-                                    question_data['explanation'] = line.split("Explanation:")[1].strip()
-                            
-                            if all(key in question_data for key in ['type', 'question', 'correct_answer']):
-                                questions.append(question_data)
-                    
-                    # Check if we got the right number of questions
-                    if len(questions) == test_length:
-                        st.session_state.test_questions = questions
-                        generation_num = st.session_state.generation_count.get('flashcard_test', 1)
-                        st.success(f"✅ Test generated with {len(questions)} questions! (Generation #{generation_num})")
-                        st.rerun()
-                        break
-                    elif len(questions) > test_length:
-                        # Too many questions - trim to exact length
-                        st.session_state.test_questions = questions[:test_length]
-                        generation_num = st.session_state.generation_count.get('flashcard_test', 1)
-                        st.success(f"✅ Test generated with {test_length} questions! (Generation #{generation_num})")
-                        st.rerun()
-                        break
-                    else:
-                        # Too few questions - try again
-                        attempt += 1
-                        if attempt < max_attempts:
-                            st.warning(f"Only got {len(questions)} questions, retrying... (Attempt {attempt + 1}/{max_attempts})")
-                        else:
-                            # Last attempt failed - use what we got
-                            st.session_state.test_questions = questions
-                            st.warning(f"⚠️ Generated {len(questions)} questions instead of {test_length}. Try regenerating if you need exactly {test_length}.")
-                            st.rerun()
-                else:
-                    attempt += 1
-                    if attempt >= max_attempts:
-                        st.error("Failed to generate test. Please try again.")
-                        break
+            if len(questions) == test_length:
+                st.session_state.test_questions = questions
+                generation_num = st.session_state.generation_count.get('flashcard_test', 1)
+                st.success(f"✅ Test generated with {len(questions)} questions! (Generation #{generation_num})")
+                st.rerun()
+            elif questions:
+                # Still short after topping up - use what we got
+                st.session_state.test_questions = questions
+                st.warning(f"⚠️ Generated {len(questions)} questions instead of {test_length}. Try regenerating if you need exactly {test_length}.")
+                st.rerun()
+            else:
+                st.error("Failed to generate test. Please try again.")
     
     if st.session_state.test_questions:
         st.divider()
@@ -1713,16 +2521,10 @@ with tab6:
     
     if st.button("✨ Generate Memory Aid", key="memory_aid_btn", use_container_width=True):
         with st.spinner(f"Creating {memory_tool.lower()}..."):
-            prompts = {
-                "Mnemonics": f"Create memorable mnemonics for the key concepts in this text. Explain each mnemonic.\n\nText: {st.session_state.document_content}",
-                "Analogies": f"Create helpful analogies to explain difficult concepts in this text by relating them to everyday experiences.\n\nText: {st.session_state.document_content}",
-                "Visual Associations": f"Suggest visual associations and mental images to help remember key information from this text.\n\nText: {st.session_state.document_content}",
-                "Acronyms": f"Create acronyms to help remember lists and key points from this text.\n\nText: {st.session_state.document_content}",
-                "Story Method": f"Create a memorable story that incorporates the key concepts from this text.\n\nText: {st.session_state.document_content}"
-            }
-            
-            prompt = add_uniqueness_instructions(prompts[memory_tool], "memory_aid")
-            memory_aid = get_ai_response(prompt)
+            prompt = add_uniqueness_instructions(
+                memory_aid_prompt(memory_tool, st.session_state.document_content), "memory_aid"
+            )
+            memory_aid = stream_generation(prompt, "memory_aid")
             
             if memory_aid:
                 st.session_state.generated_content['memory_aid'] = memory_aid
@@ -1779,21 +2581,9 @@ with tab7:
         days_until_exam = (exam_date - datetime.now().date()).days
         
         with st.spinner("Creating your personalized study plan..."):
-            prompt = f"""Create a detailed study plan for this material with the following constraints:
-- Days until exam: {days_until_exam}
-- Study hours per day: {study_hours_per_day}
-- Total study hours available: {days_until_exam * study_hours_per_day}
-
-Include:
-1. Daily breakdown of topics to cover
-2. Recommended study techniques for each section
-3. Review sessions
-4. Practice test schedule
-5. Rest days
-
-Text to study: {st.session_state.document_content}"""
+            prompt = study_plan_prompt(days_until_exam, study_hours_per_day, st.session_state.document_content)
             
-            study_plan = get_ai_response(prompt)
+            study_plan = stream_generation(prompt, "study_plan", cache=True)
             if study_plan:
                 st.session_state.generated_content['study_plan'] = study_plan
                 st.success("✅ Study plan created!")
@@ -0,0 +1,82 @@
+"""Concurrent "generate everything" study pack via asyncio fan-out"""
+import asyncio
+import time
+
+DEFAULT_CONCURRENCY = 3
+
+
+class PackTask:
+    """One generation in a study pack.
+
+    prompt is sent as is; prepare, if given, is a blocking callable run in a
+    worker thread that returns the prompt instead (e.g. a map step that has
+    to finish first).
+    """
+
+    __slots__ = ('key', 'label', 'prompt', 'prepare', 'status', 'latency', 'result', 'error')
+
+    def __init__(self, key, label, prompt=None, prepare=None):
+        self.key = key
+        self.label = label
+        self.prompt = prompt
+        self.prepare = prepare
+        self.status = 'queued'
+        self.latency = None
+        self.result = None
+        self.error = None
+
+
+async def _run_task(task, semaphore, complete, on_update):
+    async with semaphore:
+        task.status = 'running'
+        on_update(task)
+        started = time.perf_counter()
+        try:
+            prompt = task.prompt
+            if task.prepare is not None:
+                prompt = await asyncio.to_thread(task.prepare)
+            task.result = await complete(task.key, prompt)
+            task.status = 'done' if task.result else 'failed'
+        except asyncio.CancelledError:
+            task.status = 'cancelled'
+            raise
+        except Exception as e:
+            task.error = str(e)
+            task.status = 'failed'
+        finally:
+            task.latency = time.perf_counter() - started
+        on_update(task)
+
+
+async def run_tasks(tasks, complete, concurrency=DEFAULT_CONCURRENCY, on_update=None):
+    """Run every task with at most `concurrency` in flight; returns the wall time.
+
+    complete(key, prompt) is a coroutine function. on_update(task) is called on
+    the event loop thread whenever a task starts or finishes.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _run_task(task, semaphore, complete, on_update or (lambda task: None)) for task in tasks
+    ))
+    return time.perf_counter() - started
+
+
+def run_study_pack(tasks, pool, api_key, router, concurrency=DEFAULT_CONCURRENCY, on_update=None,
+                   telemetry=None, session=None):
+    """Generate all tasks through one async client of a ClientPool, each on the
+    model chain the router has for its key (recorded in telemetry, a
+    TelemetryLog, if given); returns the wall time"""
+    async def main():
+        async with pool.async_client(api_key) as client:
+            async def complete(key, prompt):
+                async def request(model):
+                    def call():
+                        return pool.acomplete(client, prompt, model)
+                    if telemetry is None:
+                        return await call()
+                    return await telemetry.atrack(key, model, prompt, call, session)
+                return await router.acall(key, request)
+            return await run_tasks(tasks, complete, concurrency, on_update)
+
+    return asyncio.run(main())
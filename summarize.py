@@ -0,0 +1,204 @@
+"""Map-reduce summarisation with a persistent cache of partial summaries"""
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from ingest import CACHE_DIR
+from packing import count_tokens
+from retrieval import chunk_corpus
+
+DEFAULT_SUMMARY_CACHE_PATH = CACHE_DIR / "summaries.sqlite3"
+MAP_UNIT_TOKENS = 6000
+REDUCE_INPUT_TOKENS = 12000
+MAP_WORKERS = 4
+PROMPT_VERSION = 1
+
+MAP_PROMPT = """Summarise this section of study material for a student. Keep every key concept, definition, command, procedure and example it covers, as compact bullet points under short headings. Do not add information that is not in the text. Never mention the course or the author.
+
+Section: {label}
+
+Text: {text}"""
+
+COMBINE_PROMPT = """Merge these partial summaries of study material into one summary. Keep every distinct concept, definition, command and procedure, remove repetition, and group related points under short headings. Never mention the course or the author.
+
+Partial summaries:
+{summaries}"""
+
+
+def summary_key(model, prompt):
+    return hashlib.sha256(f"{PROMPT_VERSION}\0{model}\0{prompt}".encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class SummaryCache:
+    """Partial summaries keyed by a hash of (model, prompt), so by content"""
+
+    def __init__(self, path=DEFAULT_SUMMARY_CACHE_PATH):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "key TEXT PRIMARY KEY, summary BLOB, created REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return zlib.decompress(row[0]).decode('utf-8')
+
+    def put(self, key, summary):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, created) VALUES (?, ?, ?)",
+                (key, zlib.compress(summary.encode('utf-8')), time.time())
+            )
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+
+def summary_units(corpus, max_tokens=MAP_UNIT_TOKENS):
+    """(label, text) units to summarise independently: whole files, or runs of
+    consecutive chunks for files larger than max_tokens"""
+    chunks = None
+    units = []
+    for file_index in range(corpus.file_count):
+        text = corpus.file_text(file_index)
+        if not text.strip():
+            continue
+        if count_tokens(text) <= max_tokens:
+            units.append((corpus.names[file_index], text))
+            continue
+        if chunks is None:
+            chunks = chunk_corpus(corpus, overlap_words=0)
+        start = end = None
+        used = 0
+        part = 0
+        for chunk_id in range(len(chunks)):
+            if chunks.files[chunk_id] != file_index:
+                continue
+            cost = count_tokens(chunks.text(chunk_id))
+            if start is not None and used + cost > max_tokens:
+                units.append(_section(corpus, file_index, chunks, start, end, part))
+                start = None
+            if start is None:
+                start, used = chunk_id, 0
+                part += 1
+            end = chunk_id
+            used += cost
+        if start is not None:
+            units.append(_section(corpus, file_index, chunks, start, end, part))
+    return units
+
+
+def _section(corpus, file_index, chunks, first, last, part):
+    label = corpus.names[file_index]
+    first_page, last_page = chunks.pages[first], chunks.pages[last]
+    if first_page:
+        label += f", pp. {first_page}-{last_page}" if last_page != first_page else f", p. {first_page}"
+    else:
+        label += f" (part {part})"
+    return label, corpus.slice(chunks.starts[first], chunks.ends[last])
+
+
+def _cached_completion(prompt, complete, cache, model):
+    """(summary, came from cache)"""
+    key = summary_key(model, prompt)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, True
+    summary = complete(prompt)
+    if summary:
+        cache.put(key, summary)
+    return summary, False
+
+
+def map_summaries(units, complete, cache, model, max_workers=MAP_WORKERS, on_progress=None):
+    """Summarise every unit concurrently, reusing cached summaries.
+
+    complete(prompt) -> text must be safe to call from worker threads.
+    Returns (summaries in unit order, stats) where failed units are None
+    and stats counts cached, generated and failed units.
+    """
+    summaries = [None] * len(units)
+    stats = {'units': len(units), 'cached': 0, 'generated': 0, 'failed': 0, 'errors': []}
+    prompts = [MAP_PROMPT.format(label=label, text=text) for label, text in units]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_cached_completion, prompt, complete, cache, model): index
+            for index, prompt in enumerate(prompts)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            try:
+                summary, cached = future.result()
+            except Exception as e:
+                summary, cached = None, False
+                stats['errors'].append(f"{units[index][0]}: {e}")
+            summaries[index] = summary
+            if summary is None:
+                stats['failed'] += 1
+            elif cached:
+                stats['cached'] += 1
+            else:
+                stats['generated'] += 1
+            if on_progress:
+                on_progress(done, len(units), units[index][0])
+    return summaries, stats
+
+
+def format_partials(labels, summaries):
+    return "\n\n".join(
+        f"### {label}\n{summary}" for label, summary in zip(labels, summaries) if summary
+    )
+
+
+def collapse_summaries(labels, summaries, complete, cache, model,
+                       max_tokens=REDUCE_INPUT_TOKENS, max_workers=MAP_WORKERS):
+    """Merge partial summaries in groups until they fit max_tokens together.
+
+    Returns (labels, summaries) ready for the final reduce prompt; each
+    intermediate merge is cached like the map step.
+    """
+    pairs = [(label, summary) for label, summary in zip(labels, summaries) if summary]
+    while len(pairs) > 1 and count_tokens(format_partials(*zip(*pairs))) > max_tokens:
+        groups = []
+        current, used = [], 0
+        for label, summary in pairs:
+            cost = count_tokens(summary)
+            if current and used + cost > max_tokens:
+                groups.append(current)
+                current, used = [], 0
+            current.append((label, summary))
+            used += cost
+        groups.append(current)
+        if len(groups) == len(pairs):
+            break
+
+        def merge(group):
+            if len(group) == 1:
+                return group[0]
+            label = f"{group[0][0].split(' … ')[0]} … {group[-1][0].split(' … ')[-1]}"
+            prompt = COMBINE_PROMPT.format(summaries=format_partials(*zip(*group)))
+            return label, _cached_completion(prompt, complete, cache, model)[0]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pairs = [pair for pair in pool.map(merge, groups) if pair[1]]
+    return [label for label, _ in pairs], [summary for _, summary in pairs]
@@ -0,0 +1,232 @@
+"""Per-call LLM telemetry: tokens, latency, retries and cache hits in SQLite"""
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+
+import numpy as np
+
+from ingest import CACHE_DIR
+from packing import count_tokens
+
+DEFAULT_TELEMETRY_PATH = CACHE_DIR / "telemetry.sqlite3"
+DEFAULT_MAX_ROWS = 50000
+TRIM_EVERY = 500
+
+COLUMNS = (
+    'time', 'session', 'task', 'model', 'status', 'prompt_tokens', 'completion_tokens',
+    'tokens_from_usage', 'wall_seconds', 'ttft_seconds', 'queue_seconds', 'retries', 'error',
+)
+
+_current = ContextVar('llm_call', default=None)
+
+
+def note(**fields):
+    """Attach fields to the LLM call being tracked in this context, if any.
+
+    Lower layers (client retries and usage, scheduler wait, coalescing)
+    report through this without knowing about the log.
+    """
+    record = _current.get()
+    if record is not None:
+        record.update(fields)
+
+
+def note_usage(usage):
+    """Token counts from an OpenAI-style usage object"""
+    if usage is not None and getattr(usage, 'prompt_tokens', None) is not None:
+        note(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens or 0,
+             tokens_from_usage=1)
+
+
+class TelemetryLog:
+    """One row per LLM call (or cache hit), capped at max_rows by dropping the oldest"""
+
+    def __init__(self, path=DEFAULT_TELEMETRY_PATH, max_rows=DEFAULT_MAX_ROWS):
+        self.path = Path(path)
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS calls ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL, session TEXT, task TEXT, model TEXT, "
+                "status TEXT, prompt_tokens INTEGER, completion_tokens INTEGER, tokens_from_usage INTEGER, "
+                "wall_seconds REAL, ttft_seconds REAL, queue_seconds REAL, retries INTEGER, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS calls_time ON calls (time)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def write(self, record):
+        row = tuple(record.get(column) for column in COLUMNS)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"INSERT INTO calls ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", row
+            )
+            self._writes += 1
+            if self._writes % TRIM_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM calls WHERE id <= (SELECT MAX(id) FROM calls) - ?", (self.max_rows,)
+                )
+
+    def _start(self, task, model, prompt, session):
+        return {
+            'time': time.time(), 'session': session, 'task': task, 'model': model, 'status': 'ok',
+            'prompt_tokens': None, 'completion_tokens': None, 'tokens_from_usage': 0,
+            'ttft_seconds': None, 'queue_seconds': 0.0, 'retries': 0, 'error': None,
+            '_prompt': prompt, '_started': time.perf_counter(),
+        }
+
+    def _finish(self, record, response=None, error=None, abandoned=False):
+        record['wall_seconds'] = time.perf_counter() - record.pop('_started')
+        prompt = record.pop('_prompt')
+        if error is not None:
+            record['status'] = 'error'
+            record['error'] = f"{type(error).__name__}: {error}"[:300]
+        elif abandoned:
+            record['status'] = 'abandoned'
+        elif record.pop('coalesced', False):
+            record['status'] = 'coalesced'
+        elif not response:
+            record['status'] = 'empty'
+        if record['prompt_tokens'] is None:
+            record['prompt_tokens'] = count_tokens(prompt)
+            record['completion_tokens'] = count_tokens(response) if response else 0
+        self._write_quietly(record)
+
+    def _write_quietly(self, record):
+        try:
+            self.write(record)
+        except sqlite3.Error:
+            # Telemetry must never break a generation
+            pass
+
+    def track(self, task, model, prompt, call, session=None):
+        """call() with its timing, tokens, retries and outcome recorded"""
+        record = self._start(task, model, prompt, session)
+        token = _current.set(record)
+        try:
+            response = call()
+        except Exception as e:
+            self._finish(record, error=e)
+            raise
+        except BaseException:
+            # Cancelled or the script was stopped
+            self._finish(record, abandoned=True)
+            raise
+        finally:
+            _current.reset(token)
+        self._finish(record, response)
+        return response
+
+    async def atrack(self, task, model, prompt, call, session=None):
+        """Async track(): call is a coroutine function"""
+        record = self._start(task, model, prompt, session)
+        token = _current.set(record)
+        try:
+            response = await call()
+        except Exception as e:
+            self._finish(record, error=e)
+            raise
+        except BaseException:
+            # Cancelled or the script was stopped
+            self._finish(record, abandoned=True)
+            raise
+        finally:
+            _current.reset(token)
+        self._finish(record, response)
+        return response
+
+    def track_stream(self, task, model, prompt, stream, session=None):
+        """Yield from stream(), also recording time to the first piece.
+
+        A stream the consumer stops reading (closed, or garbage collected
+        part way) is recorded as 'abandoned' with what it had received.
+        """
+        record = self._start(task, model, prompt, session)
+        pieces = []
+        iterator = None
+        error = None
+        finished = False
+        try:
+            while True:
+                # The record is current only while the stream runs, not in the consumer
+                token = _current.set(record)
+                try:
+                    if iterator is None:
+                        iterator = iter(stream())
+                    piece = next(iterator)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _current.reset(token)
+                if record['ttft_seconds'] is None:
+                    record['ttft_seconds'] = time.perf_counter() - record['_started']
+                pieces.append(piece)
+                yield piece
+            finished = True
+        finally:
+            if not finished and error is None and hasattr(iterator, 'close'):
+                iterator.close()
+            self._finish(record, "".join(pieces), error, abandoned=not finished)
+
+    def record_cache_hit(self, task, model, prompt, response, session=None):
+        record = self._start(task, model, prompt, session)
+        record['status'] = 'cached'
+        record['ttft_seconds'] = 0.0
+        record['wall_seconds'] = 0.0
+        record.pop('_started')
+        record['prompt_tokens'] = count_tokens(record.pop('_prompt'))
+        record['completion_tokens'] = count_tokens(response)
+        self._write_quietly(record)
+
+    def rows(self, since=0.0):
+        with self._connect() as conn:
+            return [
+                dict(zip(COLUMNS, row)) for row in conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM calls WHERE time >= ? ORDER BY id", (since,)
+                )
+            ]
+
+    def summary(self, since=0.0):
+        """Per-task call counts, outcome rates, token totals and latency percentiles"""
+        by_task = {}
+        for row in self.rows(since):
+            by_task.setdefault(row['task'], []).append(row)
+        summary = []
+        for task, rows in sorted(by_task.items()):
+            sent = [row for row in rows if row['status'] not in ('cached', 'coalesced')]
+            answered = [row for row in sent if row['status'] == 'ok']
+            failed = [row for row in sent if row['status'] in ('error', 'empty')]
+            walls = [row['wall_seconds'] for row in answered]
+            ttfts = [row['ttft_seconds'] for row in answered if row['ttft_seconds'] is not None]
+            summary.append({
+                'task': task,
+                'calls': len(rows),
+                'sent': len(sent),
+                'error_rate': (len(failed) / len(sent)) if sent else 0.0,
+                'abandoned': sum(1 for row in sent if row['status'] == 'abandoned'),
+                'cache_hit_rate': (len(rows) - len(sent)) / len(rows),
+                'retries': sum(row['retries'] or 0 for row in sent),
+                'prompt_tokens': sum(row['prompt_tokens'] or 0 for row in sent),
+                'completion_tokens': sum(row['completion_tokens'] or 0 for row in sent),
+                'usage_share': (sum(row['tokens_from_usage'] or 0 for row in sent) / len(sent)) if sent else 0.0,
+                'wall_p50': float(np.percentile(walls, 50)) if walls else None,
+                'wall_p95': float(np.percentile(walls, 95)) if walls else None,
+                'ttft_p50': float(np.percentile(ttfts, 50)) if ttfts else None,
+                'ttft_p95': float(np.percentile(ttfts, 95)) if ttfts else None,
+                'queue_p95': float(np.percentile([row['queue_seconds'] or 0.0 for row in sent], 95)) if sent else None,
+            })
+        return summary
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM calls")
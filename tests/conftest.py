@@ -0,0 +1,22 @@
+import importlib
+import os
+import sys
+
+import openai
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The HTTP library the openai package is built on (httpx or a fork of it)
+httpx = importlib.import_module(openai.DefaultHttpxClient.__mro__[1].__module__.split('.')[0])
+
+
+@pytest.fixture
+def api_error():
+    """Factory for openai status errors: api_error(openai.RateLimitError, 429, {'retry-after': '2'})"""
+    def make(error_class, status, headers=None):
+        response = httpx.Response(
+            status, headers=headers or {}, request=httpx.Request('POST', "http://llm.test/v1/chat/completions")
+        )
+        return error_class(f"HTTP {status}", response=response, body=None)
+    return make
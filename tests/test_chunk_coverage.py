@@ -0,0 +1,53 @@
+from pathlib import Path
+
+from corpus import Corpus
+from chunk_coverage import MAX_SAMPLE_TOKENS, MIN_SAMPLE_TOKENS, CoverageTracker, sample_budget
+from packing import count_tokens
+from retrieval import chunk_corpus
+
+
+def _chunks():
+    corpus = Corpus.from_records([
+        (Path(f"file{file_no}.txt"), None, " ".join(
+            f"File {file_no} passage {i} explains tablespace quota number {file_no * 100 + i}." for i in range(120)
+        ) + "\n")
+        for file_no in range(3)
+    ])
+    return chunk_corpus(corpus, max_words=80, overlap_words=0)
+
+
+def test_sample_budget_is_clamped():
+    assert sample_budget(1) == MIN_SAMPLE_TOKENS
+    assert sample_budget(10_000) == MAX_SAMPLE_TOKENS
+    assert MIN_SAMPLE_TOKENS < sample_budget(20) < MAX_SAMPLE_TOKENS
+
+
+def test_samples_fit_the_budget_in_document_order_across_files():
+    chunks = _chunks()
+    tracker = CoverageTracker(chunks, seed=1)
+    budget = 4 * count_tokens(chunks.text(0))
+    sample = tracker.sample(budget)
+    assert sum(count_tokens(chunks.text(chunk_id)) for chunk_id in sample) <= budget
+    assert sample == sorted(sample, key=lambda chunk_id: chunks.starts[chunk_id])
+    assert len({chunks.files[chunk_id] for chunk_id in sample}) > 1
+
+
+def test_every_chunk_is_used_before_any_is_reused():
+    chunks = _chunks()
+    tracker = CoverageTracker(chunks, seed=2)
+    budget = 3 * count_tokens(chunks.text(0))
+    while tracker.coverage() < 1.0:
+        unused = {chunk_id for chunk_id, uses in enumerate(tracker.uses) if not uses}
+        sample = tracker.sample(budget)
+        if not set(sample) <= unused:
+            # A passage is only repeated to fill the sample that uses up the last unused ones
+            assert unused <= set(sample)
+    assert tracker.passes == 1
+    tracker.reset()
+    assert tracker.coverage() == 0.0 and tracker.samples == 0
+
+
+def test_same_seed_gives_the_same_samples():
+    chunks = _chunks()
+    first, second = CoverageTracker(chunks, seed="0"), CoverageTracker(chunks, seed="0")
+    assert [first.sample(2000) for _ in range(3)] == [second.sample(2000) for _ in range(3)]
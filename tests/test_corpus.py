@@ -0,0 +1,74 @@
+import os
+from pathlib import Path
+
+from corpus import _ARRAY_SLOTS, Corpus, CorpusStore, folder_signature
+
+RECORDS = [
+    (Path("guide.pdf"), 1, "Page one covers backup sets.\n"),
+    (Path("guide.pdf"), 2, "Page two covers image copies.\n"),
+    (Path("empty.pdf"), 1, ""),
+    (Path("notes.txt"), None, "Plain notes about the flash recovery area.\n"),
+]
+
+
+def test_from_records_indexes_files_and_pages():
+    corpus = Corpus.from_records(RECORDS)
+    assert corpus.names == ["guide.pdf", "notes.txt"]
+    assert corpus.file_count == 2 and corpus.page_count == 2
+    assert corpus.word_count == sum(len(text.split()) for _, _, text in RECORDS)
+    assert corpus.files_info() == [
+        {'name': "guide.pdf", 'pages': 2, 'words': 10},
+        {'name': "notes.txt", 'pages': 'N/A', 'words': 7},
+    ]
+    assert "FILE: guide.pdf" in corpus.text
+    assert corpus.file_text(0) == RECORDS[0][2] + RECORDS[1][2]
+    assert corpus.file_text(1) == RECORDS[3][2]
+    assert list(corpus.iter_records()) == [RECORDS[0], RECORDS[1], RECORDS[3]]
+    assert Corpus.from_records(RECORDS, banner=None).text == "".join(text for _, _, text in RECORDS)
+
+
+def test_page_at_and_file_span():
+    corpus = Corpus.from_records(RECORDS)
+    start, end = corpus.file_span(0)
+    assert corpus.slice(start, end).startswith("Page one")
+    page_two = corpus.text.index("Page two")
+    assert corpus.page_at(start) == (0, 1)
+    assert corpus.page_at(page_two - 1) == (0, 1)
+    assert corpus.page_at(page_two) == (0, 2)
+    notes_start, notes_end = corpus.file_span(1)
+    assert corpus.page_at(notes_start) == (1, None)
+    assert corpus.page_at(notes_end - 1) == (1, None)
+
+
+def test_blobs_round_trip():
+    corpus = Corpus.from_records(RECORDS)
+    loaded = Corpus.from_blobs(*corpus.to_blobs())
+    assert loaded.text == corpus.text
+    assert (loaded.names, loaded.paths, loaded.word_count) == (corpus.names, corpus.paths, corpus.word_count)
+    for slot in _ARRAY_SLOTS:
+        assert getattr(loaded, slot) == getattr(corpus, slot), slot
+    assert loaded.digest() == corpus.digest()
+
+
+def test_store_loads_only_under_the_signature_it_was_built_from(tmp_path):
+    folder = tmp_path / "module"
+    folder.mkdir()
+    note = folder / "notes.txt"
+    note.write_text("Plain notes about the flash recovery area.", encoding='utf-8')
+    signature = folder_signature([note])
+    corpus = Corpus.from_records(RECORDS)
+    CorpusStore(tmp_path / "store.sqlite3").save(folder, "all", signature, corpus, {'words_saved': 3})
+
+    store = CorpusStore(tmp_path / "store.sqlite3")
+    loaded, report = store.load(folder, "all", signature)
+    assert loaded.text == corpus.text and report == {'words_saved': 3}
+    assert store.load(folder, "other", signature) is None
+
+    stat = note.stat()
+    os.utime(note, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    touched = folder_signature([note])
+    assert touched != signature
+    assert store.load(folder, "all", touched) is None
+    assert store.update_signature(folder, "all", signature, touched)
+    assert store.load(folder, "all", touched) is not None
+    assert CorpusStore(tmp_path / "store.sqlite3").load(folder, "all", touched) is not None
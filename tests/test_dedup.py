@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import pytest
+
+from dedup import DocumentFingerprint, dedup_records, new_dedup_report, shingle_hashes
+
+
+def _text(topic, paragraphs=30):
+    return "\n\n".join(
+        f"Paragraph {i} about {topic}: the recovery manager copies datafile {i} and "
+        f"records backup piece {i * 3} in the control file before archiving sequence {i * 7}."
+        for i in range(paragraphs)
+    )
+
+
+def test_shingles_and_fingerprints():
+    assert len(shingle_hashes([])) == 0
+    assert len(shingle_hashes(["one", "two"])) == 1
+    assert len(shingle_hashes("a b c a b c".split())) == 3
+
+    original = DocumentFingerprint("a", _text("backups"))
+    assert original.jaccard(DocumentFingerprint("b", _text("backups"))) == 1.0
+    assert original.jaccard(DocumentFingerprint("c", "Completely unrelated words about cooking pasta and sauce")) < 0.2
+    assert DocumentFingerprint("empty", "").jaccard(original) == 0.0
+
+
+def test_containment_of_an_excerpt():
+    full = DocumentFingerprint("full", _text("backups"))
+    excerpt = DocumentFingerprint("excerpt", _text("backups", paragraphs=10))
+    assert excerpt.containment_in(full) == pytest.approx(1.0, abs=0.15)
+    assert full.containment_in(excerpt) < 0.6
+
+
+def test_dedup_records_drops_duplicate_files_and_repeated_sections():
+    shared = "This shared section about redo log multiplexing appears verbatim in both handouts."
+    records = [
+        (Path("notes.pdf"), 1, _text("backups")),
+        (Path("notes copy.pdf"), 1, _text("backups")),
+        (Path("other.txt"), None, f"Flashback queries read undo data for past versions of rows.\n\n{shared}"),
+        (Path("more.txt"), None, f"{shared}\n\nStandby databases apply redo shipped from the primary."),
+    ]
+    report = new_dedup_report()
+    kept = list(dedup_records(records, report=report))
+
+    assert [path.name for path, _, _ in kept] == ["notes.pdf", "other.txt", "more.txt"]
+    assert report['duplicate_files'][0]['name'] == "notes copy.pdf"
+    assert report['duplicate_files'][0]['duplicate_of'] == "notes.pdf"
+    assert report['sections_removed'] == 1
+    assert shared not in kept[2][2]
+    assert "Standby databases" in kept[2][2]
+    assert report['words_saved'] > 0 and report['tokens_saved'] > 0
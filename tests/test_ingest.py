@@ -0,0 +1,220 @@
+import itertools
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+import pdf_backends
+from ingest import (
+    ExtractionCache, LazyPdf, extract_document, iter_extracted, iter_pages, iter_records, list_folder_files,
+    pick_cheapest_sources, split_pages,
+)
+
+SAMPLE_PDF = Path(__file__).resolve().parent.parent / "module7" / "rman_guide.pdf"
+
+
+def _open_files():
+    return {os.path.realpath(f"/proc/self/fd/{fd}") for fd in os.listdir("/proc/self/fd")}
+
+
+def test_lazy_pdf_reads_pages_without_keeping_the_file_open():
+    pdf = LazyPdf(SAMPLE_PDF)
+    assert str(SAMPLE_PDF) not in _open_files()
+    assert pdf.page_count > 2
+    pages = list(pdf.iter_range(1, 2))
+    assert [page_no for page_no, _ in pages] == [1, 2]
+    assert pdf.page(2) == pages[1][1]
+    assert pdf.cached_pages == 2
+    assert str(SAMPLE_PDF) not in _open_files()
+
+
+def test_cache_hits_are_loaded_only_when_reached(tmp_path):
+    paths = []
+    for index in range(4):
+        path = tmp_path / f"notes{index}.txt"
+        path.write_text(f"Notes number {index} on redo log groups.", encoding='utf-8')
+        paths.append(path)
+    cache = ExtractionCache(tmp_path / "cache.sqlite3")
+    for path in paths[:3]:
+        cache.put(path, *extract_document(path))
+    loads = []
+    get = cache.get
+    cache.get = lambda file_path: loads.append(Path(file_path).name) or get(file_path)
+
+    results = iter_extracted(paths, cache=cache, parallel=False)
+    first = next(results)
+    assert first[0] == paths[0] and "number 0" in first[1]
+    assert loads == ["notes0.txt"]
+    assert [result[0] for result in results] == paths[1:]
+    assert loads == ["notes0.txt", "notes1.txt", "notes2.txt"]
+    assert cache.contains(paths[3])
+
+
+def test_extraction_cache_hits_and_misses(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("Control files record the structure of the database.", encoding='utf-8')
+    cache = ExtractionCache(tmp_path / "cache.sqlite3")
+    assert cache.get(path) is None
+    cache.put(path, *extract_document(path))
+    content, pages, page_ends = cache.get(path)
+    assert "Control files" in content
+    assert list(page_ends) == [len(content)]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_extraction_cache_misses_once_the_content_changes(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("Version one of the notes.", encoding='utf-8')
+    cache = ExtractionCache(tmp_path / "cache.sqlite3")
+    cache.put(path, *extract_document(path))
+    path.write_text("Version two of the notes, a little longer.", encoding='utf-8')
+    assert cache.get(path) is None
+
+    copy = tmp_path / "copy.txt"
+    copy.write_text("Version two of the notes, a little longer.", encoding='utf-8')
+    cache.put(copy, *extract_document(copy))
+    assert cache.get(path)[0] == cache.get(copy)[0]
+
+
+def test_extraction_cache_keys_pdfs_by_backend(tmp_path, monkeypatch):
+    first, second = pdf_backends.available_pdf_backends()[:2]
+    path = tmp_path / "slides.pdf"
+    path.write_bytes(b"%PDF-1.4 stand-in bytes")
+    cache = ExtractionCache(tmp_path / "cache.sqlite3")
+    monkeypatch.setattr(pdf_backends, '_active_backend', first)
+    cache.put(path, "text from the first backend", 1)
+    monkeypatch.setattr(pdf_backends, '_active_backend', second)
+    assert cache.get(path) is None
+    monkeypatch.setattr(pdf_backends, '_active_backend', first)
+    assert cache.get(path)[0] == "text from the first backend"
+
+
+def test_extraction_cache_evicts_least_recently_used_over_the_byte_budget(tmp_path, monkeypatch):
+    clock = itertools.count(1)
+    monkeypatch.setattr(time, 'time', lambda: float(next(clock)))
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.txt"
+        path.write_text(name, encoding='utf-8')
+        paths.append(path)
+    texts = [os.urandom(600).hex() for _ in paths]
+    cache = ExtractionCache(tmp_path / "cache.sqlite3")
+    cache.put(paths[0], texts[0], 1)
+    cache.max_bytes = cache.stats()['bytes'] * 2 + 100
+
+    cache.put(paths[1], texts[1], 1)
+    assert cache.get(paths[0]) is not None
+    cache.put(paths[2], texts[2], 1)
+
+    assert cache.get(paths[1]) is None
+    assert cache.get(paths[0])[0] == texts[0]
+    assert cache.get(paths[2])[0] == texts[2]
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['bytes'] <= cache.max_bytes
+
+
+def _mixed_folder(tmp_path):
+    paths = []
+    for index in range(3):
+        path = tmp_path / f"notes{index}.txt"
+        path.write_text(f"Notes number {index} on undo retention.", encoding='utf-8')
+        paths.append(path)
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not really a pdf")
+    return [paths[0], SAMPLE_PDF, paths[1], broken, paths[2]]
+
+
+def test_parallel_extraction_matches_serial_and_passes_errors_through(tmp_path):
+    paths = _mixed_folder(tmp_path)
+    progress = []
+    serial = list(iter_extracted(paths, parallel=False))
+    parallel = list(iter_extracted(
+        paths, max_workers=2, on_progress=lambda done, total, path: progress.append((done, total))
+    ))
+
+    assert [result[0] for result in parallel] == paths
+    assert [result[:4] for result in parallel] == [result[:4] for result in serial]
+    errors = [(Path(result[0]).name, bool(result[4])) for result in parallel]
+    assert errors == [("notes0.txt", False), ("rman_guide.pdf", False), ("notes1.txt", False),
+                      ("broken.pdf", True), ("notes2.txt", False)]
+    assert progress == [(done, len(paths)) for done in range(1, len(paths) + 1)]
+
+    errors = []
+    records = list(iter_records(paths, max_workers=2, errors=errors))
+    assert [(Path(path).name, str(message)) for path, message in errors] == [("broken.pdf", str(parallel[3][4]))]
+    assert {Path(path).name for path, _, _ in records} == {"notes0.txt", "rman_guide.pdf", "notes1.txt", "notes2.txt"}
+
+
+def test_split_pages_reproduces_the_page_boundaries(tmp_path):
+    pages = list(iter_pages(SAMPLE_PDF))
+    content, page_count, page_ends = extract_document(SAMPLE_PDF)
+    assert page_count == len(pages) > 2
+    assert list(split_pages(content, page_count, page_ends)) == pages
+
+    note = tmp_path / "notes.txt"
+    note.write_text("Line one.\nLine two.\n", encoding='utf-8')
+    content, page_count, page_ends = extract_document(note)
+    assert page_count is None
+    assert list(split_pages(content, page_count, page_ends)) == [(None, "Line one.\nLine two.\n")]
+    assert list(split_pages("whole text", None, None)) == [(None, "whole text")]
+
+
+def test_html_extraction_keeps_visible_text_only(tmp_path):
+    page = tmp_path / "guide.html"
+    page.write_text(
+        "<html><head><title>RMAN</title><style>p {color: red}</style></head><body>"
+        "<h1>Backups</h1><p>Incremental   backups copy &amp; track changed blocks.</p>"
+        "<script>alert('x')</script><table><tr><td>level</td><td>0</td></tr></table>"
+        "</body></html>",
+        encoding='utf-8',
+    )
+    content, pages, _ = extract_document(page)
+    assert pages is None
+    assert content == "RMAN\n\nBackups\n\nIncremental backups copy & track changed blocks.\n\n| level | 0\n"
+
+
+def test_docx_extraction(tmp_path):
+    docx = pytest.importorskip("docx")
+    document = docx.Document()
+    document.add_heading("Redo logs", level=1)
+    document.add_paragraph("Online redo logs are archived by ARCn.")
+    document.add_paragraph("")
+    document.add_paragraph("Multiplex every group.")
+    path = tmp_path / "redo.docx"
+    document.save(path)
+
+    content, pages, _ = extract_document(path)
+    assert pages is None
+    assert content == "Redo logs\nOnline redo logs are archived by ARCn.\nMultiplex every group.\n"
+
+
+def test_pptx_extraction_yields_one_page_per_slide(tmp_path):
+    pptx = pytest.importorskip("pptx")
+    presentation = pptx.Presentation()
+    for title, body in (("Backups", "Full and incremental"), ("Recovery", "Restore then recover")):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = title
+        slide.placeholders[1].text = body
+    path = tmp_path / "deck.pptx"
+    presentation.save(path)
+
+    assert list(iter_pages(path)) == [
+        (1, "Backups\nFull and incremental\n"),
+        (2, "Recovery\nRestore then recover\n"),
+    ]
+
+
+def test_folder_listing_skips_office_lock_files(tmp_path):
+    for name in ("notes.txt", "~$notes.docx", "deck.pptx", "image.png"):
+        (tmp_path / name).write_bytes(b"x")
+    assert [path.name for path in list_folder_files(tmp_path)] == ["deck.pptx", "notes.txt"]
+
+
+def test_pick_cheapest_sources_keeps_one_copy_per_document():
+    files = [Path("m/RMAN_guide.pdf"), Path("m/rman_guide.html"), Path("m/redo.docx"),
+             Path("m/redo.pdf"), Path("m/notes.md"), Path("other/redo.pdf")]
+    kept, skipped = pick_cheapest_sources(files)
+    assert kept == [Path("m/rman_guide.html"), Path("m/redo.docx"), Path("m/notes.md"), Path("other/redo.pdf")]
+    assert skipped == [Path("m/RMAN_guide.pdf"), Path("m/redo.pdf")]
@@ -0,0 +1,111 @@
+from pathlib import Path
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import corpus
+import ingest
+import llm_backends
+import pdf_backends
+import responses
+import summarize
+import telemetry
+import vectors
+from llm_backends import (
+    DEFAULT_RECORD_SEED, LLM_BACKEND_ENV, LLM_RECORD_ENV, LLM_RECORDINGS_ENV, LLM_SEED_ENV,
+    FakeBackend, RecordReplayBackend, ReplayMiss, fixed_seed,
+)
+from practice_test import parse_questions, practice_test_prompt
+
+APP = Path(__file__).resolve().parent.parent / "study_app4.py"
+CACHE_MODULES = (ingest, corpus, llm_backends, responses, summarize, telemetry, vectors)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Move every on-disk cache under tmp_path: the CACHE_DIR-derived module
+    constants and the parameter defaults that were bound from them"""
+    old = ingest.CACHE_DIR
+    new = tmp_path / "study_cache"
+
+    def moved(value):
+        if isinstance(value, Path) and value.is_relative_to(old):
+            return new / value.relative_to(old)
+        return value
+
+    for module in CACHE_MODULES:
+        for name, value in list(vars(module).items()):
+            if moved(value) is not value:
+                monkeypatch.setattr(module, name, moved(value))
+            function = value.__init__ if isinstance(value, type) else value
+            defaults = getattr(function, '__defaults__', None)
+            if defaults and getattr(function, '__module__', None) == module.__name__:
+                if any(moved(default) is not default for default in defaults):
+                    monkeypatch.setattr(function, '__defaults__', tuple(map(moved, defaults)))
+    monkeypatch.setattr(pdf_backends, '_active_backend', None)
+    return new
+
+
+def test_fake_backend_is_deterministic_and_follows_the_prompt():
+    backend = FakeBackend()
+    prompt = practice_test_prompt(7, ["Multiple Choice", "True/False"], "Medium", "Backups and recovery of tablespaces")
+    text = backend.complete(None, prompt, "model")
+    assert text == backend.complete(None, prompt, "model")
+    assert "".join(backend.stream(None, prompt, "model")) == text
+    questions = parse_questions(text)
+    assert len(questions) == 7
+    assert {q['type'] for q in questions} <= {"Multiple Choice", "True/False"}
+
+
+def test_replay_serves_recordings_and_misses_unknown_prompts(tmp_path):
+    recorder = RecordReplayBackend(FakeBackend(), tmp_path, 'record')
+    recorded = recorder.complete(None, "Summarise the material", "model")
+    player = RecordReplayBackend(FakeBackend(), tmp_path, 'replay')
+    assert player.complete(None, "Summarise the material", "model") == recorded
+    with pytest.raises(ReplayMiss):
+        player.complete(None, "Something never recorded", "model")
+    assert player.stats()['misses'] == 1
+
+
+def test_fixed_seed(monkeypatch):
+    monkeypatch.delenv(LLM_SEED_ENV, raising=False)
+    monkeypatch.delenv(LLM_RECORD_ENV, raising=False)
+    assert fixed_seed() is None
+    monkeypatch.setenv(LLM_RECORD_ENV, "replay")
+    assert fixed_seed() == DEFAULT_RECORD_SEED
+    monkeypatch.setenv(LLM_SEED_ENV, "42")
+    assert fixed_seed() == "42"
+
+
+def _practice_test(length):
+    st.cache_resource.clear()
+    at = AppTest.from_file(str(APP), default_timeout=120)
+    at.run()
+    at.button(key='discover_modules').click().run()
+    at.selectbox(key='folder_selector').select('module7').run()
+    at.radio(key='load_method').set_value('📚 All Files').run()
+    at.button(key='load_all_files').click().run()
+    at.slider(key='tab5_test_length').set_value(length).run()
+    at.button(key='generate_test').click().run(timeout=300)
+    assert not at.exception
+    assert not at.error, [e.value for e in at.error]
+    return [q['question'] for q in at.session_state.test_questions]
+
+
+def test_practice_test_replays_what_was_recorded(tmp_path, monkeypatch, cache_dir):
+    monkeypatch.chdir(APP.parent)
+    monkeypatch.delenv(LLM_SEED_ENV, raising=False)
+    monkeypatch.setenv(LLM_BACKEND_ENV, "fake")
+    monkeypatch.setenv(LLM_RECORDINGS_ENV, str(tmp_path))
+    monkeypatch.setenv(LLM_RECORD_ENV, "record")
+    recorded = _practice_test(15)
+    assert len(recorded) == 15
+    assert list(tmp_path.glob("*.json"))
+    assert (cache_dir / "extraction.sqlite3").exists()
+
+    monkeypatch.setenv(LLM_RECORD_ENV, "replay")
+    try:
+        assert _practice_test(15) == recorded
+    finally:
+        st.cache_resource.clear()
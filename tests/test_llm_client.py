@@ -0,0 +1,140 @@
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from llm_client import BACKOFF_MAX, ClientPool
+
+
+def _chunk(text):
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class StubStream:
+    def __init__(self, texts):
+        self.chunks = [_chunk(text) for text in texts]
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class StubClient:
+    """Stands in for OpenAI: chat.completions.create runs the next scripted outcome"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _completion(text):
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _pool(client, **kwargs):
+    kwargs.setdefault('sleep', lambda seconds: None)
+    pool = ClientPool(base_url="http://llm.test/v1", **kwargs)
+    pool._new_client = lambda api_key: client
+    return pool
+
+
+def test_retries_transient_errors_with_backoff():
+    delays = []
+    client = StubClient(openai.APITimeoutError(request=None), openai.APITimeoutError(request=None), _completion("ok"))
+    pool = _pool(client, sleep=delays.append, max_retries=4)
+    assert pool.complete("key", "prompt", "m") == "ok"
+    assert client.calls == 3
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1.0 and 0 <= delays[1] <= 2.0
+    assert pool.stats()['retries'] == 2
+
+
+def test_retry_after_header_sets_the_delay(api_error):
+    delays = []
+    client = StubClient(
+        api_error(openai.RateLimitError, 429, {'retry-after': "2"}),
+        api_error(openai.RateLimitError, 429, {'retry-after': "600"}),
+        _completion("ok"),
+    )
+    assert _pool(client, sleep=delays.append).complete("key", "prompt", "m") == "ok"
+    assert delays == [2.0, BACKOFF_MAX]
+
+
+def test_gives_up_after_max_retries_or_on_other_errors(api_error):
+    client = StubClient(*[api_error(openai.RateLimitError, 429) for _ in range(3)])
+    with pytest.raises(openai.RateLimitError):
+        _pool(client, max_retries=2).complete("key", "prompt", "m")
+    assert client.calls == 3
+
+    client = StubClient(api_error(openai.AuthenticationError, 401), _completion("unused"))
+    with pytest.raises(openai.AuthenticationError):
+        _pool(client).complete("key", "prompt", "m")
+    assert client.calls == 1
+
+
+class ClosingClient(StubClient):
+    def __init__(self, api_key):
+        super().__init__(*[_completion(api_key) for _ in range(5)])
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_clients_are_reused_per_key_and_evicted_least_recently_used():
+    made = {}
+    pool = ClientPool(base_url="http://llm.test/v1", max_clients=2)
+    pool._new_client = lambda api_key: made.setdefault(api_key, ClosingClient(api_key))
+
+    assert pool.complete("a", "prompt", "m") == "a"
+    assert pool.complete("a", "prompt", "m") == "a"
+    pool.complete("b", "prompt", "m")
+    pool.complete("a", "prompt", "m")
+    assert pool.stats()['clients'] == 2
+    assert "a" not in pool._clients and "b" not in pool._clients
+
+    pool.complete("c", "prompt", "m")
+    assert made["b"].closed
+    assert not made["a"].closed and not made["c"].closed
+    assert made["a"].calls == 3
+
+
+def test_an_evicted_client_is_closed_only_after_its_stream_ends():
+    stream = StubStream(["one ", "two"])
+    old = ClosingClient("old")
+    old.outcomes = [stream]
+    pool = ClientPool(base_url="http://llm.test/v1", max_clients=1)
+    pool._new_client = lambda api_key: old if api_key == "old" else ClosingClient(api_key)
+
+    pieces = pool.stream("old", "prompt", "m")
+    assert next(pieces) == "one "
+    assert pool.complete("new", "prompt", "m") == "new"
+    assert not old.closed
+    assert list(pieces) == ["two"]
+    assert old.closed
+
+
+def test_stream_closes_the_response_when_the_reader_stops_early():
+    stream = StubStream(["one ", "two ", "three"])
+    pieces = _pool(StubClient(stream)).stream("key", "prompt", "m")
+    assert next(pieces) == "one "
+    assert not stream.closed
+    pieces.close()
+    assert stream.closed
+
+
+def test_stream_closes_the_response_when_finished():
+    stream = StubStream(["one ", "two"])
+    assert "".join(_pool(StubClient(stream)).stream("key", "prompt", "m")) == "one two"
+    assert stream.closed
@@ -0,0 +1,73 @@
+import threading
+
+from packing import CONTEXT_BUDGET_ENV, TokenCounter, approx_tokens, fit_prompt
+
+
+def _document(paragraphs=200):
+    return "\n\n".join(
+        f"Section {i}. Recovery manager backs up datafile {i} and archives redo log sequence {i * 7}. "
+        f"Tablespace {i} stays online while the control file records checkpoint {i * 13}."
+        for i in range(paragraphs)
+    )
+
+
+def test_token_counter_caches_by_hash_within_limits():
+    counter = TokenCounter(max_entries=3, max_bytes=100)
+    assert counter.count("alpha beta") == approx_tokens("alpha beta")
+    assert counter.count("alpha beta") == approx_tokens("alpha beta")
+    assert (counter.hits, counter.misses) == (1, 1)
+    assert all(isinstance(key, bytes) for key in counter._cache)
+
+    for text in ("one", "two", "three"):
+        counter.count(text)
+    assert len(counter._cache) == 3
+    counter.count("x" * 90)
+    assert counter._bytes <= 100
+    counter.count("y" * 101)
+    assert counter._bytes <= 100 and len(counter._cache) <= 3
+
+
+def test_token_counter_is_consistent_across_threads():
+    counter = TokenCounter(max_entries=50, max_bytes=2000)
+    texts = [f"word {i} " * (i % 7 + 1) for i in range(200)]
+    errors = []
+
+    def work():
+        try:
+            for text in texts:
+                assert counter.count(text) == approx_tokens(text)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(counter._cache) <= 50
+    assert counter._bytes == sum(size for _, size in counter._cache.values()) <= 2000
+
+
+def test_fit_prompt_leaves_small_prompts_alone(monkeypatch):
+    monkeypatch.setenv(CONTEXT_BUDGET_ENV, "100000")
+    document = _document(5)
+    prompt = f"Summarise this material:\n{document}"
+    sent, stats = fit_prompt(prompt, document, "model")
+    assert sent == prompt
+    assert not stats['packed']
+    assert stats['sent_tokens'] == stats['original_tokens']
+
+
+def test_fit_prompt_packs_large_documents_into_the_budget(monkeypatch):
+    monkeypatch.setenv(CONTEXT_BUDGET_ENV, "1500")
+    document = _document()
+    prompt = f"Summarise the recovery manager material:\n{document}\n\nUse bullet points."
+    sent, stats = fit_prompt(prompt, document, "model", counter=TokenCounter())
+    assert stats['packed']
+    assert stats['original_tokens'] > 1500
+    assert stats['sent_tokens'] <= 1500
+    assert approx_tokens(sent) <= 1500
+    assert sent.startswith("Summarise the recovery manager material:")
+    assert sent.endswith("Use bullet points.")
+    assert stats['kept'] > 0 and stats['dropped'] + stats['summarised'] > 0
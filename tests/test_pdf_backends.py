@@ -0,0 +1,94 @@
+import json
+import time
+
+import pytest
+
+import pdf_backends
+from pdf_backends import (
+    PdfBackend, auto_select_pdf_backend, benchmark_pdf_backends, default_pdf_backend, pick_fastest_backend,
+)
+
+GOOD_PAGE = "Recovery Manager restores datafiles from backup sets and applies archived redo logs. " * 5
+
+
+class ScriptedBackend(PdfBackend):
+    """Ignores the file and returns fixed page texts, optionally slowly or with an error"""
+
+    def __init__(self, name, text=GOOD_PAGE, delay=0.0, error=None):
+        self.name = self.label = name
+        self.text = text
+        self.delay = delay
+        self.error = error
+
+    def iter_page_texts(self, stream):
+        for _ in range(3):
+            if self.error:
+                raise self.error
+            time.sleep(self.delay)
+            yield self.text
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    registry = {
+        backend.name: backend for backend in (
+            ScriptedBackend('slow', delay=0.02),
+            ScriptedBackend('fast'),
+            ScriptedBackend('spaced', text="P a g e  o n e " * 40),
+            ScriptedBackend('broken', error=ValueError("bad xref table")),
+        )
+    }
+    monkeypatch.setattr(pdf_backends, 'PDF_BACKENDS', registry)
+    monkeypatch.setattr(pdf_backends, '_active_backend', None)
+    monkeypatch.delenv(pdf_backends.PDF_BACKEND_ENV, raising=False)
+    return registry
+
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    path = tmp_path / "sample.pdf"
+    path.write_bytes(b"%PDF-1.4 stand-in bytes")
+    return [path]
+
+
+def test_benchmark_checks_output_and_picks_the_fastest_passing_backend(backends, sample_pdf):
+    results = {result['backend']: result for result in benchmark_pdf_backends(sample_pdf)}
+    assert results['fast']['pages'] == 3 and results['fast']['passes']
+    assert results['slow']['passes']
+    assert results['fast']['pages_per_sec'] > results['slow']['pages_per_sec']
+    assert not results['spaced']['passes']
+    assert results['broken']['error'] == "bad xref table" and not results['broken']['passes']
+    assert pick_fastest_backend(results.values()) == 'fast'
+
+
+def test_pick_falls_back_when_backends_are_missing_or_raise(backends, sample_pdf):
+    results = benchmark_pdf_backends(sample_pdf, backends=['broken', 'not-installed'])
+    assert [(result['backend'], result['passes']) for result in results] == [
+        ('broken', False), ('not-installed', False)
+    ]
+    assert results[1]['error'] == "not installed"
+    assert pick_fastest_backend(results) == default_pdf_backend() == 'slow'
+    assert pick_fastest_backend([]) == 'slow'
+
+
+def test_selection_is_saved_and_reused(backends, sample_pdf, tmp_path, monkeypatch):
+    selection = tmp_path / "cache" / "pdf_backend.json"
+    backend, results = auto_select_pdf_backend(sample_pdf, selection)
+    assert backend == 'fast' == pdf_backends.active_pdf_backend()
+    assert json.loads(selection.read_text(encoding='utf-8'))['backend'] == 'fast'
+
+    def no_benchmark(*args, **kwargs):
+        raise AssertionError("benchmark should not run again")
+
+    monkeypatch.setattr(pdf_backends, 'benchmark_pdf_backends', no_benchmark)
+    monkeypatch.setattr(pdf_backends, '_active_backend', None)
+    assert auto_select_pdf_backend(sample_pdf, selection)[0] == 'fast'
+    assert pdf_backends.active_pdf_backend() == 'fast'
+
+
+def test_a_saved_backend_that_is_no_longer_installed_is_benchmarked_again(backends, sample_pdf, tmp_path):
+    selection = tmp_path / "pdf_backend.json"
+    selection.write_text(json.dumps({'backend': 'uninstalled', 'results': []}), encoding='utf-8')
+    backend, results = auto_select_pdf_backend(sample_pdf, selection)
+    assert backend == 'fast' and results
+    assert json.loads(selection.read_text(encoding='utf-8'))['backend'] == 'fast'
@@ -0,0 +1,55 @@
+from llm_backends import FakeBackend
+from practice_test import (
+    merge_questions, parse_questions, plan_shards, practice_test_prompt, shard_question_types,
+    shard_request_size,
+)
+
+
+def _question(text):
+    return {'type': "Short Answer", 'question': text, 'correct_answer': "x"}
+
+
+def test_plan_shards_balances_sizes_under_the_cap():
+    assert plan_shards(0) == []
+    assert plan_shards(7) == [7]
+    assert plan_shards(10) == [10]
+    assert plan_shards(11) == [6, 5]
+    assert plan_shards(50) == [10] * 5
+    assert plan_shards(23, shard_questions=10) == [8, 8, 7]
+    for count in range(1, 80):
+        sizes = plan_shards(count)
+        assert sum(sizes) == count
+        assert max(sizes) <= 10 and max(sizes) - min(sizes) <= 1
+
+
+def test_shards_oversample_and_rotate_types():
+    assert shard_request_size(10, 1) == 10
+    assert shard_request_size(10, 3) == 12
+    types = ["Multiple Choice", "True/False", "Short Answer"]
+    assert shard_question_types(types, 0) == types
+    assert shard_question_types(types, 4) == ["True/False", "Short Answer", "Multiple Choice"]
+
+
+def test_merge_questions_interleaves_drops_duplicates_and_trims():
+    first = [_question("What does RMAN back up?"), _question("Define a checkpoint.")]
+    second = [_question("What does RMAN back up"), _question("Why archive redo logs?")]
+    merged, duplicates = merge_questions([], [first, second], 10)
+    assert [q['question'] for q in merged] == [
+        "What does RMAN back up?", "Define a checkpoint.", "Why archive redo logs?",
+    ]
+    assert duplicates == 1
+
+    kept = [_question("Define a checkpoint")]
+    merged, duplicates = merge_questions(kept, [first], 2)
+    assert [q['question'] for q in merged] == ["Define a checkpoint", "What does RMAN back up?"]
+    assert duplicates == 1
+
+
+def test_parse_questions_reads_complete_blocks_only():
+    prompt = practice_test_prompt(4, ["Multiple Choice", "True/False"], "Medium", "Recovery catalog notes")
+    text = FakeBackend().complete(None, prompt, "m")
+    questions = parse_questions(text)
+    assert len(questions) == 4
+    assert all(q['correct_answer'] for q in questions)
+    assert len(parse_questions(text + "\n==QUESTION START==\nQuestion Type: Short Answer")) == 4
+    assert parse_questions(None) == []
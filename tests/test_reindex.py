@@ -0,0 +1,71 @@
+import os
+
+from corpus import CorpusStore
+from ingest import ExtractionCache
+from reindex import IncrementalIndexer
+
+
+def test_refresh_swaps_in_a_new_corpus_and_leaves_the_old_one_intact(tmp_path):
+    folder = tmp_path / "module"
+    folder.mkdir()
+    (folder / "one.txt").write_text("Checkpoints flush dirty buffers to the datafiles.", encoding='utf-8')
+    indexer = IncrementalIndexer(
+        folder, ExtractionCache(tmp_path / "extract.sqlite3"), CorpusStore(tmp_path / "store.sqlite3"),
+        prefer_fast=False, dedup=False
+    )
+    seen = []
+    indexer.subscribe(lambda corpus, changes: seen.append(corpus))
+    indexer.load(parallel=False)
+    before = indexer.corpus
+    text_before = before.text
+
+    second = folder / "two.txt"
+    second.write_text("Archived redo logs allow point in time recovery.", encoding='utf-8')
+    changes = indexer.refresh()
+
+    assert changes['added'] == [str(second)]
+    assert indexer.corpus is not before
+    assert before.text == text_before and before.file_count == 1
+    assert indexer.corpus.file_count == 2
+    assert seen == [before, indexer.corpus]
+
+
+def _indexer(tmp_path, folder):
+    return IncrementalIndexer(
+        folder, ExtractionCache(tmp_path / "extract.sqlite3"), CorpusStore(tmp_path / "store.sqlite3"),
+        prefer_fast=False, dedup=False
+    )
+
+
+def test_files_that_fail_to_extract_are_retried(tmp_path):
+    folder = tmp_path / "module"
+    folder.mkdir()
+    (folder / "one.txt").write_text("Checkpoints flush dirty buffers to the datafiles.", encoding='utf-8')
+    indexer = _indexer(tmp_path, folder)
+    indexer.load(parallel=False)
+
+    broken = folder / "broken.pdf"
+    broken.write_bytes(b"not really a pdf")
+    errors = []
+    assert indexer.refresh(errors=errors)['added'] == [str(broken)]
+    assert [str(path) for path, _ in errors] == [str(broken)]
+    assert str(broken) not in indexer.store.load_manifest(str(folder))
+
+    errors = []
+    assert indexer.refresh(errors=errors)['added'] == [str(broken)]
+    assert errors
+
+
+def test_touching_a_file_keeps_the_stored_corpus(tmp_path):
+    folder = tmp_path / "module"
+    folder.mkdir()
+    note = folder / "one.txt"
+    note.write_text("Checkpoints flush dirty buffers to the datafiles.", encoding='utf-8')
+    indexer = _indexer(tmp_path, folder)
+    indexer.load(parallel=False)
+
+    stat = note.stat()
+    os.utime(note, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+    assert indexer.refresh() is None
+
+    assert _indexer(tmp_path, folder).load(parallel=False)
@@ -0,0 +1,69 @@
+import os
+import time
+
+import pytest
+
+from responses import ResponseCache, build_prompt, response_key
+
+CONTEXT = "Online redo logs are archived by ARCn so media recovery can roll datafiles forward.\n" * 20
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(time, 'time', clock)
+    return clock
+
+
+def test_prompts_over_the_same_material_share_the_context_prefix():
+    quiz = build_prompt(CONTEXT, "Write 5 multiple choice questions.")
+    notes = build_prompt(CONTEXT, "Write revision notes.")
+    shared = len(os.path.commonprefix([quiz, notes]))
+    assert shared >= quiz.index(CONTEXT) + len(CONTEXT)
+    assert quiz.index(CONTEXT) < quiz.index("Write 5 multiple choice questions.")
+    assert quiz.endswith("Write 5 multiple choice questions.")
+    assert build_prompt(CONTEXT, "x", context_label="Notes").startswith("Notes:\n" + CONTEXT)
+
+
+def test_response_key_covers_model_prompt_and_params():
+    key = response_key("m", "prompt", {'temperature': 0.2})
+    assert key == response_key("m", "prompt", {'temperature': 0.2})
+    assert len({key, response_key("other", "prompt", {'temperature': 0.2}),
+                response_key("m", "prompt!", {'temperature': 0.2}), response_key("m", "prompt")}) == 4
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "responses.sqlite3", ttl=60)
+    cache.put("m", "prompt", "answer")
+    clock.now += 59
+    assert cache.get("m", "prompt") == ("answer", clock.now - 59)
+    clock.now += 2
+    assert cache.get("m", "prompt") is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations'], stats['entries']) == (1, 1, 1, 0)
+
+
+def test_least_recently_used_entries_are_evicted_over_the_byte_budget(tmp_path, clock):
+    answers = {name: os.urandom(500).hex() for name in ("a", "b", "c")}
+    cache = ResponseCache(tmp_path / "responses.sqlite3")
+    cache.put("m", "a", answers["a"])
+    cache.max_bytes = cache.stats()['bytes'] * 2 + 100
+    clock.now += 1
+    cache.put("m", "b", answers["b"])
+    clock.now += 1
+    assert cache.get("m", "a") is not None
+    clock.now += 1
+    cache.put("m", "c", answers["c"])
+
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a")[0] == answers["a"]
+    assert cache.get("m", "c")[0] == answers["c"]
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+from corpus import Corpus
+from retrieval import BM25Index, chunk_corpus, retrieve_context, tokenize
+
+TOPICS = {
+    "backup.pdf": "RMAN backup sets store datafile blocks; incremental backups copy only changed blocks",
+    "redo.pdf": "Online redo logs are archived by ARCn so media recovery can roll datafiles forward",
+    "memory.txt": "The buffer cache and shared pool live in the SGA; the PGA is private to each server process",
+}
+
+
+def _corpus(pages=3, repeat=40):
+    records = []
+    for name, sentence in TOPICS.items():
+        paged = name.endswith(".pdf")
+        for page in range(1, pages + 1):
+            text = " ".join(f"{sentence} (part {page}.{i})." for i in range(repeat)) + "\n"
+            records.append((Path(name), page if paged else None, text))
+    return Corpus.from_records(records)
+
+
+def test_chunks_stay_within_files_and_size():
+    corpus = _corpus()
+    chunks = chunk_corpus(corpus, max_words=100, overlap_words=20)
+    assert len(chunks) > corpus.file_count
+    for chunk_id in range(len(chunks)):
+        start, end = corpus.file_span(chunks.files[chunk_id])
+        assert start <= chunks.starts[chunk_id] < chunks.ends[chunk_id] <= end
+        assert len(chunks.text(chunk_id).split()) <= 100
+    labels = {chunks.label(chunk_id) for chunk_id in range(len(chunks))}
+    assert "backup.pdf, p. 2" in labels and "memory.txt" in labels
+
+
+def test_bm25_ranks_the_matching_file_first():
+    index = BM25Index(chunk_corpus(_corpus()))
+    for query, name in (
+        ("incremental backup changed blocks", "backup.pdf"),
+        ("archived redo media recovery", "redo.pdf"),
+        ("shared pool PGA server process", "memory.txt"),
+    ):
+        ranked = index.search(query, k=3)
+        assert len(ranked) == 3
+        assert [score for _, score in ranked] == sorted((score for _, score in ranked), reverse=True)
+        assert all(index.chunks.label(chunk_id).startswith(name) for chunk_id, _ in ranked)
+    assert index.search("zebra giraffe") == []
+
+
+def test_retrieve_context_respects_the_budget():
+    index = BM25Index(chunk_corpus(_corpus()))
+    context, stats = retrieve_context(index, "redo logs archived", k=6, max_tokens=300)
+    assert stats['chunk_ids'] and len(stats['chunk_ids']) < 6
+    assert stats['tokens'] <= 300 or len(stats['chunk_ids']) == 1
+    assert context.startswith("[Source: redo.pdf")
+    assert stats['chunk_total'] == len(index.chunks)
+
+
+def test_tokenize_keeps_identifiers():
+    assert "v$datafile" in tokenize("SELECT * FROM V$DATAFILE")
+    assert "the" not in tokenize("the control file")
@@ -0,0 +1,131 @@
+import asyncio
+
+import openai
+import pytest
+
+from llm_backends import ReplayMiss
+from routing import (
+    COOLDOWN_SECONDS, DEFAULT_MODEL, MIN_SAMPLES, ModelRouter, fails_over, load_routes, percentile,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_load_routes(tmp_path):
+    assert load_routes("")['summary'] == [DEFAULT_MODEL]
+    routes = load_routes('{"*": ["a", "b"], "chat": "c"}')
+    assert routes['summary'] == ["a", "b"]
+    assert routes['chat'] == ["c"]
+    path = tmp_path / "routes.json"
+    path.write_text('{"questions": ["q1", "q2"]}', encoding='utf-8')
+    assert load_routes(str(path))['questions'] == ["q1", "q2"]
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile(range(1, 11), 50) == 5
+    assert percentile(range(1, 11), 90) == 9
+    assert percentile(range(1, 11), 91) == 10
+    assert percentile(range(1, 21), 95) == 19
+    assert percentile(range(1, 21), 100) == 20
+    assert percentile(range(1, 101), 1) == 1
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([5], 0) == 5
+
+
+def test_only_model_or_transient_errors_fail_over(api_error):
+    assert fails_over(openai.APITimeoutError(request=None))
+    assert fails_over(api_error(openai.RateLimitError, 429))
+    assert fails_over(api_error(openai.InternalServerError, 503))
+    assert fails_over(api_error(openai.NotFoundError, 404))
+    assert not fails_over(api_error(openai.AuthenticationError, 401))
+    assert not fails_over(api_error(openai.BadRequestError, 400))
+    assert not fails_over(ReplayMiss("no recording"))
+    assert not fails_over(TypeError("bug"))
+
+
+def test_call_fails_over_down_the_chain():
+    router = ModelRouter({'chat': ["a", "b", "c"]}, clock=FakeClock())
+    tried = []
+
+    def request(model):
+        tried.append(model)
+        if model == "a":
+            raise openai.APITimeoutError(request=None)
+        return "" if model == "b" else f"from {model}"
+
+    assert router.call('chat', request) == "from c"
+    assert tried == ["a", "b", "c"]
+    with pytest.raises(openai.APITimeoutError):
+        router.call('chat', lambda model: (_ for _ in ()).throw(openai.APITimeoutError(request=None)))
+
+
+def test_other_errors_are_raised_at_once_without_blaming_the_model(api_error):
+    router = ModelRouter({'chat': ["a", "b"]}, clock=FakeClock())
+    tried = []
+
+    def request(model):
+        tried.append(model)
+        raise api_error(openai.AuthenticationError, 401)
+
+    with pytest.raises(openai.AuthenticationError):
+        router.call('chat', request)
+    assert tried == ["a"]
+    assert router.stats() == []
+
+
+def test_degraded_model_goes_last_until_cooldown():
+    clock = FakeClock()
+    router = ModelRouter({'chat': ["a", "b"]}, clock=clock)
+    for _ in range(3):
+        router.record('chat', "a", 1.0, False)
+    assert router.order('chat') == ["b", "a"]
+    clock.now += COOLDOWN_SECONDS + 1
+    assert router.order('chat') == ["a", "b"]
+
+
+def test_much_slower_model_goes_after_faster_ones():
+    router = ModelRouter({'chat': ["slow", "fast"]}, clock=FakeClock())
+    for _ in range(MIN_SAMPLES):
+        router.record('chat', "slow", 10.0, True)
+        router.record('chat', "fast", 1.0, True)
+    assert router.order('chat') == ["fast", "slow"]
+    assert {row['model']: row['p50_seconds'] for row in router.stats()} == {"slow": 10.0, "fast": 1.0}
+
+
+def test_stream_fails_over_only_before_the_first_piece():
+    router = ModelRouter({'chat': ["a", "b"]}, clock=FakeClock())
+
+    def request(model):
+        if model == "a":
+            raise openai.APITimeoutError(request=None)
+        yield "one"
+        yield "two"
+
+    assert list(router.stream('chat', request)) == ["one", "two"]
+
+    def breaks_midway(model):
+        yield f"{model} starts"
+        raise RuntimeError("connection lost")
+
+    pieces = []
+    with pytest.raises(RuntimeError):
+        for piece in router.stream('chat', breaks_midway):
+            pieces.append(piece)
+    assert pieces == ["a starts"]
+
+
+def test_acall_fails_over():
+    router = ModelRouter({'chat': ["a", "b"]}, clock=FakeClock())
+
+    async def request(model):
+        if model == "a":
+            raise openai.APIConnectionError(request=None)
+        return f"from {model}"
+
+    assert asyncio.run(router.acall('chat', request)) == "from b"
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_backends import FakeBackend
+from scheduler import AcquireCancelled, LlmScheduler, ScheduledLlm, TokenBucket
+from study_pack import PackTask, run_tasks
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_paces():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=clock)
+    for _ in range(2):
+        assert bucket.delay() == 0
+        bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.delay() == 0
+
+
+def test_sessions_take_turns():
+    scheduler = LlmScheduler(rate_per_minute=6000, burst=100, max_concurrency=1)
+    holder = scheduler.acquire('holder')
+    order = []
+    lock = threading.Lock()
+
+    def request(session):
+        started = scheduler.acquire(session)
+        with lock:
+            order.append(session)
+        scheduler.release(started)
+
+    threads = [threading.Thread(target=request, args=('greedy',)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    late = threading.Thread(target=request, args=('late',))
+    late.start()
+    time.sleep(0.05)
+    scheduler.release(holder)
+    for thread in threads + [late]:
+        thread.join(5)
+    # The late session waits behind at most one greedy request
+    assert order.index('late') <= 1
+    assert scheduler.stats()['active'] == 0
+
+
+def test_cancelled_acquire_leaves_queue():
+    scheduler = LlmScheduler(rate_per_minute=6000, burst=100, max_concurrency=1)
+    holder = scheduler.acquire('a')
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(AcquireCancelled):
+        scheduler.acquire('b', cancelled=cancelled)
+    assert scheduler.stats()['waiting'] == 0
+    scheduler.release(holder)
+
+
+def test_cancelled_async_request_does_not_leak_a_slot():
+    scheduler = LlmScheduler(rate_per_minute=6000, burst=100, max_concurrency=1)
+    llm = ScheduledLlm(FakeBackend(latency=0.0), scheduler, 'session')
+    holder = scheduler.acquire('other')
+
+    async def main():
+        task = asyncio.ensure_future(llm.acomplete(None, "prompt", "model"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    scheduler.release(holder)
+    time.sleep(0.7)
+    stats = scheduler.stats()
+    assert stats['active'] == 0
+    assert stats['waiting'] == 0
+
+
+def test_cancelled_study_pack_releases_every_slot():
+    scheduler = LlmScheduler(rate_per_minute=6000, burst=100, max_concurrency=2)
+    llm = ScheduledLlm(FakeBackend(latency=0.3), scheduler, 'session')
+    tasks = [PackTask(f"t{index}", f"T{index}", f"prompt {index}") for index in range(4)]
+
+    async def complete(key, prompt):
+        return await llm.acomplete(None, prompt, "model")
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(run_tasks(tasks, complete, concurrency=4), 0.1)
+
+    asyncio.run(main())
+    time.sleep(0.7)
+    assert scheduler.stats()['active'] == 0
+    assert all(task.status == 'cancelled' for task in tasks)
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import CoalescedLlm, Singleflight, flight_key
+
+
+class SlowLlm:
+    """Counts calls; each one waits until released"""
+
+    requires_api_key = True
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def complete(self, api_key, prompt, model):
+        with self._lock:
+            self.calls += 1
+        assert self.release.wait(5)
+        return f"{model}:{api_key}:{prompt.strip()}"
+
+    def stream(self, api_key, prompt, model):
+        yield from self.complete(api_key, prompt, model).split(":")
+
+    def async_client(self, api_key):
+        return api_key
+
+    async def acomplete(self, client, prompt, model):
+        return await asyncio.to_thread(self.complete, client, prompt, model)
+
+    def stats(self):
+        return {}
+
+
+def _concurrently(calls):
+    results = [None] * len(calls)
+
+    def run(index):
+        results[index] = calls[index]()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_flight_key_ignores_whitespace_but_not_model_or_credentials():
+    assert flight_key("m", "a  b\n", "key") == flight_key("m", " a b", "key")
+    assert flight_key("m", "a b", "key") != flight_key("other", "a b", "key")
+    assert flight_key("m", "a b", "key") != flight_key("m", "a b", "other key")
+    assert "key" not in repr(flight_key("m", "a b", "key"))
+
+
+def test_identical_requests_share_one_call():
+    llm = SlowLlm()
+    flights = Singleflight()
+    coalesced = CoalescedLlm(llm, flights)
+    threads, results = _concurrently([lambda: coalesced.complete("key", "same prompt", "m")] * 4)
+    # Let every caller join the leader's flight before it returns
+    time.sleep(0.2)
+    llm.release.set()
+    for thread in threads:
+        thread.join()
+    assert llm.calls == 1
+    assert results == ["m:key:same prompt"] * 4
+    assert flights.stats()['coalesced'] == 3
+
+
+def test_different_api_keys_are_not_coalesced():
+    llm = SlowLlm()
+    coalesced = CoalescedLlm(llm, Singleflight())
+    threads, results = _concurrently([
+        lambda: coalesced.complete("key one", "same prompt", "m"),
+        lambda: coalesced.complete("key two", "same prompt", "m"),
+    ])
+    llm.release.set()
+    for thread in threads:
+        thread.join()
+    assert llm.calls == 2
+    assert results == ["m:key one:same prompt", "m:key two:same prompt"]
+
+
+def test_errors_reach_every_waiting_caller():
+    flights = Singleflight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flights.do("key", "prompt", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    time.sleep(0.2)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_async_callers_coalesce():
+    llm = SlowLlm()
+    llm.release.set()
+    coalesced = CoalescedLlm(llm, Singleflight())
+
+    async def main():
+        return await asyncio.gather(*(coalesced.acomplete("key", "same prompt", "m") for _ in range(3)))
+
+    assert asyncio.run(main()) == ["m:key:same prompt"] * 3
+    assert llm.calls == 1
+
+
+def test_abandoned_leader_hands_over_to_a_follower():
+    flights = Singleflight()
+
+    async def main():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        async def fast():
+            return "answer"
+
+        leader = asyncio.create_task(flights.ado("key", "prompt", slow))
+        await started.wait()
+        follower = asyncio.create_task(flights.ado("key", "prompt", fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(follower, 5)
+
+    assert asyncio.run(main()) == "answer"
+    assert flights.stats()['in_flight'] == 0
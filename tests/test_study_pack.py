@@ -0,0 +1,40 @@
+import asyncio
+from collections import Counter
+
+from study_pack import PackTask, run_tasks
+
+
+def test_run_tasks_respects_the_concurrency_limit_and_reports_each_task_once():
+    tasks = [PackTask(f"task{i}", f"Task {i}", prompt=f"prompt {i}") for i in range(7)]
+    tasks.append(PackTask("prepared", "Prepared", prepare=lambda: "prepared prompt"))
+    tasks.append(PackTask("broken", "Broken", prompt="boom"))
+    tasks.append(PackTask("empty", "Empty", prompt="nothing"))
+    in_flight = 0
+    peak = 0
+    updates = []
+
+    async def complete(key, prompt):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if prompt == "boom":
+                raise RuntimeError("model unavailable")
+            return "" if prompt == "nothing" else f"answer to {prompt}"
+        finally:
+            in_flight -= 1
+
+    asyncio.run(run_tasks(tasks, complete, concurrency=3,
+                          on_update=lambda task: updates.append((task.key, task.status))))
+
+    assert peak == 3
+    finished = Counter(key for key, status in updates if status in ('done', 'failed'))
+    assert finished == Counter(task.key for task in tasks)
+    assert all(count == 1 for count in finished.values())
+    assert {task.key: task.status for task in tasks if task.status != 'done'} == {
+        "broken": 'failed', "empty": 'failed'
+    }
+    assert tasks[7].result == "answer to prepared prompt"
+    assert tasks[8].error == "model unavailable"
+    assert all(task.latency is not None for task in tasks)
@@ -0,0 +1,97 @@
+from pathlib import Path
+
+from corpus import Corpus
+from llm_backends import FakeBackend
+from packing import count_tokens
+from summarize import (
+    COMBINE_PROMPT, SummaryCache, collapse_summaries, format_partials, map_summaries, summary_units,
+)
+
+TOPICS = ["backup sets", "redo logs", "undo retention", "flashback query", "buffer cache", "data guard"]
+MODEL = "fake-model"
+
+
+class CountingBackend(FakeBackend):
+    def __init__(self, fail_on=None):
+        super().__init__(latency=0.0)
+        self.prompts = []
+        self.fail_on = fail_on
+
+    def complete(self, api_key, prompt, model):
+        self.prompts.append(prompt)
+        if self.fail_on and self.fail_on in prompt:
+            raise RuntimeError("upstream error")
+        return super().complete(api_key, prompt, model)
+
+
+def _corpus():
+    return Corpus.from_records([
+        (Path(f"{topic.replace(' ', '_')}.pdf"), page,
+         " ".join(f"Page {page} sentence {i} explains {topic} in detail." for i in range(30)) + "\n")
+        for topic in TOPICS for page in (1, 2)
+    ])
+
+
+def _summarise(backend, cache, depth):
+    """Map, collapse and reduce the way the app does; depth only reaches the reduce prompt"""
+    def complete(prompt):
+        return backend.complete(None, prompt, MODEL)
+
+    units = summary_units(_corpus(), max_tokens=1200)
+    partials, stats = map_summaries(units, complete, cache, MODEL, max_workers=2)
+    labels, partials = collapse_summaries([label for label, _ in units], partials, complete, cache, MODEL,
+                                          max_tokens=1000)
+    partials_text = format_partials(labels, partials)
+    summary = complete(f"Write a {depth} summary of these section summaries:\n{partials_text}")
+    return summary, stats, labels, partials_text
+
+
+def test_map_step_summarises_every_unit_in_order(tmp_path):
+    backend = CountingBackend()
+    units = summary_units(_corpus(), max_tokens=1200)
+    assert len(units) == len(TOPICS)
+    partials, stats = map_summaries(
+        units, lambda prompt: backend.complete(None, prompt, MODEL), SummaryCache(tmp_path / "s.sqlite3"), MODEL
+    )
+    assert stats == {'units': len(units), 'cached': 0, 'generated': len(units), 'failed': 0, 'errors': []}
+    assert all(partial for partial in partials)
+    for (label, text), partial in zip(units, partials):
+        prompt = next(prompt for prompt in backend.prompts if f"Section: {label}\n" in prompt)
+        assert partial == FakeBackend(latency=0.0).complete(None, prompt, MODEL)
+
+
+def test_collapse_merges_partials_until_they_fit_the_budget(tmp_path):
+    backend = CountingBackend()
+    _, _, labels, partials_text = _summarise(backend, SummaryCache(tmp_path / "s.sqlite3"), "brief")
+    assert count_tokens(partials_text) <= 1000
+    assert 1 <= len(labels) < len(TOPICS)
+    assert labels[0].startswith("backup_sets.pdf … ")
+    assert any(COMBINE_PROMPT.split("\n")[0] in prompt for prompt in backend.prompts)
+
+
+def test_changing_depth_reruns_only_the_reduce_step(tmp_path):
+    cache = SummaryCache(tmp_path / "s.sqlite3")
+    first = CountingBackend()
+    _summarise(first, cache, "brief")
+    assert len(first.prompts) > 2
+
+    second = CountingBackend()
+    summary, stats, _, _ = _summarise(second, cache, "detailed")
+    assert summary
+    assert stats['cached'] == len(TOPICS) and stats['generated'] == 0
+    assert len(second.prompts) == 1
+    assert second.prompts[0].startswith("Write a detailed summary")
+
+
+def test_failed_units_are_reported_and_not_cached(tmp_path):
+    cache = SummaryCache(tmp_path / "s.sqlite3")
+    units = summary_units(_corpus(), max_tokens=1200)
+    failing = CountingBackend(fail_on="Section: redo_logs.pdf")
+    partials, stats = map_summaries(units, lambda prompt: failing.complete(None, prompt, MODEL), cache, MODEL)
+    assert stats['failed'] == 1 and stats['errors'] == ["redo_logs.pdf: upstream error"]
+    assert partials[1] is None and all(partials[:1] + partials[2:])
+
+    retry = CountingBackend()
+    partials, stats = map_summaries(units, lambda prompt: retry.complete(None, prompt, MODEL), cache, MODEL)
+    assert (stats['cached'], stats['generated'], stats['failed']) == (len(TOPICS) - 1, 1, 0)
+    assert len(retry.prompts) == 1 and "Section: redo_logs.pdf" in retry.prompts[0]
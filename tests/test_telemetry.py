@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from telemetry import TelemetryLog, note
+
+
+@pytest.fixture
+def log(tmp_path):
+    return TelemetryLog(tmp_path / "telemetry.sqlite3")
+
+
+def test_track_records_outcome_and_notes(log):
+    def call():
+        note(retries=2, queue_seconds=0.5)
+        return "an answer"
+
+    assert log.track('summary', 'm', "a prompt", call, session='s') == "an answer"
+    with pytest.raises(RuntimeError):
+        log.track('summary', 'm', "a prompt", lambda: (_ for _ in ()).throw(RuntimeError("down")))
+    ok, failed = log.rows()
+    assert (ok['status'], ok['retries'], ok['queue_seconds'], ok['session']) == ('ok', 2, 0.5, 's')
+    assert ok['completion_tokens'] > 0
+    assert failed['status'] == 'error' and "RuntimeError: down" in failed['error']
+
+
+def test_finished_stream_records_ttft(log):
+    pieces = list(log.track_stream('chat', 'm', "prompt", lambda: iter(["a", "b", "c"])))
+    assert pieces == ["a", "b", "c"]
+    (row,) = log.rows()
+    assert row['status'] == 'ok'
+    assert row['ttft_seconds'] is not None
+
+
+def test_abandoned_stream_is_recorded(log):
+    closed = []
+
+    def stream():
+        try:
+            yield "first"
+            yield "second"
+        finally:
+            closed.append(True)
+
+    tracked = log.track_stream('chat', 'm', "prompt", stream)
+    assert next(tracked) == "first"
+    tracked.close()
+    (row,) = log.rows()
+    assert row['status'] == 'abandoned'
+    assert closed == [True]
+
+
+def test_cancelled_async_call_is_recorded(log):
+    async def main():
+        task = asyncio.create_task(log.atrack('questions', 'm', "prompt", lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    (row,) = log.rows()
+    assert row['status'] == 'abandoned'
+
+
+def test_summary_separates_cache_hits_errors_and_abandoned(log):
+    log.track('summary', 'm', "prompt", lambda: "answer")
+    log.track('summary', 'm', "prompt", lambda: "")
+    log.record_cache_hit('summary', 'm', "prompt", "answer")
+    stream = log.track_stream('summary', 'm', "prompt", lambda: iter(["a", "b"]))
+    next(stream)
+    stream.close()
+    (summary,) = log.summary()
+    assert summary['calls'] == 4
+    assert summary['sent'] == 3
+    assert summary['cache_hit_rate'] == pytest.approx(0.25)
+    assert summary['error_rate'] == pytest.approx(1 / 3)
+    assert summary['abandoned'] == 1
+    assert summary['wall_p50'] is not None
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from corpus import Corpus
+from vectors import TfidfIndex, load_or_build_vector_index, retrieve_context_batch
+
+TOPICS = {
+    "backup.pdf": "RMAN backup sets store datafile blocks; incremental backups copy only changed blocks",
+    "redo.pdf": "Online redo logs are archived by ARCn so media recovery can roll datafiles forward",
+    "memory.txt": "The buffer cache and shared pool live in the SGA; the PGA is private to each server process",
+}
+
+
+def _corpus():
+    return Corpus.from_records([
+        (Path(name), None, " ".join(f"{sentence} (part {i})." for i in range(60)) + "\n")
+        for name, sentence in TOPICS.items()
+    ])
+
+
+@pytest.fixture(scope='module')
+def index():
+    return TfidfIndex.build(_corpus())
+
+
+def test_scores_are_cosines(index):
+    scores = index.scores(["incremental backups", "zzzz qqqq"])
+    assert scores.shape == (2, len(index.chunks))
+    assert 0 < scores[0].max() <= 1.0 + 1e-5
+    assert not scores[1].any()
+
+
+def test_query_ranks_the_matching_file_first(index):
+    rankings = index.query(["incremental backups changed blocks", "buffer cache shared pool"], k=2)
+    for ranking, name in zip(rankings, ("backup.pdf", "memory.txt")):
+        assert ranking
+        assert index.chunks.label(ranking[0][0]) == name
+    assert index.chunks.label(index.search("archived redo logs")[0][0]) == "redo.pdf"
+
+
+def test_batch_retrieval_covers_every_query(index):
+    context, stats = retrieve_context_batch(index, ["incremental backups", "archived redo logs"], k=2, max_tokens=5000)
+    assert "backup.pdf" in context and "redo.pdf" in context
+    assert stats['chunk_total'] == len(index.chunks)
+
+
+def test_saved_index_is_memory_mapped_and_matches(tmp_path):
+    corpus = _corpus()
+    built = load_or_build_vector_index("module", corpus, base=tmp_path)
+    loaded = load_or_build_vector_index("module", corpus, base=tmp_path)
+    assert isinstance(loaded.data, np.memmap)
+    query = ["media recovery rolls datafiles forward"]
+    assert np.allclose(built.scores(query), loaded.scores(query))
+    assert TfidfIndex.load(tmp_path / "missing", corpus, corpus.digest()) is None
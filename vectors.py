@@ -0,0 +1,250 @@
+"""Persisted TF-IDF vector index (word + character n-grams) over corpus chunks"""
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import time
+import zlib
+
+import numpy as np
+
+from ingest import CACHE_DIR
+from retrieval import (
+    Chunks, chunk_corpus, format_passages, select_within_budget, tokenize,
+    DEFAULT_CONTEXT_TOKENS, DEFAULT_TOP_K
+)
+
+VECTOR_DIR = CACHE_DIR / "vectors"
+WORD_FEATURES = 1 << 18
+CHAR_FEATURES = 1 << 18
+CHAR_NGRAMS = (3, 4, 5)
+MAX_INDEXES_PER_FOLDER = 4
+INDEX_VERSION = 1
+
+_SPACE_RE = re.compile(r'\s+')
+_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+_CHUNK_ARRAYS = ('starts', 'ends', 'files', 'pages')
+_MATRIX_ARRAYS = ('indptr', 'indices', 'data', 'idf')
+
+
+def word_features(text):
+    """Hashed word unigram and bigram ids in [0, WORD_FEATURES)"""
+    tokens = tokenize(text)
+    terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return np.fromiter(
+        (zlib.crc32(term.encode()) % WORD_FEATURES for term in terms), dtype=np.int64, count=len(terms)
+    )
+
+
+def char_features(text):
+    """Hashed character 3-5 gram ids in [WORD_FEATURES, WORD_FEATURES + CHAR_FEATURES).
+
+    The text is lowercased and whitespace-collapsed first; the rolling hash
+    runs over the UTF-8 bytes in NumPy, so long chunks cost a few array ops.
+    """
+    normalized = " " + _SPACE_RE.sub(" ", text.lower()).strip() + " "
+    data = np.frombuffer(normalized.encode('utf-8', 'ignore'), dtype=np.uint8).astype(np.uint64)
+    ids = []
+    for n in CHAR_NGRAMS:
+        if len(data) < n:
+            continue
+        hashes = np.full(len(data) - n + 1, n, dtype=np.uint64)
+        for offset in range(n):
+            hashes = hashes * _HASH_MULTIPLIER + data[offset:len(data) - n + 1 + offset]
+        ids.append((hashes % np.uint64(CHAR_FEATURES)).astype(np.int64) + WORD_FEATURES)
+    return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+
+
+def _term_counts(text):
+    """(word ids, word counts, char ids, char counts) for one piece of text"""
+    word_ids, word_counts = np.unique(word_features(text), return_counts=True)
+    char_ids, char_counts = np.unique(char_features(text), return_counts=True)
+    return word_ids, word_counts, char_ids, char_counts
+
+
+def _weigh(ids, counts, idf):
+    """Sublinear tf * idf, L2-normalised and scaled so the word and char halves weigh equally"""
+    if not len(ids):
+        return np.empty(0, dtype=np.float32)
+    weights = (1.0 + np.log(counts)) * idf[ids]
+    norm = float(np.sqrt(np.dot(weights, weights)))
+    if not norm:
+        return np.zeros(len(ids), dtype=np.float32)
+    return (weights / (norm * math.sqrt(2.0))).astype(np.float32)
+
+
+class TfidfIndex:
+    """Chunk vectors as a term-major sparse matrix (CSC: one column of chunks per feature).
+
+    indptr/indices/data follow the usual compressed sparse layout, so a
+    query only touches the columns of its own features. Chunk and matrix
+    arrays are saved as .npy files and memory-mapped back by load().
+    Cosine scores are 0.5 * word-level cosine + 0.5 * char-level cosine.
+    """
+
+    def __init__(self, chunks, indptr, indices, data, idf, build_seconds=0.0):
+        self.chunks = chunks
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.idf = idf
+        self.build_seconds = build_seconds
+
+    @classmethod
+    def build(cls, corpus, chunks=None):
+        started = time.perf_counter()
+        chunks = chunks if chunks is not None else chunk_corpus(corpus)
+        count = len(chunks)
+        per_chunk = [_term_counts(chunks.text(chunk_id)) for chunk_id in range(count)]
+
+        df = np.zeros(WORD_FEATURES + CHAR_FEATURES, dtype=np.int32)
+        for word_ids, _, char_ids, _ in per_chunk:
+            df[word_ids] += 1
+            df[char_ids] += 1
+        idf = (np.log((1.0 + count) / (1.0 + df)) + 1.0).astype(np.float32)
+
+        rows, cols, values = [], [], []
+        for chunk_id, (word_ids, word_counts, char_ids, char_counts) in enumerate(per_chunk):
+            for ids, counts in ((word_ids, word_counts), (char_ids, char_counts)):
+                rows.append(np.full(len(ids), chunk_id, dtype=np.int32))
+                cols.append(ids)
+                values.append(_weigh(ids, counts, idf))
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+        values = np.concatenate(values) if values else np.empty(0, dtype=np.float32)
+
+        order = np.argsort(cols, kind='stable')
+        indptr = np.zeros(len(idf) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=len(idf)), out=indptr[1:])
+        return cls(chunks, indptr, rows[order], values[order], idf, time.perf_counter() - started)
+
+    def query_vector(self, text):
+        """(feature ids, weights) of a query, weighted like the chunks"""
+        word_ids, word_counts, char_ids, char_counts = _term_counts(text)
+        ids = np.concatenate([word_ids, char_ids])
+        weights = np.concatenate([_weigh(word_ids, word_counts, self.idf), _weigh(char_ids, char_counts, self.idf)])
+        return ids, weights
+
+    def scores(self, queries):
+        """Dense (len(queries), chunk count) matrix of cosine similarities"""
+        result = np.zeros((len(queries), len(self.chunks)), dtype=np.float32)
+        for row, query in enumerate(queries):
+            ids, weights = self.query_vector(query)
+            starts = self.indptr[ids]
+            lengths = self.indptr[ids + 1] - starts
+            keep = lengths > 0
+            if not keep.any():
+                continue
+            starts, lengths, weights = starts[keep], lengths[keep], weights[keep]
+            # Gather every (chunk, weight) entry of the query's columns in one go
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            np.add.at(result[row], self.indices[positions], self.data[positions] * np.repeat(weights, lengths))
+        return result
+
+    def query(self, queries, k=DEFAULT_TOP_K):
+        """Top-k (chunk_id, score) pairs per query, best first"""
+        scores = self.scores(queries)
+        results = []
+        for row in scores:
+            if not len(row):
+                results.append([])
+                continue
+            top = np.argpartition(-row, min(k, len(row)) - 1)[:k]
+            top = top[np.argsort(-row[top], kind='stable')]
+            results.append([(int(chunk_id), float(row[chunk_id])) for chunk_id in top if row[chunk_id] > 0])
+        return results
+
+    def search(self, query, k=DEFAULT_TOP_K):
+        """Single-query form of query(), interchangeable with BM25Index.search"""
+        return self.query([query], k)[0]
+
+    def save(self, path, corpus_digest):
+        path.mkdir(parents=True, exist_ok=True)
+        for name in _CHUNK_ARRAYS:
+            np.save(path / f"chunk_{name}.npy", np.asarray(getattr(self.chunks, name)))
+        for name in _MATRIX_ARRAYS:
+            np.save(path / f"{name}.npy", getattr(self, name))
+        meta = {
+            'version': INDEX_VERSION,
+            'corpus_digest': corpus_digest,
+            'chunks': len(self.chunks),
+            'features': len(self.idf),
+            'build_seconds': self.build_seconds,
+            'saved_at': time.time(),
+        }
+        with open(path / "meta.json", 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path, corpus, corpus_digest):
+        """Memory-map a saved index; None if missing or built from different text"""
+        try:
+            with open(path / "meta.json", 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != INDEX_VERSION or meta.get('corpus_digest') != corpus_digest:
+                return None
+            chunks = Chunks(corpus)
+            for name in _CHUNK_ARRAYS:
+                setattr(chunks, name, np.load(path / f"chunk_{name}.npy", mmap_mode='r'))
+            arrays = {name: np.load(path / f"{name}.npy", mmap_mode='r') for name in _MATRIX_ARRAYS}
+        except (OSError, ValueError):
+            return None
+        return cls(chunks, build_seconds=meta.get('build_seconds', 0.0), **arrays)
+
+
+def folder_index_dir(folder, base=VECTOR_DIR):
+    return base / hashlib.sha1(str(folder).encode()).hexdigest()[:16]
+
+
+def _prune(folder_dir, keep):
+    """Remove all but the `keep` most recently used indexes of a folder"""
+    indexes = sorted(
+        (p for p in folder_dir.iterdir() if p.is_dir()),
+        key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    for stale in indexes[keep:]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def load_or_build_vector_index(folder, corpus, base=VECTOR_DIR, keep=MAX_INDEXES_PER_FOLDER):
+    """The folder's saved index for this corpus text, building and saving it if needed.
+
+    Each folder keeps its `keep` most recent indexes (e.g. all files plus a
+    few single files), keyed by the corpus content hash.
+    """
+    digest = corpus.digest()
+    folder_dir = folder_index_dir(folder, base)
+    path = folder_dir / digest[:16]
+    index = TfidfIndex.load(path, corpus, digest)
+    if index is not None:
+        os.utime(path)
+        return index
+    index = TfidfIndex.build(corpus)
+    index.save(path, digest)
+    _prune(folder_dir, keep)
+    return index
+
+
+def retrieve_context_batch(index, queries, k=DEFAULT_TOP_K, max_tokens=DEFAULT_CONTEXT_TOKENS):
+    """Like retrieval.retrieve_context, for several queries scored in one batch.
+
+    Each chunk is ranked by its best score over the queries; the stats
+    have the same keys as retrieve_context's.
+    """
+    started = time.perf_counter()
+    best = {}
+    for ranking in index.query(queries, k=k):
+        for chunk_id, score in ranking:
+            best[chunk_id] = max(score, best.get(chunk_id, 0.0))
+    ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+    selected, tokens = select_within_budget(index.chunks, ranked, max_tokens)
+    context = format_passages(index.chunks, selected)
+    return context, {
+        'chunk_ids': selected,
+        'chunk_total': len(index.chunks),
+        'sources': [index.chunks.label(chunk_id) for chunk_id in selected],
+        'tokens': tokens,
+        'latency_ms': (time.perf_counter() - started) * 1000,
+    }